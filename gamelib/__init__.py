@@ -2,7 +2,8 @@
 The gamelib package contains modules that assist in algo creation \n
 
 The GameState class in game_state.py is the main class most players interact with. 
-It contains functions that let you get information about resources, deploy units, and help you strategize your move. \n
+It contains functions that let you get information about resources, deploy units, and help you strategize your move. 
+to_bytes and from_bytes encode it compactly, for handing it to other processes or caching it. \n
 
 The GameMap class in game_map.py represents the current game map. It can be used to access information related to the locations of units. 
 Investigating it is useful for any player that wants to access more information about the current state of the game. \n
@@ -13,17 +14,56 @@ Investigating it is useful for any player that wants to access information about
 The AlgoCore class in algocore.py handles communication with the game engine, and forms the bones of an algo. AlgoStrategy inherits from it. 
 Investigating it is useful for advanced players interested in getting data from the action phase or communicating directly with the game engine. \n
 
+The AsyncAlgoCore class in async_algocore.py is an alternative to AlgoCore that runs on_turn as an asyncio task with a deadline. \n
+
 The Navigation class in navigation.py contains functions related to path-finding, which are used by GameState in pathing related functions. 
-Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. \n 
+Investigating it is useful for advanced player who want to optimize the slow default pathing algorithm we provide. 
+FieldPathFinder is a faster path finder that gives the same paths by caching distance fields between queries. \n 
+
+The ActionPhaseSimulator class in simulator.py steps the action phase frame by frame on a local copy of the board, 
+so candidate attacks can be compared before they are deployed. 
+BatchSimulator in batch_simulator.py runs many such simulations in lockstep with NumPy, which it requires. 
+validation.py checks the simulator against recorded action phases and measures its speed. \n
+
+replay.py records every message of a game to a compressed replay file when AlgoCore.start is given a record path. 
+driver.py plays a recorded game through a strategy offline to measure its turn latency. 
+corpus.py converts many recorded games into memory-mapped NumPy arrays for fast offline analysis, 
+and query.py indexes them to find turns by breach location, structure layout or attack outcome. 
+local_game.py models the engine's turn loop headlessly, and mock_engine.py uses it to play a strategy as a subprocess over stdin and stdout, 
+enforcing the turn time limit and measuring round trip latency. 
+tournament.py plays strategy files against each other in LocalGames across worker processes and reports win rates and turn times. \n
+
+The Parameter class in parameters.py declares the tunable constants of a strategy in its PARAMETERS, 
+and sweep.py searches grids or random samples of their values with matches or recorded positions. \n
+
+telemetry.py times the hot paths of gamelib, marked with its instrumented decorator, and custom spans and counters, 
+and writes a JSON line per turn when the GAMELIB_TELEMETRY environment variable is set. It costs nothing while disabled. 
+With GAMELIB_TRACE it also writes a Chrome trace of every span, for viewing the timeline of a game in Perfetto. 
+profiler.py samples the stack during on_turn when GAMELIB_PROFILE is set, and writes collapsed stacks for flamegraph tools. \n
+memory.py reports allocation sites, growth and peak memory per turn with tracemalloc when GAMELIB_MEMORY is set. 
+benchmark.py times the hot paths of gamelib on synthetic and recorded boards and compares the timings with a baseline, 
+and with --strategies measures the wall time and allocations of whole strategy turns on recorded turn states. 
+fuzz.py checks faster pathing and targeting against find_path_to_edge, get_target and get_attackers on random boards, and shrinks boards where they differ. \n
+
+cache.py is a registry of named caches with LRU, per-turn or per-board eviction, hit and miss counters, and one shared memory budget. 
+AlgoCore empties them when a game starts. \n
+
+workers.py keeps a pool of worker processes for a whole game, publishes the board to them in shared memory every turn, 
+and gathers evaluations like paths, simulations and placement scores from them before a deadline. It requires NumPy. \n
+
+The TurnBudget class in budget.py tracks the time left in a turn, and PlanningStages runs expensive planning steps in priority order within it. \n
 
 util.py contains a small handful of functions that help with communication, including the debug-printing function, debug_write().
 """
 
 from .algocore import AlgoCore
+from .async_algocore import AsyncAlgoCore
 from .util import debug_write
 from .game_state import GameState
 from .unit import GameUnit
 from .game_map import GameMap
+from .budget import TurnBudget, PlanningStages
+from .parameters import Parameter
 
-__all__ = ["algocore", "game_state", "game_map", "navigation", "unit", "util"]
+__all__ = ["algocore", "async_algocore", "benchmark", "budget", "cache", "driver", "fuzz", "game_state", "game_map", "local_game", "memory", "mock_engine", "navigation", "parameters", "profiler", "replay", "simulator", "sweep", "telemetry", "tournament", "validation", "unit", "util"]
  
\ No newline at end of file
@@ -1,7 +1,137 @@
+import os
+import re
 import json
+import time
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .game_state import GameState
-from .util import get_command, debug_write, BANNER_TEXT, send_command
+from .budget import TurnTimer, PlanningStages, default_turn_limit, parse_player_time
+from .util import get_command_bytes, debug_write, flush_debug, BANNER_TEXT, send_turn, StdinReader, set_recorder
+from .replay import ReplayRecorder
+from .parameters import resolve_parameters, environment_parameters
+from . import cache
+from . import telemetry
+from .profiler import profiler_from_environment
+from .memory import memory_monitor_from_environment
+
+MOBILE_UNIT_INDICES = (3, 4, 5)
+RECORD_ENV = "GAMELIB_RECORD"
+
+def parse_turn_type(message):
+    """Reads the message type from an engine message without parsing the whole message
+
+    Args:
+        message: The raw engine message as bytes
+
+    Returns:
+        0 for a turn, 1 for an action frame, 2 for the end of the game, None if the message has no turnInfo
+
+    """
+    start = message.find(b'"turnInfo"')
+    if start == -1:
+        return None
+    start = message.find(b"[", start) + 1
+    end = message.find(b",", start)
+    try:
+        return int(message[start:end])
+    except ValueError:
+        return int(json.loads(message).get("turnInfo")[0])
+
+def parse_turn_number(message):
+    """Reads the turn number from an engine message without parsing the whole message
+
+    Args:
+        message: The raw engine message as bytes
+
+    Returns:
+        The turn number, or None if the message has no turnInfo
+
+    """
+    start = message.find(b'"turnInfo"')
+    if start == -1:
+        return None
+    start = message.find(b",", start) + 1
+    end = message.find(b",", start)
+    try:
+        return int(message[start:end])
+    except ValueError:
+        return int(json.loads(message).get("turnInfo")[1])
+
+def frame_is_settled(state):
+    """Checks if the board in an action frame can no longer change this action phase
+
+    Args:
+        state: A parsed action frame
+
+    Returns:
+        True if neither player has mobile units on the board and none were spawned this frame
+
+    """
+    for units in (state["p1Units"], state["p2Units"]):
+        for index in MOBILE_UNIT_INDICES:
+            if index < len(units) and units[index]:
+                return False
+    return not state.get("events", {}).get("spawn")
+
+# A list of units of one type, each unit a flat list like [x, y, health, "id"]
+_UNIT_LIST = rb'\[[^\[\]]*(?:\[[^\[\]]*\][^\[\]]*)*\]'
+# Skips the unit lists of the types before the mobile ones and captures the mobile ones
+_MOBILE_LISTS = re.compile(rb'\s*:\s*\[\s*' + (_UNIT_LIST + rb'\s*,\s*') * MOBILE_UNIT_INDICES[0]
+                           + rb'\s*,\s*'.join([rb'(' + _UNIT_LIST + rb')'] * len(MOBILE_UNIT_INDICES)))
+_EMPTY_SPAWN = re.compile(rb'\s*:\s*\[\s*\]')
+
+def message_is_settled(message):
+    """Checks frame_is_settled on a raw action frame without parsing the whole message
+
+    Args:
+        message: The raw action frame as bytes
+
+    Returns:
+        True if neither player has mobile units on the board and none were spawned this frame
+
+    """
+    for key in (b'"p1Units"', b'"p2Units"'):
+        start = message.find(key)
+        match = _MOBILE_LISTS.match(message, start + len(key)) if start != -1 else None
+        if match is None:
+            return frame_is_settled(json.loads(message))
+        # An empty list has no opening bracket after its own
+        if any(units.find(b"[", 1) != -1 for units in match.groups()):
+            return False
+    start = message.find(b'"spawn"')
+    return start == -1 or _EMPTY_SPAWN.match(message, start + len(b'"spawn"')) is not None
+
+class Precomputation:
+    """Analyses of an upcoming turn that a worker thread computes during the action phase.
+
+    Attributes :
+        * turn_number (int): The turn the analyses are for
+        * state_string (string): The action frame the next turn's board was predicted from. It can be passed to GameState like a turn state.
+        * results (dict): The finished analyses, by name. Only store complete results here, on_turn may read them at any time.
+
+    """
+    def __init__(self, turn_number, state_string):
+        self.turn_number = turn_number
+        self.state_string = state_string
+        self.results = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Asks the worker to stop, called once the real turn has started
+        """
+        self._stop.set()
+
+    def should_stop(self):
+        """Returns True once the results are no longer wanted. Long analyses should check this regularly.
+        """
+        return self._stop.is_set()
+
+    def finished(self):
+        """Returns a copy of the results finished so far
+        """
+        return dict(self.results)
 
 class AlgoCore(object):
     """
@@ -10,10 +140,39 @@ class AlgoCore(object):
 
     Attributes :
         * config (JSON): json object containing information about the game
+        * precomputed (dict): The analyses precompute_turn finished before the current turn started. Always empty unless the algo was started with background=True
+        * turn_time_limit (float): Seconds a turn may take. Defaults to the soft time limit in the config if None
+        * turn_budget (:obj: TurnBudget): The time budget of the current turn, see budget.py
+        * recorder (:obj: ReplayRecorder): Records every message of the game if recording was turned on, see start
+        * planning_stages (:obj: PlanningStages): Planning stages that can be run within the turn budget with run_planning_stages
+        * parameters (dict): The value of every parameter declared in the class's PARAMETERS, see parameters.py
+        * profiler (:obj: TurnProfiler): Samples the stack during on_turn if profiling was turned on, see profiler.py
+        * memory_monitor (:obj: MemoryMonitor): Reports allocations per turn if memory accounting was turned on, see memory.py
 
     """
+    PARAMETERS = {}
+
     def __init__(self):
         self.config = None
+        self.turn_time_limit = None
+        self.turn_budget = None
+        self.planning_stages = PlanningStages()
+        self._turn_timer = None
+        self.precomputed = {}
+        self._precomputation = None
+        self._predicted_turn = None
+        self._worker = None
+        self.recorder = None
+        self.profiler = None
+        self.memory_monitor = None
+        self.parameters = resolve_parameters(self.PARAMETERS, environment_parameters())
+
+    def set_parameters(self, values):
+        """
+        Sets the values of declared parameters, the others keep their current value.
+        """
+        resolved = resolve_parameters(self.PARAMETERS, values)
+        self.parameters.update((name, resolved[name]) for name in values if name in resolved)
 
     def on_game_start(self, config):
         """
@@ -31,8 +190,7 @@ class AlgoCore(object):
         algo_strategy.py inherits from AlgoCore and overrides this on turn function. 
         Adjusting the on_turn function in algo_strategy is the main way to adjust your algo's logic. 
         """
-        send_command("[]")
-        send_command("[]")
+        send_turn("[]", "[]")
     
     def on_action_frame(self, action_frame_game_state):
         """
@@ -43,53 +201,231 @@ class AlgoCore(object):
         """
         pass
 
+    def run_planning_stages(self, game_state):
+        """
+        Runs the registered planning stages in priority order until the turn budget runs out.
+        Register stages with self.planning_stages.register, usually in on_game_start.
+        Returns a dict of the results of the stages that ran, by name.
+        """
+        return self.planning_stages.run(game_state, self.turn_budget)
+
+    def _begin_turn(self, message):
+        """
+        Creates the time budget for the turn in the given raw turn message and starts the per turn profiling
+        """
+        started = time.perf_counter()
+        limit = self.turn_time_limit if self.turn_time_limit is not None else default_turn_limit(self.config)
+        if self._turn_timer is None:
+            self._turn_timer = TurnTimer(limit)
+        self._turn_timer.limit = limit
+        self.turn_budget = self._turn_timer.start_turn(parse_player_time(message), started)
+        if self._worker is not None:
+            # Stop the precomputation before its turn's cache entries are dropped
+            self._collect_precomputed()
+        cache.registry.begin_turn()
+        turn_number = parse_turn_number(message)
+        if telemetry.active() is not None:
+            telemetry.active().begin_turn(turn_number)
+        if self.memory_monitor is not None:
+            self.memory_monitor.begin_turn(turn_number)
+        if self.profiler is not None:
+            self.profiler.begin_turn(turn_number)
+
+    def _end_turn(self):
+        """
+        Stops the per turn profiling and closes the time budget of the turn
+        """
+        if self.profiler is not None:
+            self.profiler.end_turn()
+        if self.memory_monitor is not None:
+            self.memory_monitor.end_turn(self)
+        self._turn_timer.end_turn(self.turn_budget)
+        if telemetry.active() is not None:
+            telemetry.active().end_turn()
+            if self.turn_budget.remaining() <= 0:
+                telemetry.mark("turn_budget_exceeded", {"turn": telemetry.active().turn_number})
+
+    def precompute_turn(self, game_state_string, precomputation):
+        """
+        Only used when the algo is started with start(background=True).
+        This function is called on a worker thread as soon as the board for the next turn can be predicted,
+        which is once an action frame has no mobile units left on the board.
+        game_state_string is that action frame, and can be used to initiate a new GameState object. \n
+        Store each finished analysis (paths, threat maps...) in precomputation.results and stop early once
+        precomputation.should_stop() returns True. Whatever is finished when the next turn starts is available
+        to on_turn as self.precomputed. This runs alongside on_action_frame, so avoid changing attributes it uses.
+        """
+        pass
+
+    def _watch_message(self, message):
+        """
+        Runs on the stdin reader thread for every message. Starts a precomputation once an action frame
+        shows that the board for the next turn is settled.
+        """
+        if self._worker is None or self.config is None or parse_turn_type(message) != 1:
+            return
+        turn_number = parse_turn_number(message)
+        if turn_number == self._predicted_turn or not message_is_settled(message):
+            return
+        self._predicted_turn = turn_number
+        precomputation = Precomputation(turn_number + 1, message.decode("utf-8"))
+        self._precomputation = precomputation
+        self._worker.submit(self._run_precomputation, precomputation)
+
+    def _run_precomputation(self, precomputation):
+        try:
+            with telemetry.span("precompute_turn"):
+                self.precompute_turn(precomputation.state_string, precomputation)
+        except Exception as e:
+            debug_write("Precomputation for turn {} failed: {}".format(precomputation.turn_number, e))
+
+    def _collect_precomputed(self):
+        """
+        Stops the running precomputation, if any, and keeps what it finished for on_turn
+        """
+        precomputation = self._precomputation
+        self._precomputation = None
+        if precomputation is None:
+            self.precomputed = {}
+            return
+        precomputation.stop()
+        self.precomputed = precomputation.finished()
 
-    def start(self):
+    def start(self, background=False, record=None):
         """ 
         Start the parsing loop.
         After starting the algo, it will wait until it receives information from the game 
         engine, process this information, and respond if needed to take it's turn. 
         The algo continues this loop until it receives the "End" turn message from the game.
+
+        If background is True, a reader thread drains stdin while the algo is busy and a worker thread
+        runs precompute_turn during the action phase. See precompute_turn.
+
+        If record is a file or directory path, every message received and command sent is saved to a replay file there,
+        see replay.py. Recording can also be turned on without code changes with the GAMELIB_RECORD environment variable.
+        Per-turn timing telemetry is written when the GAMELIB_TELEMETRY environment variable is set, see telemetry.py,
+        and on_turn is profiled when GAMELIB_PROFILE is set, see profiler.py. Allocations are reported per turn
+        when GAMELIB_MEMORY is set, see memory.py.
         """
         debug_write(BANNER_TEXT)
+        self._start_recording(record)
+        self._start_monitoring()
+
+        if background:
+            self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gamelib-precompute")
+            reader = StdinReader(on_message=self._watch_message)
+            reader.start()
+            next_message = reader.get_message
+        else:
+            next_message = get_command_bytes
 
+        # Note: Python blocks and hangs on stdin. Can cause issues if connections aren't setup properly and may need to
+        # manually kill this Python program.
         while True:
-            # Note: Python blocks and hangs on stdin. Can cause issues if connections aren't setup properly and may need to
-            # manually kill this Python program.
-            game_state_string = get_command()
-            if "replaySave" in game_state_string:
-                """
-                This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
-                """
-                parsed_config = json.loads(game_state_string)
+            message = self._record_message(next_message())
+            with telemetry.span("handle_message"):
+                running = self._handle_message(message)
+            if not running:
+                break
+
+        if self._worker is not None:
+            self._collect_precomputed()
+            self._worker.shutdown(wait=False)
+        self._stop_recording()
+        self._stop_monitoring()
+
+    def _start_monitoring(self):
+        """
+        Turns on telemetry, profiling and memory reports if their environment variables are set
+        """
+        telemetry.enable_from_environment()
+        if self.profiler is None:
+            self.profiler = profiler_from_environment()
+        if self.memory_monitor is None:
+            self.memory_monitor = memory_monitor_from_environment()
+
+    def _stop_monitoring(self):
+        telemetry.disable()
+        if self.profiler is not None:
+            self.profiler.close()
+        if self.memory_monitor is not None:
+            self.memory_monitor.close()
+
+    def _start_recording(self, record):
+        """Starts recording to the given path, or the one in the GAMELIB_RECORD environment variable
+        """
+        record = record or os.environ.get(RECORD_ENV)
+        if not record:
+            return
+        try:
+            self.recorder = ReplayRecorder(record)
+        except OSError as e:
+            debug_write("Could not start recording to {}: {}".format(record, e))
+            return
+        set_recorder(self.recorder)
+        atexit.register(self._stop_recording)
+
+    def _record_message(self, message):
+        if self.recorder is not None:
+            self.recorder.record_input(message)
+        return message
+
+    def _stop_recording(self):
+        if self.recorder is not None:
+            set_recorder(None)
+            self.recorder.close()
+
+    def _handle_message(self, message):
+        """
+        Handles a single engine message. Returns False once the game is over.
+        """
+        if b"replaySave" in message:
+            """
+            This means this must be the config file. So, load in the config file as a json and add it to your AlgoStrategy class.
+            """
+            parsed_config = json.loads(message)
+            cache.registry.clear()
+            with telemetry.span("on_game_start"):
                 self.on_game_start(parsed_config)
-            elif "turnInfo" in game_state_string:
-                state = json.loads(game_state_string)
-                stateType = int(state.get("turnInfo")[0])
-                if stateType == 0:
-                    """
-                    This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
-                    deploy phase. Printing is handled by the provided functions.
-                    """
-                    self.on_turn(game_state_string)
-                elif stateType == 1:
-                    """
-                    If stateType == 1, this game_state_string string represents a single frame of an action phase
-                    """
-                    self.on_action_frame(game_state_string)
-                elif stateType == 2:
-                    """
-                    This is the end game message. This means the game is over so break and finish the program.
-                    """
-                    debug_write("Got end state, game over. Stopping algo.")
-                    break
-                else:
-                    """
-                    Something is wrong? Received an incorrect or improperly formatted string.
-                    """
-                    debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
-            else:
-                """
-                Something is wrong? Received an incorrect or improperly formatted string.
-                """
-                debug_write("Got unexpected string : {}".format(game_state_string))
+            flush_debug()
+            return True
+
+        stateType = parse_turn_type(message)
+        game_state_string = message.decode("utf-8")
+        if stateType is None:
+            """
+            Something is wrong? Received an incorrect or improperly formatted string.
+            """
+            debug_write("Got unexpected string : {}".format(game_state_string))
+        elif stateType == 0:
+            """
+            This is the game turn game state message. Algo must now print to stdout 2 lines, one for build phase one for
+            deploy phase. Printing is handled by the provided functions.
+            """
+            self._begin_turn(message)
+            with telemetry.span("on_turn"):
+                self.on_turn(game_state_string)
+            self._end_turn()
+            flush_debug()
+        elif stateType == 1:
+            """
+            If stateType == 1, this game_state_string string represents a single frame of an action phase
+            """
+            before = self.memory_monitor.measure_frame() if self.memory_monitor is not None else None
+            with telemetry.span("on_action_frame"):
+                self.on_action_frame(game_state_string)
+            if before is not None:
+                self.memory_monitor.add_frame(before)
+        elif stateType == 2:
+            """
+            This is the end game message. This means the game is over so break and finish the program.
+            """
+            debug_write("Got end state, game over. Stopping algo.")
+            flush_debug()
+            return False
+        else:
+            """
+            Something is wrong? Received an incorrect or improperly formatted string.
+            """
+            debug_write("Got unexpected string with turnInfo: {}".format(game_state_string))
+        return True
@@ -0,0 +1,159 @@
+import sys
+import json
+import asyncio
+
+from .algocore import AlgoCore, parse_turn_type
+from .budget import default_turn_limit
+from . import telemetry
+from .util import StdinTransport, debug_write, flush_debug, send_turn, BANNER_TEXT, _exit_on_eof
+
+STREAM_LIMIT = 1 << 26
+
+
+class AsyncAlgoCore(AlgoCore):
+    """
+    An AlgoCore that runs its parsing loop on asyncio. \n
+    on_turn is a coroutine that runs as a task with a deadline. It can await long computations
+    offloaded with run_in_executor while keeping track of the best plan found so far with propose_plan.
+    If the deadline expires the task is cancelled and the last proposed plan is submitted instead.
+
+    Attributes :
+        * config (JSON): json object containing information about the game
+        * turn_deadline (float): Seconds on_turn may run before it is cancelled. What is left of turn_budget if None, see get_turn_deadline
+        * executor (concurrent.futures.Executor): Executor used by run_in_executor. The event loop's default thread pool if None
+
+    """
+    def __init__(self):
+        super().__init__()
+        self.turn_deadline = None
+        self.executor = None
+        self._plan = None
+
+    async def on_turn(self, game_state):
+        """
+        This coroutine is called at the start of each turn.
+        It is passed the current game state, which can be used to initiate a new GameState object. \n
+        Return the GameState whose queued builds and deploys should be submitted instead of calling submit_turn,
+        and call propose_plan with intermediate results so there is something to submit if the deadline expires.
+        By default, it submits an empty turn.
+        """
+        return None
+
+    def propose_plan(self, game_state):
+        """Remembers the builds and deploys currently queued on a GameState as the best plan so far.
+        They are copied, so the GameState can keep being modified afterwards.
+
+        Args:
+            game_state: A GameState with the units to submit queued on it
+
+        """
+        self._plan = (json.dumps(game_state._build_stack), json.dumps(game_state._deploy_stack))
+
+    async def run_in_executor(self, func, *args):
+        """Runs a blocking function in the executor without blocking the event loop
+
+        Args:
+            func: The function to call
+            args: Arguments passed to func
+
+        Returns:
+            The value func returned
+
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, telemetry.traced(func), *args)
+
+    def get_turn_deadline(self):
+        """Gets the number of seconds on_turn may run, what is left of the turn budget unless turn_deadline is set.
+        Outside of a started turn there is no budget yet, and the config's soft turn limit is used
+        """
+        if self.turn_deadline is not None:
+            return self.turn_deadline
+        if self.turn_budget is None:
+            return default_turn_limit(self.config)
+        return self.turn_budget.remaining()
+
+    def start(self, record=None):
+        """
+        Start the parsing loop on a new event loop.
+        The algo continues this loop until it receives the "End" turn message from the game.
+        Messages are recorded to a replay file if record is given, see AlgoCore.start.
+        """
+        self._start_recording(record)
+        self._start_monitoring()
+        try:
+            asyncio.run(self._run())
+        finally:
+            self._stop_recording()
+            self._stop_monitoring()
+
+    async def _run(self):
+        debug_write(BANNER_TEXT)
+        read_message = await self._open_stdin()
+        while True:
+            message = await read_message()
+            if message is None:
+                _exit_on_eof()
+            self._record_message(message)
+            if b"replaySave" not in message and parse_turn_type(message) == 0:
+                self._begin_turn(message)
+                await self._play_turn(message.decode("utf-8"))
+                self._end_turn()
+                flush_debug()
+            elif not self._handle_message(message):
+                return
+
+    async def _open_stdin(self):
+        """
+        Connects an asyncio stream to stdin. Returns a coroutine function that gets the next message,
+        or None once stdin is closed.
+        """
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=STREAM_LIMIT)
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        except (ValueError, OSError):
+            # Regular files can't be watched by the event loop, read them on a thread instead
+            transport = StdinTransport(sys.stdin.buffer)
+
+            async def read_file_message():
+                return await loop.run_in_executor(None, transport.read_line)
+            return read_file_message
+
+        async def read_pipe_message():
+            line = await reader.readline()
+            if not line:
+                return None
+            return line.rstrip(b"\n")
+        return read_pipe_message
+
+    async def _play_turn(self, game_state_string):
+        """
+        Runs on_turn as a task and submits exactly one turn, either the GameState it returns,
+        or the last proposed plan if it fails or runs out of time.
+        """
+        self._plan = None
+        deadline = self.get_turn_deadline()
+        task = asyncio.ensure_future(self.on_turn(game_state_string))
+        with telemetry.span("on_turn"):
+            done, _ = await asyncio.wait({task}, timeout=deadline)
+
+        result = None
+        if not done:
+            debug_write("Turn deadline of {:.3f}s expired, submitting the best plan found so far".format(deadline))
+            telemetry.mark("turn_deadline_expired", {"deadline": deadline})
+        elif task.exception() is not None:
+            debug_write("on_turn failed, submitting the best plan found so far: {!r}".format(task.exception()))
+        else:
+            result = task.result()
+
+        if result is not None:
+            self.propose_plan(result)
+        build_string, deploy_string = self._plan if self._plan is not None else ("[]", "[]")
+        send_turn(build_string, deploy_string)
+
+        if not done:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
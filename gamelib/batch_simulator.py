@@ -0,0 +1,491 @@
+"""
+Lockstep simulation of many action phases on the same starting board.
+
+BatchSimulator advances K scenarios together, frame by frame, with the state of every scenario
+held in NumPy arrays: unit positions, health and shields are (K, units) arrays and structure
+health is a (K, structures) array. Scenarios may deploy different units and build different
+structures (a support placement, for example) on top of the shared board.
+
+The rules and outcomes are the same as ActionPhaseSimulator. Units act in the same order, so attacks
+are resolved one attacker at a time, each vectorized over all scenarios. Paths are looked up in tables
+of next tiles computed once per distinct board, since destroyed structures make the boards diverge.
+The fixed cost of a batch is higher than a single simulation, so it pays off when screening hundreds
+of attack variants, after which the best ones can be inspected in detail with ActionPhaseSimulator.
+
+NumPy is required for this module. It is not imported by gamelib itself, so algos that don't use it
+don't need NumPy installed.
+"""
+import numpy as np
+
+from . import cache
+from .navigation import FieldPathFinder
+from .simulator import SimUnit, DEFAULT_MAX_FRAMES
+from .unit import GameUnit
+
+UNREACHABLE = 1 << 20
+HEALTH_SCALE = 1000
+HEALTH_KEY_MAX = (1 << 24) - 1
+
+# Next tile tables by (arena size, blocked tiles, edge). Boards repeat between batches and between turns
+_next_tile_tables = cache.register("batch_next_tiles", lambda key, table: table.nbytes + 64 * len(key[1]))
+
+
+class BatchResult:
+    """The outcomes of a batch of simulated action phases, one row per scenario.
+
+    Attributes :
+        * frames (ndarray): (K,) The number of frames each scenario ran for
+        * survivors (ndarray): (K, 2) The number of each player's mobile units that reached their target edge
+        * deployed (ndarray): (K, 2) The number of mobile units each player deployed
+        * health_lost (ndarray): (K, 2) The health each player lost to breaches
+        * structure_damage (ndarray): (K, 2) The damage each player's units dealt to enemy structures
+        * mobile_damage (ndarray): (K, 2) The damage each player's units dealt to enemy mobile units
+        * structures_destroyed (ndarray): (K, 2) The number of each player's structures destroyed
+        * structure_health (ndarray): (K, S) The health of every structure at the end, 0 if it was destroyed or not built.
+          The structures of the board and of every scenario's builds are ordered by location, like GameMap iteration
+
+    """
+    def __init__(self, count, structure_count):
+        self.frames = np.zeros(count, dtype=np.int64)
+        self.survivors = np.zeros((count, 2), dtype=np.int64)
+        self.deployed = np.zeros((count, 2), dtype=np.int64)
+        self.health_lost = np.zeros((count, 2))
+        self.structure_damage = np.zeros((count, 2))
+        self.mobile_damage = np.zeros((count, 2))
+        self.structures_destroyed = np.zeros((count, 2), dtype=np.int64)
+        self.structure_health = np.zeros((count, structure_count))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def outcome(self, index):
+        """Gets the outcome of a single scenario
+
+        Args:
+            index: The index of the scenario
+
+        Returns:
+            A dict of the scenario's frames, survivors, deployed, health_lost, structure_damage, mobile_damage and structures_destroyed
+
+        """
+        return {
+            "frames": int(self.frames[index]),
+            "survivors": self.survivors[index].tolist(),
+            "deployed": self.deployed[index].tolist(),
+            "health_lost": self.health_lost[index].tolist(),
+            "structure_damage": self.structure_damage[index].tolist(),
+            "mobile_damage": self.mobile_damage[index].tolist(),
+            "structures_destroyed": self.structures_destroyed[index].tolist(),
+        }
+
+
+class BatchSimulator:
+    """Simulates many action phases that start from the board of the same GameState.
+
+    Attributes :
+        * config (JSON): Contains information about the game
+        * arena_size (int): The size of the arena
+        * max_frames (int): Scenarios stop after this many frames even if mobile units remain
+
+    """
+    def __init__(self, game_state, max_frames=DEFAULT_MAX_FRAMES):
+        """Reads the structures on the board of a game state
+
+        Args:
+            game_state: The GameState to simulate from. Structures queued with attempt_spawn or attempt_upgrade are included
+            max_frames: Scenarios stop after this many frames
+
+        """
+        self.config = game_state.config
+        self.arena_size = game_state.ARENA_SIZE
+        self.max_frames = max_frames
+        self._type_indices = {unit["shorthand"]: index for index, unit in enumerate(self.config["unitInformation"]) if "shorthand" in unit}
+        self._hit_radius = self.config["unitInformation"][0].get("getHitRadius", 0)
+        self._base_structures = []
+        for location in game_state.game_map:
+            for unit in game_state.game_map[location]:
+                if unit.stationary:
+                    self._base_structures.append(unit)
+
+        self._finder = FieldPathFinder(self.arena_size)
+        size = self.arena_size
+        self._in_bounds = np.array(self._finder._in_bounds, dtype=bool)
+        self._edge_tiles = np.zeros((4, size * size), dtype=bool)
+        for edge, locations in enumerate(self._finder._edges):
+            for x, y in locations:
+                self._edge_tiles[edge, x * size + y] = True
+        self._next_lookup = self._direction_lookup()
+
+    def _sim_unit(self, unit):
+        index = self._type_indices[unit.unit_type]
+        return SimUnit(unit, index, self.config["unitInformation"][index], self.arena_size)
+
+    def _direction_lookup(self):
+        """Builds a table of which neighbor a unit steps to, by target edge, previous move direction and
+        the set of neighbors that are one step closer, using the tie breaks of FieldPathFinder.next_move.
+        Neighbors are numbered in the order up, down, right, left.
+        """
+        finder = self._finder
+        lookup = np.full((4, 3, 16), -1, dtype=np.int64)
+        center = (10, 10)
+        neighbors = [(10, 11), (10, 9), (11, 10), (9, 10)]
+        for edge in range(4):
+            direction = finder._directions[edge]
+            for previous in range(3):
+                for mask in range(1, 16):
+                    best = center
+                    best_index = -1
+                    for index, neighbor in enumerate(neighbors):
+                        if not mask & (1 << index):
+                            continue
+                        if best_index != -1 and not finder._better_direction(center, neighbor, best, previous, direction):
+                            continue
+                        best = neighbor
+                        best_index = index
+                    lookup[edge, previous, mask] = best_index
+        return lookup
+
+    def _next_tiles(self, blocked, edge):
+        """Computes the tile a unit steps to from every tile, for each previous move direction
+
+        Args:
+            blocked: (size, size) boolean array of blocked tiles
+            edge: The target edge
+
+        Returns:
+            (3, size * size) array of next tile indices, -1 where the unit has reached the end of its path
+
+        """
+        size = self.arena_size
+        finder = self._finder.copy()
+        finder.blocked = blocked.tolist()
+        finder._clear_fields()
+        finder._label_components()
+        field = np.full((size, size), UNREACHABLE, dtype=np.int64)
+        seen = set()
+        for x in range(size):
+            for y in range(size):
+                component = finder._components[x][y]
+                if component == -1 or component in seen:
+                    continue
+                seen.add(component)
+                component_field = np.array(finder._get_field((x, y), edge), dtype=np.int64)
+                members = np.array(finder._components) == component
+                field[members] = component_field[members]
+
+        padded = np.full((size + 2, size + 2), UNREACHABLE, dtype=np.int64)
+        padded[1:-1, 1:-1] = field
+        lower = field - 1
+        mask = ((padded[1:-1, 2:] == lower).astype(np.int64)
+                | ((padded[1:-1, :-2] == lower).astype(np.int64) << 1)
+                | ((padded[2:, 1:-1] == lower).astype(np.int64) << 2)
+                | ((padded[:-2, 1:-1] == lower).astype(np.int64) << 3))
+        mask[(field <= 0) | (field >= UNREACHABLE)] = 0
+        steps = np.array([1, -1, size, -size], dtype=np.int64)
+        tiles = np.arange(size * size, dtype=np.int64)
+        next_tiles = np.full((3, size * size), -1, dtype=np.int64)
+        for previous in range(3):
+            choice = self._next_lookup[edge, previous][mask.ravel()]
+            moving = choice >= 0
+            next_tiles[previous, moving] = tiles[moving] + steps[choice[moving]]
+        return next_tiles
+
+    def simulate(self, deploys, enemy_deploys=None, builds=None):
+        """Simulates one action phase per scenario
+
+        Args:
+            deploys: A list with your deploys for each scenario, each a list of (unit_type, x, y) entries like GameState._deploy_stack
+            enemy_deploys: A list with your opponent's deploys for each scenario, or None if they deploy nothing
+            builds: A list with extra structures for each scenario, each a list of (unit_type, x, y, player_index) entries, or None
+
+        Returns:
+            A BatchResult with one row per scenario
+
+        """
+        count = len(deploys)
+        enemy_deploys = enemy_deploys if enemy_deploys is not None else [[]] * count
+        builds = builds if builds is not None else [[]] * count
+        size = self.arena_size
+        hit_radius = self._hit_radius
+
+        # Structures: the shared board and every extra structure any scenario builds
+        extra_index = {}
+        structures = [self._sim_unit(unit) for unit in self._base_structures]
+        occupied = {(unit.x, unit.y) for unit in structures}
+        scenario_extras = []
+        for scenario_builds in builds:
+            indices = []
+            for unit_type, x, y, player_index in scenario_builds:
+                key = (unit_type, x, y, player_index)
+                if key not in extra_index:
+                    if (x, y) in occupied:
+                        continue
+                    extra_index[key] = len(structures)
+                    structures.append(self._sim_unit(GameUnit(unit_type, self.config, player_index, None, x, y)))
+                indices.append(extra_index[key])
+            scenario_extras.append(indices)
+        # Structures act in the order of their locations on the map, as in ActionPhaseSimulator, so extras are merged into it
+        order = sorted(range(len(structures)), key=lambda index: (structures[index].y, structures[index].x))
+        position = {index: new_index for new_index, index in enumerate(order)}
+        structures = [structures[index] for index in order]
+        scenario_extras = [[position[index] for index in indices] for indices in scenario_extras]
+        extras = [position[index] for index in range(len(self._base_structures), len(structures))]
+        structure_count = len(structures)
+
+        sx = np.array([unit.x for unit in structures], dtype=np.int64)
+        sy = np.array([unit.y for unit in structures], dtype=np.int64)
+        s_player = np.array([unit.player_index for unit in structures], dtype=np.int64)
+        s_damage_f = np.array([unit.damage_f for unit in structures], dtype=float)
+        s_damage_i = np.array([unit.damage_i for unit in structures], dtype=float)
+        s_range = np.array([unit.attack_range for unit in structures], dtype=float)
+        s_health = np.tile(np.array([unit.health for unit in structures], dtype=float), (count, 1))
+        # The parts of a structure's targeting key that only depend on where the attacker stands, by attacker player and tile
+        tiles = np.arange(size * size)
+        dx = sx[None, :] - (tiles // size)[:, None]
+        dy = sy[None, :] - (tiles % size)[:, None]
+        s_distance = dx * dx + dy * dy
+        s_key_x = size - 1 - np.abs(size - 1 - 2 * sx)
+        s_static_keys = np.stack([(1 << 40) | (s_distance << 34) | (key_y << 5) | s_key_x for key_y in (sy, size - 1 - sy)])
+        s_enemy = np.stack([s_player == 1, s_player == 0])
+        absent = np.zeros((count, structure_count), dtype=bool)
+        absent[:, extras] = True
+        for scenario, indices in enumerate(scenario_extras):
+            absent[scenario, indices] = False
+        s_health[absent] = 0
+
+        # Board signatures: the set of structures missing from a scenario's board, which decides its paths
+        signatures = {}
+        tables = {}
+        signature_of = np.zeros(count, dtype=np.int64)
+        for scenario in range(count):
+            key = frozenset(np.flatnonzero(absent[scenario]).tolist())
+            signature_of[scenario] = signatures.setdefault(key, len(signatures))
+        signature_keys = {index: key for key, index in signatures.items()}
+
+        def table(signature, edge):
+            key = (signature, edge)
+            if key not in tables:
+                missing = signature_keys[signature]
+                blocked = frozenset((int(sx[index]), int(sy[index])) for index in range(structure_count) if index not in missing)
+                # Boards repeat between calls, so next tiles are cached by the blocked tiles rather than the signature
+                shared_key = (size, blocked, edge)
+                next_tiles = _next_tile_tables.get(shared_key)
+                if next_tiles is None:
+                    grid = np.zeros((size, size), dtype=bool)
+                    for x, y in blocked:
+                        grid[x, y] = True
+                    next_tiles = self._next_tiles(grid, edge)
+                    _next_tile_tables.put(shared_key, next_tiles)
+                tables[key] = next_tiles
+            return tables[key]
+
+        # Mobile units, padded to the largest deployment
+        units = []
+        for scenario in range(count):
+            blocked = {(int(sx[index]), int(sy[index])) for index in range(structure_count) if not absent[scenario, index]}
+            scenario_units = []
+            for player_index, stack in ((0, deploys[scenario]), (1, enemy_deploys[scenario])):
+                for unit_type, x, y in stack:
+                    if (x, y) not in blocked:
+                        scenario_units.append((unit_type, x, y, player_index))
+            units.append(scenario_units)
+        unit_count = max([len(scenario_units) for scenario_units in units] + [1])
+
+        shape = (count, unit_count)
+        ux = np.zeros(shape, dtype=np.int64)
+        uy = np.zeros(shape, dtype=np.int64)
+        u_health = np.zeros(shape)
+        u_player = np.zeros(shape, dtype=np.int64)
+        u_damage_f = np.zeros(shape)
+        u_damage_i = np.zeros(shape)
+        u_range = np.zeros(shape)
+        u_interval = np.ones(shape, dtype=np.int64)
+        u_timer = np.ones(shape, dtype=np.int64)
+        u_direction = np.zeros(shape, dtype=np.int64)
+        u_edge = np.zeros(shape, dtype=np.int64)
+        u_steps = np.zeros(shape, dtype=np.int64)
+        u_breach = np.zeros(shape)
+        u_sd_f = np.zeros(shape)
+        u_sd_i = np.zeros(shape)
+        u_sd_range = np.zeros(shape)
+        u_sd_steps = np.zeros(shape, dtype=np.int64)
+        alive = np.zeros(shape, dtype=bool)
+
+        result = BatchResult(count, structure_count)
+        templates = {}
+        for scenario, scenario_units in enumerate(units):
+            for index, (unit_type, x, y, player_index) in enumerate(scenario_units):
+                template = templates.get((unit_type, player_index))
+                if template is None:
+                    template = self._sim_unit(GameUnit(unit_type, self.config, player_index))
+                    templates[(unit_type, player_index)] = template
+                ux[scenario, index] = x
+                uy[scenario, index] = y
+                u_health[scenario, index] = GameUnit(unit_type, self.config).max_health
+                u_player[scenario, index] = player_index
+                u_damage_f[scenario, index] = template.damage_f
+                u_damage_i[scenario, index] = template.damage_i
+                u_range[scenario, index] = template.attack_range
+                u_interval[scenario, index] = template.move_interval
+                u_timer[scenario, index] = template.move_interval
+                u_edge[scenario, index] = self._finder.get_target_edge([x, y])
+                u_breach[scenario, index] = template.breach_damage
+                u_sd_f[scenario, index] = template.self_destruct_damage_f
+                u_sd_i[scenario, index] = template.self_destruct_damage_i
+                u_sd_range[scenario, index] = template.self_destruct_range
+                u_sd_steps[scenario, index] = template.self_destruct_steps
+                alive[scenario, index] = True
+                result.deployed[scenario, player_index] += 1
+
+        supports = [index for index, unit in enumerate(structures) if unit.shield_amount > 0 and unit.shield_range > 0]
+        shielded = np.zeros((count, len(supports), unit_count), dtype=bool)
+        attackers = np.flatnonzero((s_damage_f > 0) | (s_damage_i > 0))
+
+        def target_keys(ax, ay, player, attack_range, damage_f, damage_i, rows):
+            """Returns the targeting keys of every mobile unit and structure for an attacker in each of the given rows,
+            the smallest key is the target get_target would choose. Invalid targets get the maximum key."""
+            limit = (attack_range + hit_radius) ** 2
+            enemy = 1 - player
+            dx = ux[rows] - ax[:, None]
+            dy = uy[rows] - ay[:, None]
+            d2 = dx * dx + dy * dy
+            health = u_health[rows]
+            valid = (alive[rows] & (health > 0) & (u_player[rows] == enemy[:, None])
+                     & (d2 < limit[:, None]) & (damage_i[:, None] > 0))
+            health_key = np.minimum(np.rint(health * HEALTH_SCALE), HEALTH_KEY_MAX).astype(np.int64)
+            y_key = np.where(player[:, None] == 0, uy[rows], size - 1 - uy[rows])
+            x_key = size - 1 - np.abs(size - 1 - 2 * ux[rows])
+            mobile_keys = (d2 << 34) | (np.maximum(health_key, 0) << 10) | (y_key << 5) | x_key
+            mobile_keys[~valid] = np.iinfo(np.int64).max
+
+            attacker_tiles = ax * size + ay
+            health = s_health[rows]
+            valid = ((health > 0) & s_enemy[player] & (s_distance[attacker_tiles] < limit[:, None]) & (damage_f[:, None] > 0))
+            health_key = np.minimum(np.rint(health * HEALTH_SCALE), HEALTH_KEY_MAX).astype(np.int64)
+            structure_keys = s_static_keys[player, attacker_tiles] | (np.maximum(health_key, 0) << 10)
+            structure_keys[~valid] = np.iinfo(np.int64).max
+            return np.concatenate([mobile_keys, structure_keys], axis=1)
+
+        def attack(rows, ax, ay, player, attack_range, damage_f, damage_i):
+            keys = target_keys(ax, ay, player, attack_range, damage_f, damage_i, rows)
+            choice = np.argmin(keys, axis=1)
+            hit = keys[np.arange(len(rows)), choice] != np.iinfo(np.int64).max
+            if not hit.any():
+                return
+            rows, choice, player = rows[hit], choice[hit], player[hit]
+            damage_f, damage_i = damage_f[hit], damage_i[hit]
+            mobile = choice < unit_count
+            if mobile.any():
+                r, c = rows[mobile], choice[mobile]
+                dealt = np.minimum(damage_i[mobile], u_health[r, c])
+                u_health[r, c] -= damage_i[mobile]
+                np.add.at(result.mobile_damage, (r, player[mobile]), dealt)
+            if (~mobile).any():
+                r, c = rows[~mobile], choice[~mobile] - unit_count
+                dealt = np.minimum(damage_f[~mobile], s_health[r, c])
+                s_health[r, c] -= damage_f[~mobile]
+                np.add.at(result.structure_damage, (r, player[~mobile]), dealt)
+
+        def self_destruct(rows, index):
+            """Self destructs unit index in the given rows, damaging enemies nearby if it moved far enough"""
+            player = u_player[rows, index]
+            strong = u_steps[rows, index] >= u_sd_steps[rows, index]
+            limit = (u_sd_range[rows, index] + hit_radius) ** 2
+            dx = sx[None, :] - ux[rows, index][:, None]
+            dy = sy[None, :] - uy[rows, index][:, None]
+            near = ((dx * dx + dy * dy) < limit[:, None]) & (s_player[None, :] != player[:, None]) & (s_health[rows] > 0) & strong[:, None]
+            damage = u_sd_f[rows, index][:, None]
+            dealt = np.where(near, np.minimum(damage, s_health[rows]), 0).sum(axis=1)
+            s_health[rows] -= np.where(near, damage, 0)
+            np.add.at(result.structure_damage, (rows, player), dealt)
+            dx = ux[rows] - ux[rows, index][:, None]
+            dy = uy[rows] - uy[rows, index][:, None]
+            near = (((dx * dx + dy * dy) < limit[:, None]) & (u_player[rows] != player[:, None])
+                    & alive[rows] & (u_health[rows] > 0) & strong[:, None])
+            damage = u_sd_i[rows, index][:, None]
+            dealt = np.where(near, np.minimum(damage, u_health[rows]), 0).sum(axis=1)
+            u_health[rows] -= np.where(near, damage, 0)
+            np.add.at(result.mobile_damage, (rows, player), dealt)
+            u_health[rows, index] = 0
+
+        def move(rows, index):
+            """Moves unit index in the given rows one step, breaching or self destructing where its path ends"""
+            tiles = ux[rows, index] * size + uy[rows, index]
+            next_tiles = np.empty(len(rows), dtype=np.int64)
+            pairs = signature_of[rows] * 4 + u_edge[rows, index]
+            for pair in np.unique(pairs):
+                same = pairs == pair
+                next_tiles[same] = table(pair // 4, pair % 4)[u_direction[rows[same], index], tiles[same]]
+            ended = next_tiles < 0
+            if ended.any():
+                self_destruct(rows[ended], index)
+            rows, next_tiles = rows[~ended], next_tiles[~ended]
+            nx, ny = next_tiles // size, next_tiles % size
+            u_direction[rows, index] = np.where(nx == ux[rows, index], 2, 1)
+            ux[rows, index] = nx
+            uy[rows, index] = ny
+            u_steps[rows, index] += 1
+            breached = self._edge_tiles[u_edge[rows, index], next_tiles]
+            if breached.any():
+                rows = rows[breached]
+                player = u_player[rows, index]
+                np.add.at(result.survivors, (rows, player), 1)
+                np.add.at(result.health_lost, (rows, 1 - player), u_breach[rows, index])
+                u_health[rows, index] = 0
+
+        running = alive.any(axis=1)
+        frame = 0
+        while running.any() and frame < self.max_frames:
+            frame += 1
+            result.frames[running] = frame
+
+            for slot, support in enumerate(supports):
+                unit = structures[support]
+                limit = (unit.shield_range + hit_radius) ** 2
+                dx = ux - unit.x
+                dy = uy - unit.y
+                gets_shield = (alive & (u_health > 0) & (u_player == unit.player_index) & ((dx * dx + dy * dy) < limit)
+                               & ~shielded[:, slot, :] & (s_health[:, support] > 0)[:, None])
+                u_health[gets_shield] += unit.shield_amount
+                shielded[:, slot, :] |= gets_shield
+
+            active = alive & (u_health > 0)
+            u_timer[active] -= 1
+            due = active & (u_timer <= 0)
+            u_timer[due] = u_interval[due]
+            for index in range(unit_count):
+                rows = np.flatnonzero(due[:, index] & (u_health[:, index] > 0))
+                if len(rows):
+                    move(rows, index)
+
+            for index in attackers:
+                rows = np.flatnonzero(running & (s_health[:, index] > 0))
+                if not len(rows):
+                    continue
+                unit = structures[index]
+                ones = np.ones(len(rows))
+                attack(rows, np.full(len(rows), unit.x), np.full(len(rows), unit.y), np.full(len(rows), unit.player_index),
+                       ones * unit.attack_range, ones * unit.damage_f, ones * unit.damage_i)
+            for index in range(unit_count):
+                rows = np.flatnonzero(alive[:, index] & (u_health[:, index] > 0))
+                if not len(rows):
+                    continue
+                attack(rows, ux[rows, index], uy[rows, index], u_player[rows, index],
+                       u_range[rows, index], u_damage_f[rows, index], u_damage_i[rows, index])
+
+            alive &= u_health > 0
+            destroyed = (s_health <= 0) & ~absent
+            if destroyed.any():
+                for scenario in np.flatnonzero(destroyed.any(axis=1)):
+                    lost = np.flatnonzero(destroyed[scenario])
+                    np.add.at(result.structures_destroyed[scenario], s_player[lost], 1)
+                    absent[scenario, lost] = True
+                    key = frozenset(np.flatnonzero(absent[scenario]).tolist())
+                    if key not in signatures:
+                        signatures[key] = len(signatures)
+                        signature_keys[signatures[key]] = key
+                    signature_of[scenario] = signatures[key]
+            running = alive.any(axis=1)
+
+        result.structure_health = np.maximum(s_health, 0)
+        return result
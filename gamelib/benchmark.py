@@ -0,0 +1,541 @@
+"""
+Microbenchmarks of the hot paths of gamelib on realistic boards.
+
+Every benchmark is timed on synthetic boards of increasing density, drawn with random_board, and on
+turn states captured from recordings. Each measurement is repeated, and the median and 95th percentile
+time of one operation and the operations per second of the median are written to a JSON file. Given a
+baseline written by an earlier run, the benchmarks whose median got slower by more than a threshold are
+reported as regressions and the exit code is 1:
+
+    python -m gamelib.benchmark --config game.replay.gz --output baseline.json
+    python -m gamelib.benchmark --replay game.replay.gz --baseline baseline.json --threshold 0.15
+
+The benchmarks are, per board:
+
+    * game_state: Parsing the turn state into a GameState
+    * from_bytes: Decoding the GameState from its to_bytes encoding
+    * find_path_to_edge: Pathing from every unblocked edge location
+    * get_attackers: get_attackers for player 0 at every arena location
+    * get_target: get_target for every unit on the board
+    * get_locations_in_range: get_locations_in_range of the largest attack range at every arena location
+    * attempt_spawn: Spawning 100 scouts at every free friendly edge location, with enough MP
+    * submit_turn: Submitting the turn after those spawns and a build on every free friendly location
+    * message_is_settled: Checking if the board settled in an action frame of the board without mobile units, from its bytes
+    * json_is_settled: The same check by parsing the frame with json.loads, which message_is_settled has to beat
+
+A second tier measures whole turns of strategies instead, so the effect of a gamelib change on the turn
+latency of real strategies is measured. Each strategy file is loaded, a fresh algo is given the config and
+then one captured turn state, with its commands and debug output captured. The wall time of the turn is
+reported, and from one more turn traced with tracemalloc, the peak bytes allocated during the turn and the
+retained blocks, the memory blocks allocated during the turn that are still allocated after it. Blocks allocated
+and freed within the turn are not counted, CPython keeps no count of them:
+
+    python -m gamelib.benchmark --replay game.replay.gz --strategies every-3.py sunny-2.py --output turns.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import contextlib
+import tracemalloc
+
+from .algocore import message_is_settled, frame_is_settled, MOBILE_UNIT_INDICES
+from .driver import CommandCapture, percentile
+from .game_map import GameMap
+from .game_state import GameState
+from .local_game import LocalGame
+from .mock_engine import load_config, read_positions
+from .tournament import strategy_class, handle_message
+
+BENCHMARK_VERSION = 1
+DEFAULT_REPEAT = 11
+DEFAULT_MIN_TIME = 0.02
+DEFAULT_THRESHOLD = 0.1
+DEFAULT_POSITIONS = 4
+DEFAULT_TURN_REPEAT = 5
+# (structures per player, mobile unit stacks per player) of the synthetic boards
+SYNTHETIC_DENSITIES = {"sparse": (15, 2), "medium": (60, 6), "dense": (140, 12)}
+SPAWN_NUM = 100
+MP_FOR_SPAWNS = 10000
+
+
+def arena_locations(config):
+    """Gets every location in the arena
+    """
+    game_map = GameMap(config)
+    return [[x, y] for x in range(game_map.ARENA_SIZE) for y in range(game_map.ARENA_SIZE) if game_map.in_arena_bounds([x, y])]
+
+
+def random_board(config, rng, structures=60, mobile=6, upgraded=0.2, max_stack=4, turn=10):
+    """Draws a legal turn state with structures and stacks of mobile units on both halves of the board
+
+    Args:
+        config: The game config
+        rng: A random.Random
+        structures: The number of structures of each player
+        mobile: The number of stacks of mobile units of each player, anywhere not blocked
+        upgraded: The chance of a structure being upgraded
+        max_stack: The most units in one stack
+        turn: The turn number of the state
+
+    Returns:
+        The turn state as a JSON string, like the engine sends it
+
+    """
+    unit_information = config["unitInformation"]
+    half = GameMap(config).HALF_ARENA
+    locations = arena_locations(config)
+    units = [[[] for _ in range(8)], [[] for _ in range(8)]]
+    next_id = 0
+    blocked = set()
+    for player_index, player_units in enumerate(units):
+        own_half = [location for location in locations if (location[1] < half) == (player_index == 0)]
+        for x, y in rng.sample(own_half, min(structures, len(own_half))):
+            unit_type = rng.choices((0, 1, 2), weights=(5, 1, 3))[0]
+            upgrade = rng.random() < upgraded
+            information = unit_information[unit_type]
+            max_health = information.get("upgrade", {}).get("startHealth", information["startHealth"]) if upgrade else information["startHealth"]
+            player_units[unit_type].append([x, y, round(rng.uniform(0.2, 1) * max_health, 1), str(next_id)])
+            if upgrade:
+                player_units[7].append([x, y, 0, ""])
+            blocked.add((x, y))
+            next_id += 1
+    free = [location for location in locations if tuple(location) not in blocked]
+    for player_units in units:
+        for x, y in rng.sample(free, min(mobile, len(free))):
+            unit_type = rng.choice((3, 4, 5))
+            for _ in range(rng.randint(1, max_stack)):
+                player_units[unit_type].append([x, y, unit_information[unit_type]["startHealth"], str(next_id)])
+                next_id += 1
+    stats = [30, 25.0, 12.0, 0]
+    return json.dumps({"p1Units": units[0], "p2Units": units[1], "turnInfo": [0, turn, -1],
+                       "p1Stats": stats, "p2Stats": stats, "events": {}})
+
+
+def _parsed(config, state):
+    game_state = GameState(config, state)
+    game_state.suppress_warnings(True)
+    return game_state
+
+
+def _free_edge_locations(game_state):
+    game_map = game_state.game_map
+    edges = game_map.get_edge_locations(game_map.BOTTOM_LEFT) + game_map.get_edge_locations(game_map.BOTTOM_RIGHT)
+    return [location for location in edges if not game_state.contains_stationary_unit(location)]
+
+
+def _spawned(config, state):
+    game_state = _parsed(config, state)
+    game_state._player_resources[0]["MP"] = MP_FOR_SPAWNS
+    game_state.attempt_spawn(config["unitInformation"][3]["shorthand"], _free_edge_locations(game_state), SPAWN_NUM)
+    return game_state
+
+
+def bench_game_state(config, state):
+    return None, lambda: GameState(config, state)
+
+
+def bench_from_bytes(config, state):
+    data = _parsed(config, state).to_bytes()
+    return None, lambda: GameState.from_bytes(config, data)
+
+
+def bench_find_path_to_edge(config, state):
+    game_state = _parsed(config, state)
+    starts = [location for edge in game_state.game_map.get_edges() for location in edge
+              if not game_state.contains_stationary_unit(location)]
+
+    def run():
+        # Forget the memoized answers, to time computing them
+        game_state.game_map.mark_changed()
+        for start in starts:
+            game_state.find_path_to_edge(start)
+    return None, run
+
+
+def bench_get_attackers(config, state):
+    game_state = _parsed(config, state)
+    locations = arena_locations(config)
+
+    def run():
+        # Forget the memoized answers, to time computing them
+        game_state.game_map.mark_changed()
+        for location in locations:
+            game_state.get_attackers(location, 0)
+    return None, run
+
+
+def bench_get_target(config, state):
+    game_state = _parsed(config, state)
+    units = [unit for location in arena_locations(config) for unit in game_state.game_map[location]]
+
+    def run():
+        for unit in units:
+            game_state.get_target(unit)
+    return None, run
+
+
+def bench_get_locations_in_range(config, state):
+    game_map = _parsed(config, state).game_map
+    locations = arena_locations(config)
+    radius = max(unit.get("attackRange", 0) for unit in config["unitInformation"])
+
+    def run():
+        for location in locations:
+            game_map.get_locations_in_range(location, radius)
+    return None, run
+
+
+def bench_attempt_spawn(config, state):
+    scout = config["unitInformation"][3]["shorthand"]
+
+    def setup():
+        game_state = _parsed(config, state)
+        game_state._player_resources[0]["MP"] = MP_FOR_SPAWNS
+        return game_state, _free_edge_locations(game_state)
+
+    def run(prepared):
+        game_state, locations = prepared
+        game_state.attempt_spawn(scout, locations, SPAWN_NUM)
+    return setup, run
+
+
+def bench_submit_turn(config, state):
+    wall = config["unitInformation"][0]["shorthand"]
+
+    def setup():
+        game_state = _spawned(config, state)
+        game_state._player_resources[0]["SP"] = MP_FOR_SPAWNS
+        game_state.attempt_spawn(wall, [location for location in arena_locations(config) if location[1] < game_state.HALF_ARENA])
+        return game_state
+
+    return setup, lambda game_state: game_state.submit_turn()
+
+
+def _settled_frame(state):
+    frame = json.loads(state)
+    frame["turnInfo"] = [1, frame["turnInfo"][1], 0]
+    for key in ("p1Units", "p2Units"):
+        for index in MOBILE_UNIT_INDICES:
+            frame[key][index] = []
+    frame["events"] = {"spawn": []}
+    return json.dumps(frame).encode("utf-8")
+
+
+def bench_message_is_settled(config, state):
+    message = _settled_frame(state)
+    return None, lambda: message_is_settled(message)
+
+
+def bench_json_is_settled(config, state):
+    message = _settled_frame(state)
+    return None, lambda: frame_is_settled(json.loads(message))
+
+
+BENCHMARKS = {
+    "game_state": bench_game_state,
+    "from_bytes": bench_from_bytes,
+    "find_path_to_edge": bench_find_path_to_edge,
+    "get_attackers": bench_get_attackers,
+    "get_target": bench_get_target,
+    "get_locations_in_range": bench_get_locations_in_range,
+    "attempt_spawn": bench_attempt_spawn,
+    "submit_turn": bench_submit_turn,
+    "message_is_settled": bench_message_is_settled,
+    "json_is_settled": bench_json_is_settled,
+}
+
+
+class BenchmarkResult:
+    """The timings of one benchmark on one board.
+
+    Attributes :
+        * name (string): The benchmark and board, like "get_target[dense]"
+        * samples (list): Seconds per operation, one per repetition
+        * number (int): Operations timed together in each repetition
+
+    """
+    def __init__(self, name, samples, number):
+        self.name = name
+        self.samples = samples
+        self.number = number
+
+    @property
+    def median(self):
+        return percentile(self.samples, 50)
+
+    @property
+    def p95(self):
+        return percentile(self.samples, 95)
+
+    @property
+    def ops_per_sec(self):
+        return 1 / self.median if self.median > 0 else float("inf")
+
+    def to_dict(self):
+        return {"median": self.median, "p95": self.p95, "ops_per_sec": self.ops_per_sec,
+                "repeat": len(self.samples), "number": self.number}
+
+
+def measure(run, setup=None, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """Times an operation, with the garbage collector off like timeit
+
+    Args:
+        run: The operation. Called with the value setup returns, if there is a setup
+        setup: Prepares a fresh input for every operation, untimed, for operations that change their input
+        repeat: The number of samples
+        min_time: The least seconds a sample takes, enough operations are timed together to reach it
+
+    Returns:
+        A (samples, number) tuple, samples being seconds per operation
+
+    """
+    def sample(number):
+        inputs = [setup() for _ in range(number)] if setup is not None else None
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if inputs is None:
+                started = time.perf_counter()
+                for _ in range(number):
+                    run()
+            else:
+                started = time.perf_counter()
+                for prepared in inputs:
+                    run(prepared)
+            return (time.perf_counter() - started) / number
+        finally:
+            if enabled:
+                gc.enable()
+
+    first = sample(1)
+    number = max(1, int(min_time / first)) if first > 0 else 1
+    return [sample(number) for _ in range(repeat)], number
+
+
+def run_benchmarks(config, boards, names=None, repeat=DEFAULT_REPEAT, min_time=DEFAULT_MIN_TIME):
+    """Runs benchmarks on boards, with stdout discarded
+
+    Args:
+        config: The game config
+        boards: A dict of turn state strings by board name
+        names: The benchmarks to run, all of them by default
+
+    Returns:
+        A list of BenchmarkResults
+
+    """
+    results = []
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+        for name in names or BENCHMARKS:
+            for board, state in boards.items():
+                setup, run = BENCHMARKS[name](config, state)
+                samples, number = measure(run, setup, repeat, min_time)
+                results.append(BenchmarkResult("{}[{}]".format(name, board), samples, number))
+    return results
+
+
+class TurnBenchmarkResult(BenchmarkResult):
+    """The timings and allocations of one strategy's turn on one board.
+
+    Attributes :
+        * peak_bytes (int): The most bytes allocated at once during the traced turn, above what was allocated before it
+        * retained_blocks (int): The change in sys.getallocatedblocks over the traced turn, the blocks it allocated
+          and did not free. It is not a count of every allocation, which CPython does not keep
+
+    """
+    def __init__(self, name, samples, peak_bytes, retained_blocks):
+        super().__init__(name, samples, 1)
+        self.peak_bytes = peak_bytes
+        self.retained_blocks = retained_blocks
+
+    def to_dict(self):
+        result = super().to_dict()
+        result.update(max=max(self.samples), peak_bytes=self.peak_bytes, retained_blocks=self.retained_blocks)
+        return result
+
+
+def measure_turn(strategy, config, state, repeat=DEFAULT_TURN_REPEAT, seed=0):
+    """Times one turn of a strategy, each time with a fresh algo that was given the config first
+
+    Args:
+        strategy: The strategy file
+        config: The game config
+        state: The turn state string
+        repeat: The number of timed turns, one more turn is traced for allocations
+        seed: The random module is seeded with it before the algo is created and before the turn
+
+    Returns:
+        A (samples, peak bytes, retained blocks) tuple
+
+    """
+    config_message = LocalGame(config).config_message()
+
+    def play(measured):
+        random.seed(seed)
+        algo = strategy_class(strategy)()
+        capture = CommandCapture()
+        handle_message(algo, capture, config_message)
+        random.seed(seed)
+        gc.collect()
+        return measured(lambda: handle_message(algo, capture, state))
+
+    def timed(turn):
+        started = time.perf_counter()
+        turn()
+        return time.perf_counter() - started
+
+    def traced(turn):
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        try:
+            turn()
+            return tracemalloc.get_traced_memory()[1] - before, sys.getallocatedblocks() - blocks
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+    samples = [play(timed) for _ in range(repeat)]
+    peak_bytes, retained_blocks = play(traced)
+    return samples, peak_bytes, retained_blocks
+
+
+def run_turn_benchmarks(strategies, config, boards, repeat=DEFAULT_TURN_REPEAT):
+    """Measures the turns of strategies on boards, with their output discarded
+
+    Args:
+        strategies: Strategy files
+        config: The game config
+        boards: A dict of turn state strings by board name
+
+    Returns:
+        A list of TurnBenchmarkResults
+
+    """
+    results = []
+    with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        for strategy in strategies:
+            for board, state in boards.items():
+                samples, peak_bytes, retained_blocks = measure_turn(strategy, config, state, repeat)
+                name = "{}[{}]".format(os.path.basename(strategy), board)
+                results.append(TurnBenchmarkResult(name, samples, peak_bytes, retained_blocks))
+    return results
+
+
+def synthetic_boards(config, seed=0):
+    """Draws one board of every density in SYNTHETIC_DENSITIES
+    """
+    rng = random.Random(seed)
+    return {density: random_board(config, rng, structures, mobile) for density, (structures, mobile) in SYNTHETIC_DENSITIES.items()}
+
+
+def captured_boards(positions, count=DEFAULT_POSITIONS):
+    """Picks evenly spaced turn states from recorded positions, so early, mid and late game boards are included.
+    Boards are named by turn number, followed by their index in positions if another board has the same turn number
+    """
+    if not positions:
+        return {}
+    count = min(count, len(positions))
+    picked = sorted({round(index * (len(positions) - 1) / max(1, count - 1)) for index in range(count)})
+    boards = {}
+    for index in picked:
+        name = "turn-{}".format(json.loads(positions[index])["turnInfo"][1])
+        if name in boards:
+            # Positions of several recordings can share a turn number, tell them apart by their position
+            name = "{}-{}".format(name, index)
+        boards[name] = positions[index]
+    return boards
+
+
+def results_document(results):
+    return {
+        "version": BENCHMARK_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {result.name: result.to_dict() for result in results},
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Finds the benchmarks that got slower than a baseline
+
+    Args:
+        results: A list of BenchmarkResults
+        baseline: A document written by an earlier run
+        threshold: The fraction the median may grow by before it is a regression
+
+    Returns:
+        A list of (name, baseline median, median) of every regression
+
+    """
+    regressions = []
+    previous = baseline.get("results", {})
+    for result in results:
+        if result.name in previous and result.median > previous[result.name]["median"] * (1 + threshold):
+            regressions.append((result.name, previous[result.name]["median"], result.median))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.benchmark", description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--config", help="a JSON config file or a recording to read the config from")
+    parser.add_argument("--replay", nargs="*", default=[], help="recordings to capture turn states from")
+    parser.add_argument("--positions", type=int, default=DEFAULT_POSITIONS, help="captured turn states to benchmark")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="the benchmarks to run")
+    parser.add_argument("--strategies", nargs="*", help="measure whole turns of these strategy files on the captured turn states instead")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the synthetic boards")
+    parser.add_argument("--repeat", type=int, help="samples per benchmark, {} or {} turns per strategy by default".format(DEFAULT_REPEAT, DEFAULT_TURN_REPEAT))
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="least seconds per sample")
+    parser.add_argument("--output", help="the JSON file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="median growth counted as a regression")
+    args = parser.parse_args(argv)
+    if not args.config and not args.replay:
+        parser.error("a --config or --replay is needed")
+    if args.repeat is None:
+        args.repeat = DEFAULT_TURN_REPEAT if args.strategies else DEFAULT_REPEAT
+
+    positions = []
+    if args.replay:
+        config, positions = read_positions(args.replay)
+    if args.config:
+        config = load_config(args.config)
+
+    if args.strategies:
+        if not positions:
+            parser.error("--strategies needs turn states captured from a --replay")
+        results = run_turn_benchmarks(args.strategies, config, captured_boards(positions, args.positions), args.repeat)
+        for result in results:
+            print("{:<40} median {:>10.3f} ms  max {:>10.3f} ms  peak {:>8.1f} KiB  retained {:>7} blocks".format(
+                result.name, result.median * 1000, max(result.samples) * 1000, result.peak_bytes / 1024, result.retained_blocks))
+    else:
+        boards = synthetic_boards(config, args.seed)
+        boards.update(captured_boards(positions, args.positions))
+        results = run_benchmarks(config, boards, args.only, args.repeat, args.min_time)
+        for result in results:
+            print("{:<40} median {:>10.3f} ms  p95 {:>10.3f} ms  {:>10.1f} ops/s".format(
+                result.name, result.median * 1000, result.p95 * 1000, result.ops_per_sec))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results_document(results), file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, before, after in regressions:
+            print("Regression: {} {:.3f} ms -> {:.3f} ms ({:+.0%})".format(name, before * 1000, after * 1000, after / before - 1))
+        if regressions:
+            return 1
+        print("No regressions over {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
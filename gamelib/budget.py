@@ -0,0 +1,188 @@
+import json
+import time
+
+from .util import debug_write
+from . import telemetry
+
+DEFAULT_TURN_LIMIT = 5.0
+SAFETY_MARGIN = 0.25
+OVERHEAD_HISTORY = 10
+
+
+def default_turn_limit(config):
+    """Gets the engine's soft time limit for a turn in seconds
+
+    Args:
+        config: The game config, may be None
+
+    Returns:
+        The waitTimeBotSoft value of the config in seconds, or DEFAULT_TURN_LIMIT if the config does not have one
+
+    """
+    timing = (config or {}).get("timingAndReplay", {})
+    if "waitTimeBotSoft" in timing:
+        return timing["waitTimeBotSoft"] / 1000
+    return DEFAULT_TURN_LIMIT
+
+def parse_player_time(message, stats_key=b'"p1Stats"'):
+    """Reads the time a player took on their previous turn from a raw turn message without parsing the whole message
+
+    Args:
+        message: The raw turn message as bytes
+        stats_key: The stats entry to read, p1Stats for yourself
+
+    Returns:
+        The reported time in milliseconds, or None if the message has no stats
+
+    """
+    start = message.find(stats_key)
+    if start == -1:
+        return None
+    start = message.find(b"[", start)
+    end = message.find(b"]", start)
+    try:
+        return float(json.loads(message[start:end + 1])[3])
+    except (ValueError, IndexError):
+        return None
+
+
+class TurnBudget:
+    """Tracks how much of a turn's time budget is left.
+
+    Attributes :
+        * limit (float): The number of seconds this turn may take
+        * started (float): The time.perf_counter() value when the turn started
+
+    """
+    def __init__(self, limit, started=None):
+        self.limit = limit
+        self.started = time.perf_counter() if started is None else started
+
+    def elapsed(self):
+        """Returns the number of seconds since the turn started
+        """
+        return time.perf_counter() - self.started
+
+    def remaining(self):
+        """Returns the number of seconds left in the budget, never negative
+        """
+        return max(self.limit - self.elapsed(), 0.0)
+
+    def should_stop(self, reserve=0.0):
+        """Checks if expensive work should stop now
+
+        Args:
+            reserve: Seconds that must still be left afterwards, for example to finish up and submit the turn
+
+        Returns:
+            True if less than reserve seconds are left
+
+        """
+        return self.remaining() <= reserve
+
+
+class TurnTimer:
+    """Builds each turn's TurnBudget from a time limit and the turn times the engine reported.
+
+    The engine measures a turn from when it sends the state until it receives our commands,
+    so it includes time we can't see, like transport and interpreter overhead.
+    The largest recent difference between the engine's time and our own measurement is
+    kept out of the budget, along with a fixed safety margin.
+
+    Attributes :
+        * limit (float): The time limit of a turn in seconds
+        * safety_margin (float): Seconds always kept out of the budget
+        * overheads (list): Recent overheads in seconds, most recent last
+
+    """
+    def __init__(self, limit, safety_margin=SAFETY_MARGIN):
+        self.limit = limit
+        self.safety_margin = safety_margin
+        self.overheads = []
+        self._last_duration = None
+
+    def start_turn(self, reported_time=None, started=None):
+        """Creates the budget of a new turn
+
+        Args:
+            reported_time: The time in milliseconds the engine reported for our previous turn (GameState.my_time)
+            started: The time.perf_counter() value when the turn message was received
+
+        Returns:
+            A TurnBudget for this turn
+
+        """
+        if reported_time and self._last_duration is not None:
+            self.overheads.append(max(reported_time / 1000 - self._last_duration, 0.0))
+            del self.overheads[:-OVERHEAD_HISTORY]
+        self._last_duration = None
+        overhead = max(self.overheads) if self.overheads else 0.0
+        return TurnBudget(max(self.limit - overhead - self.safety_margin, 0.0), started)
+
+    def end_turn(self, budget):
+        """Records how long a turn took by our own measurement
+
+        Args:
+            budget: The budget returned by start_turn for this turn
+
+        """
+        self._last_duration = budget.elapsed()
+
+
+class PlanningStages:
+    """A registry of planning stages that run in priority order while a TurnBudget lasts.
+
+    A stage is a function taking (game_state, budget) and returning its result.
+    Stages doing long searches should check budget.should_stop() and return the best result found so far,
+    so they can be cut short instead of running over time.
+
+    """
+    def __init__(self):
+        self._stages = []
+
+    def register(self, name, func, priority=0, min_time=0.0):
+        """Adds a planning stage
+
+        Args:
+            name: A name for the stage, used as its key in the results
+            func: The function to run, called with (game_state, budget)
+            priority: Stages with a higher priority run first. Stages with the same priority run in registration order
+            min_time: The stage is skipped if fewer than this many seconds are left when it is reached
+
+        """
+        self._stages.append((-priority, len(self._stages), name, func, min_time))
+        self._stages.sort(key=lambda stage: stage[:2])
+
+    def unregister(self, name):
+        """Removes every planning stage with the given name
+        """
+        self._stages = [stage for stage in self._stages if stage[2] != name]
+
+    def names(self):
+        """Returns the stage names in the order they run
+        """
+        return [stage[2] for stage in self._stages]
+
+    def run(self, game_state, budget):
+        """Runs the stages in priority order until the budget runs out
+
+        Args:
+            game_state: The GameState passed to every stage
+            budget: The TurnBudget of this turn
+
+        Returns:
+            A dict of the results of the stages that ran, by name
+
+        """
+        results = {}
+        skipped = []
+        for _, _, name, func, min_time in self._stages:
+            if budget.should_stop(min_time):
+                skipped.append(name)
+                continue
+            with telemetry.span("stage:" + name):
+                results[name] = func(game_state, budget)
+        if skipped:
+            debug_write("Turn budget ran out, skipped planning stages: {}".format(", ".join(skipped)))
+            telemetry.mark("planning_stages_skipped", {"stages": skipped})
+        return results
@@ -0,0 +1,287 @@
+"""
+A registry of the caches of gamelib and of strategies, sharing one memory budget.
+
+Every cache registers a name, an eviction policy and optionally a size estimator, and then behaves like a
+small dict with hit, miss and eviction counters:
+
+    paths = gamelib.cache.register("attack_paths", policy=gamelib.cache.PER_TURN)
+    path = paths.get_or_compute(start, lambda: game_state.find_path_to_edge(start))
+
+The policies are:
+
+    * LRU: Entries stay until the memory budget or the cache's max_entries needs room, least recently used first
+    * PER_TURN: Entries are also dropped at the start of every turn
+    * PER_BOARD: Entries belong to the board set with set_board, and are dropped when a different board is set
+
+The sizes of all entries are estimated when they are stored, and when the total goes over the registry's
+budget the least recently used entries of any cache are evicted. AlgoCore clears every cache before
+on_game_start and drops PER_TURN entries before on_turn. The budget can be set in bytes with the
+GAMELIB_CACHE_BUDGET environment variable.
+
+Caches are used from the precompute worker thread and from executor threads as well as from on_turn, so the
+registry and all of its caches share one lock. Values are computed by get_or_compute without holding it.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from .util import debug_write
+
+LRU = "lru"
+PER_TURN = "turn"
+PER_BOARD = "board"
+POLICIES = (LRU, PER_TURN, PER_BOARD)
+CACHE_BUDGET_ENV = "GAMELIB_CACHE_BUDGET"
+DEFAULT_BUDGET = 256 << 20
+_MISSING = object()
+
+
+def estimate_size(value, _seen=None):
+    """Estimates the bytes used by a value, following containers. Arrays count their buffer's nbytes.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return size + nbytes
+    if isinstance(value, dict):
+        size += sum(estimate_size(key, _seen) + estimate_size(item, _seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in value)
+    return size
+
+
+def _entry_size(key, value):
+    return estimate_size(key) + estimate_size(value)
+
+
+class Cache:
+    """A named cache in a CacheRegistry.
+
+    Attributes :
+        * name (string): The name the cache was registered with
+        * policy (string): LRU, PER_TURN or PER_BOARD
+        * max_entries (int): The most entries kept, None for no limit besides the registry's budget
+        * board: The board entries belong to, for PER_BOARD caches
+        * hits (int): Lookups that found an entry
+        * misses (int): Lookups that did not
+        * evictions (int): Entries dropped to make room, or because their turn or board was over
+        * size (int): The estimated bytes of the entries
+
+    """
+    def __init__(self, registry, name, size_estimator=None, policy=LRU, max_entries=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown cache policy {}, expected one of {}".format(policy, POLICIES))
+        self.registry = registry
+        self.name = name
+        self.policy = policy
+        self.max_entries = max_entries
+        self.board = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._size_estimator = size_estimator or _entry_size
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Gets the value stored for key, counting a hit or a miss
+        """
+        with self.registry._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            entry[2] = self.registry._tick()
+            return entry[0]
+
+    def put(self, key, value):
+        """Stores a value, evicting other entries if the cache or the registry is full
+        """
+        size = self._size_estimator(key, value)
+        with self.registry._lock:
+            old = self._entries.pop(key, _MISSING)
+            if old is not _MISSING:
+                self.size -= old[1]
+                self.registry._charge(-old[1])
+            self._entries[key] = [value, size, self.registry._tick()]
+            self.size += size
+            self.registry._charge(size)
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self.evict_oldest()
+            self.registry._enforce_budget()
+
+    def get_or_compute(self, key, compute):
+        """Gets the value stored for key, or stores and returns compute() if there is none
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def evict_oldest(self):
+        """Drops the least recently used entry
+        """
+        with self.registry._lock:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            self.registry._charge(-size)
+
+    def set_board(self, board):
+        """Sets the board the entries of a PER_BOARD cache belong to, dropping them if it changed
+
+        Args:
+            board: Any hashable identifying the board, like a hash of its structures
+
+        """
+        with self.registry._lock:
+            if board != self.board:
+                self.clear(evicted=True)
+                self.board = board
+
+    def clear(self, evicted=False):
+        """Drops every entry. They count as evictions if evicted is True
+        """
+        with self.registry._lock:
+            if evicted:
+                self.evictions += len(self._entries)
+            self.registry._charge(-self.size)
+            self._entries.clear()
+            self.size = 0
+
+    def oldest_use(self):
+        """The registry's use counter of the least recently used entry, None if the cache is empty
+        """
+        for entry in self._entries.values():
+            return entry[2]
+        return None
+
+    def stats(self):
+        with self.registry._lock:
+            lookups = self.hits + self.misses
+            return {"policy": self.policy, "entries": len(self._entries), "size": self.size, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class CacheRegistry:
+    """Holds every cache and keeps their total estimated size within a budget.
+
+    Attributes :
+        * budget (int): The most bytes all caches may use together
+        * caches (dict): The registered caches by name
+        * size (int): The estimated bytes used by all caches
+
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.caches = {}
+        self.size = 0
+        self._clock = 0
+        # Reentrant, since cache methods holding it call each other and the registry
+        self._lock = threading.RLock()
+
+    def register(self, name, size_estimator=None, policy=LRU, max_entries=None):
+        """Registers a cache, or returns the cache already registered with that name
+
+        Args:
+            name: The cache's name, shown in stats
+            size_estimator: A function of (key, value) returning the entry's size in bytes. Estimated with estimate_size by default
+            policy: LRU, PER_TURN or PER_BOARD
+            max_entries: The most entries the cache keeps, None for no limit besides the budget
+
+        Returns:
+            The Cache
+
+        """
+        with self._lock:
+            cache = self.caches.get(name)
+            if cache is None:
+                cache = Cache(self, name, size_estimator, policy, max_entries)
+                self.caches[name] = cache
+            return cache
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _charge(self, size):
+        self.size += size
+
+    def _enforce_budget(self):
+        while self.size > self.budget:
+            oldest = None
+            oldest_use = None
+            for cache in self.caches.values():
+                use = cache.oldest_use()
+                if use is not None and (oldest_use is None or use < oldest_use):
+                    oldest, oldest_use = cache, use
+            if oldest is None:
+                return
+            oldest.evict_oldest()
+
+    def begin_turn(self):
+        """Drops the entries of every PER_TURN cache
+        """
+        with self._lock:
+            for cache in self.caches.values():
+                if cache.policy == PER_TURN and len(cache):
+                    cache.clear(evicted=True)
+
+    def clear(self):
+        """Drops every entry of every cache and resets the counters, for a new game
+        """
+        with self._lock:
+            for cache in self.caches.values():
+                cache.clear()
+                cache.board = None
+                cache.hits = cache.misses = cache.evictions = 0
+            self.size = 0
+
+    def stats(self):
+        """Returns the stats of every cache by name
+        """
+        with self._lock:
+            return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def summary(self):
+        lines = ["Caches use {:.1f} of {:.1f} MiB".format(self.size / (1 << 20), self.budget / (1 << 20))]
+        for name, stats in self.stats().items():
+            lines.append("  {}: {} entries, {:.1f} KiB, {:.0%} hits of {} lookups, {} evictions".format(
+                name, stats["entries"], stats["size"] / 1024, stats["hit_rate"], stats["hits"] + stats["misses"], stats["evictions"]))
+        return lines
+
+
+def _environment_budget():
+    text = os.environ.get(CACHE_BUDGET_ENV)
+    if not text:
+        return DEFAULT_BUDGET
+    try:
+        return int(text)
+    except ValueError:
+        debug_write("Invalid {} {}, using {} bytes".format(CACHE_BUDGET_ENV, text, DEFAULT_BUDGET))
+        return DEFAULT_BUDGET
+
+
+registry = CacheRegistry(_environment_budget())
+
+
+def register(name, size_estimator=None, policy=LRU, max_entries=None):
+    """Registers a cache in the shared registry, see CacheRegistry.register
+    """
+    return registry.register(name, size_estimator, policy, max_entries)
@@ -0,0 +1,251 @@
+"""
+A columnar, memory-mapped format for many recorded games.
+
+Parsing the JSON of every message again for each analysis is slow, so recordings are converted once
+into a corpus directory of fixed width record arrays that can be memory-mapped and scanned without copying:
+
+    * states.bin: One row per turn state or action frame, with the players' stats and offsets into the other arrays
+    * units.bin: Every unit of every state, the rows of a state are contiguous
+    * events.bin: Every event of every state, the rows of a state are contiguous
+    * index.json: The games in the corpus, the number of rows of each array, and the format version
+
+Convert recordings with the command below. Running it again on the same directory adds the new games to the corpus.
+
+    python -m gamelib.corpus CORPUS_DIRECTORY game1.replay.gz game2.replay.gz ...
+
+NumPy is required for this module.
+"""
+import os
+import sys
+import json
+
+import numpy as np
+
+from .algocore import parse_turn_type
+from .replay import read_messages
+
+CORPUS_VERSION = 1
+TURN_STATE_FRAME = -1
+NO_ID = -1
+
+STATE_DTYPE = np.dtype([
+    ("game", "<u4"), ("turn", "<i4"), ("frame", "<i4"),
+    ("p1_health", "<f4"), ("p1_sp", "<f4"), ("p1_mp", "<f4"), ("p1_time", "<f4"),
+    ("p2_health", "<f4"), ("p2_sp", "<f4"), ("p2_mp", "<f4"), ("p2_time", "<f4"),
+    ("unit_start", "<u8"), ("unit_count", "<u4"), ("event_start", "<u8"), ("event_count", "<u4"),
+])
+UNIT_DTYPE = np.dtype([
+    ("state", "<u4"), ("player", "u1"), ("type", "u1"), ("x", "u1"), ("y", "u1"), ("health", "<f4"), ("id", "<i8"),
+])
+EVENT_DTYPE = np.dtype([
+    ("state", "<u4"), ("kind", "u1"), ("player", "u1"), ("type", "i1"), ("x", "u1"), ("y", "u1"),
+    ("target_x", "i1"), ("target_y", "i1"), ("amount", "<f4"), ("id", "<i8"), ("target_id", "<i8"),
+])
+ARRAYS = {"states": STATE_DTYPE, "units": UNIT_DTYPE, "events": EVENT_DTYPE}
+
+# Where the fields of each kind of engine event are: (amount, unit type, id, target id, player, target location), None if absent
+EVENT_FIELDS = {
+    "spawn": (None, 1, 2, None, 3, None),
+    "move": (None, 3, 4, None, 5, 1),
+    "breach": (1, 2, 3, None, 4, None),
+    "damage": (1, 2, 3, None, 4, None),
+    "death": (None, 1, 2, None, 3, None),
+    "attack": (2, 3, 4, 5, 6, 1),
+    "shield": (2, 3, 4, 5, 6, 1),
+    "selfDestruct": (2, 3, 4, None, 5, None),
+    "melee": (2, 3, 4, 5, 6, 1),
+}
+EVENT_KINDS = tuple(EVENT_FIELDS)
+
+
+def _parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return NO_ID
+
+
+class CorpusWriter:
+    """Converts recorded games into a corpus directory, appending to the arrays as it goes
+    so memory use does not grow with the size of the corpus. Games are added after those
+    already in an existing corpus directory.
+
+    Attributes :
+        * directory (string): The corpus directory
+        * games (list): The names of the games added so far
+        * counts (dict): The number of rows written to each array
+
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.games = []
+        self.counts = {name: 0 for name in ARRAYS}
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as file:
+                index = json.load(file)
+            if index["version"] != CORPUS_VERSION:
+                raise ValueError("Corpus version {} is not supported, expected {}".format(index["version"], CORPUS_VERSION))
+            self.games = index["games"]
+            self.counts = index["counts"]
+        self._files = {}
+        for name, dtype in ARRAYS.items():
+            path = os.path.join(directory, name + ".bin")
+            size = self.counts[name] * dtype.itemsize
+            if size and (not os.path.exists(path) or os.path.getsize(path) < size):
+                raise ValueError("{} is shorter than the {} rows in the corpus index".format(path, self.counts[name]))
+            # Rows written after the index by an unfinished conversion are dropped
+            file = open(path, "ab")
+            file.truncate(size)
+            self._files[name] = file
+
+    def add_recording(self, path, name=None):
+        """Adds the game in a replay file or a file with one engine message per line
+        """
+        self.add_messages(read_messages(path), name or os.path.basename(path))
+
+    def add_messages(self, messages, name):
+        """Adds a game from its engine messages
+
+        Args:
+            messages: An iterable of messages as bytes, in the order they were received
+            name: A name to find the game by
+
+        """
+        game = len(self.games)
+        self.games.append(name)
+        states = []
+        units = []
+        events = []
+        for message in messages:
+            if b"replaySave" in message or parse_turn_type(message) not in (0, 1):
+                continue
+            self._add_state(game, json.loads(message), states, units, events)
+        self._append("states", states)
+        self._append("units", units)
+        self._append("events", events)
+
+    def _add_state(self, game, state, states, units, events):
+        index = self.counts["states"] + len(states)
+        unit_start = self.counts["units"] + len(units)
+        event_start = self.counts["events"] + len(events)
+        for player, key in ((0, "p1Units"), (1, "p2Units")):
+            for unit_type, entries in enumerate(state.get(key, [])):
+                for entry in entries:
+                    units.append((index, player, unit_type, entry[0], entry[1], entry[2], _parse_id(entry[3])))
+        for kind_index, kind in enumerate(EVENT_KINDS):
+            amount, unit_type, unit_id, target_id, player, target = EVENT_FIELDS[kind]
+            for entry in state.get("events", {}).get(kind, []):
+                try:
+                    target_location = entry[target] if target is not None else [-1, -1]
+                    if not isinstance(target_location, list) or len(target_location) != 2:
+                        target_location = [-1, -1]
+                    events.append((
+                        index, kind_index, entry[player] - 1, entry[unit_type], entry[0][0], entry[0][1],
+                        target_location[0], target_location[1],
+                        entry[amount] if amount is not None else 0.0,
+                        _parse_id(entry[unit_id]),
+                        _parse_id(entry[target_id]) if target_id is not None else NO_ID,
+                    ))
+                except (IndexError, TypeError):
+                    continue
+        turn_info = state.get("turnInfo", [0, 0, 0])
+        p1 = (state.get("p1Stats", []) + [0, 0, 0, 0])[:4]
+        p2 = (state.get("p2Stats", []) + [0, 0, 0, 0])[:4]
+        frame = turn_info[2] if turn_info[0] == 1 else TURN_STATE_FRAME
+        states.append((game, turn_info[1], frame, *p1, *p2,
+                       unit_start, self.counts["units"] + len(units) - unit_start,
+                       event_start, self.counts["events"] + len(events) - event_start))
+
+    def _append(self, name, rows):
+        if rows:
+            self._files[name].write(np.array(rows, dtype=ARRAYS[name]).tobytes())
+            self.counts[name] += len(rows)
+
+    def close(self):
+        """Writes the index and closes the arrays
+        """
+        for file in self._files.values():
+            file.close()
+        index = {
+            "version": CORPUS_VERSION,
+            "games": self.games,
+            "counts": self.counts,
+            "dtypes": {name: dtype.descr for name, dtype in ARRAYS.items()},
+        }
+        with open(os.path.join(self.directory, "index.json"), "w") as file:
+            json.dump(index, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayCorpus:
+    """Read only, memory-mapped access to a corpus directory.
+
+    Attributes :
+        * directory (string): The corpus directory
+        * games (list): The names of the games, a state's game column indexes this list
+        * states (numpy.memmap): The STATE_DTYPE rows of every turn state and action frame
+        * units (numpy.memmap): The UNIT_DTYPE rows of every unit
+        * events (numpy.memmap): The EVENT_DTYPE rows of every event
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as file:
+            index = json.load(file)
+        if index["version"] != CORPUS_VERSION:
+            raise ValueError("Corpus version {} is not supported, expected {}".format(index["version"], CORPUS_VERSION))
+        self.games = index["games"]
+        for name, dtype in ARRAYS.items():
+            count = index["counts"][name]
+            if count:
+                array = np.memmap(os.path.join(directory, name + ".bin"), dtype=dtype, mode="r", shape=(count,))
+            else:
+                array = np.zeros(0, dtype=dtype)
+            setattr(self, name, array)
+
+    def state_units(self, state):
+        """Gets the unit rows of a state, as a view into the memory map
+        """
+        row = self.states[state]
+        return self.units[int(row["unit_start"]):int(row["unit_start"]) + int(row["unit_count"])]
+
+    def state_events(self, state, kind=None):
+        """Gets the event rows of a state, optionally only those of one kind like "breach"
+        """
+        row = self.states[state]
+        events = self.events[int(row["event_start"]):int(row["event_start"]) + int(row["event_count"])]
+        if kind is not None:
+            events = events[events["kind"] == EVENT_KINDS.index(kind)]
+        return events
+
+    def turn_states(self, game=None):
+        """Gets the indexes of the turn state rows, the states at the start of each turn, of one game or of all of them
+        """
+        mask = self.states["frame"] == TURN_STATE_FRAME
+        if game is not None:
+            mask &= self.states["game"] == game
+        return np.flatnonzero(mask)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python -m gamelib.corpus CORPUS_DIRECTORY RECORDING [RECORDING ...]")
+        return 2
+    with CorpusWriter(argv[0]) as writer:
+        for path in argv[1:]:
+            writer.add_recording(path)
+    print("{} now has {} games, {} states, {} units and {} events".format(
+        argv[0], len(writer.games), writer.counts["states"], writer.counts["units"], writer.counts["events"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Offline replay driver that plays a recorded game through a strategy without the engine.
+
+The strategy file is imported, its AlgoStrategy is created, and every recorded message is handled
+in this process exactly as AlgoCore.start would, except that the submitted commands are captured
+instead of written to stdout. It reports how long turns and action frames took and the peak memory used,
+and can compare the commands with the ones recorded in the replay:
+
+    python -m gamelib.driver wpa.py game.replay.gz --compare
+
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+import importlib.util
+import tracemalloc
+
+from .algocore import parse_turn_type
+from .replay import read_replay, read_messages, INPUT, OUTPUT, GZIP_MAGIC
+from .util import set_recorder, flush_debug
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, q):
+    """Gets the q-th percentile of a list of values, interpolating between the nearest ranks
+
+    Args:
+        values: A list of numbers
+        q: The percentile, from 0 to 100
+
+    Returns:
+        The percentile, or 0.0 if there are no values
+
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def load_strategy(path, class_name="AlgoStrategy"):
+    """Imports a strategy file and gets its algo class, without running its __main__ block
+
+    Args:
+        path: The path of the strategy file, like wpa.py
+        class_name: The name of the algo class in the file
+
+    Returns:
+        The algo class
+
+    """
+    path = os.path.abspath(path)
+    # Strategies import gamelib from the folder they are in
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module_name = "strategy_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, class_name)
+
+
+def read_recording(path):
+    """Reads the messages and recorded commands of a recording
+
+    Args:
+        path: A replay file, or a plain text file with one message per line
+
+    Returns:
+        A (messages, commands) tuple. commands is a list of [build, deploy] pairs, empty for plain text recordings
+
+    """
+    with open(path, "rb") as recording:
+        compressed = recording.read(2) == GZIP_MAGIC
+    if not compressed:
+        return list(read_messages(path)), []
+    messages = []
+    outputs = []
+    for kind, _, payload in read_replay(path):
+        if kind == INPUT:
+            messages.append(payload)
+        elif kind == OUTPUT:
+            outputs.append(payload.decode("utf-8"))
+    return messages, [outputs[index:index + 2] for index in range(0, len(outputs) - 1, 2)]
+
+
+class CommandCapture:
+    """Collects the commands an algo sends, in place of a ReplayRecorder.
+
+    Attributes :
+        * commands (list): Every command sent, in order
+
+    """
+    def __init__(self):
+        self.commands = []
+
+    def record_output(self, command):
+        self.commands.append(command)
+
+    def turns(self):
+        """Returns the captured commands as [build, deploy] pairs
+        """
+        return [self.commands[index:index + 2] for index in range(0, len(self.commands) - 1, 2)]
+
+
+class DriverReport:
+    """What happened when a recording was played through a strategy.
+
+    Attributes :
+        * turn_times (list): Seconds each turn took, in order
+        * frame_times (list): Seconds each action frame took, in order
+        * total_time (float): Seconds taken by the whole game
+        * peak_memory (int): The most bytes allocated by Python at once while traced, or None if memory was not traced
+        * commands (list): The [build, deploy] commands submitted each turn
+        * mismatched_turns (list): Indexes of the turns whose commands differ from the recorded ones
+        * compared_turns (int): The number of turns compared with recorded commands
+
+    """
+    def __init__(self):
+        self.turn_times = []
+        self.frame_times = []
+        self.total_time = 0.0
+        self.peak_memory = None
+        self.commands = []
+        self.mismatched_turns = []
+        self.compared_turns = 0
+
+    def compare(self, recorded_commands):
+        """Compares the submitted commands with recorded ones, turn by turn
+        """
+        self.compared_turns = min(len(recorded_commands), len(self.commands))
+        self.mismatched_turns = [index for index in range(self.compared_turns)
+                                 if self.commands[index] != recorded_commands[index]]
+
+    def summary(self):
+        """Returns the report as readable lines of text
+        """
+        lines = ["Played {} turns and {} action frames in {:.3f}s".format(len(self.turn_times), len(self.frame_times), self.total_time)]
+        for name, times in (("Turn", self.turn_times), ("Frame", self.frame_times)):
+            if times:
+                lines.append("{} latency ms: {}, max {:.2f}".format(name, ", ".join(
+                    "p{} {:.2f}".format(q, percentile(times, q) * 1000) for q in PERCENTILES), max(times) * 1000))
+        if self.peak_memory is not None:
+            lines.append("Peak traced memory: {:.1f} MiB".format(self.peak_memory / (1 << 20)))
+        if self.compared_turns:
+            lines.append("Commands matched the recording on {} of {} turns".format(
+                self.compared_turns - len(self.mismatched_turns), self.compared_turns))
+            if self.mismatched_turns:
+                lines.append("First differing turn: {}".format(self.mismatched_turns[0]))
+        return lines
+
+
+class ReplayDriver:
+    """Plays recorded engine messages through an algo in this process.
+
+    Attributes :
+        * algo (AlgoCore): The algo being driven
+        * trace_memory (bool): Whether to measure peak memory with tracemalloc, which slows the algo down
+        * show_debug (bool): Whether the algo's debug output goes to stderr, it is discarded otherwise
+
+    """
+    def __init__(self, algo, trace_memory=False, show_debug=False):
+        self.algo = algo
+        self.trace_memory = trace_memory
+        self.show_debug = show_debug
+
+    def run(self, messages, recorded_commands=None):
+        """Handles every message the way AlgoCore.start would, until the end of the game
+
+        Args:
+            messages: The recorded messages as bytes
+            recorded_commands: [build, deploy] pairs to compare the submitted commands with
+
+        Returns:
+            A DriverReport
+
+        """
+        report = DriverReport()
+        capture = CommandCapture()
+        set_recorder(capture)
+        sink = open(os.devnull, "w")
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(sink), contextlib.ExitStack() as stack:
+                if not self.show_debug:
+                    stack.enter_context(contextlib.redirect_stderr(sink))
+                for message in messages:
+                    turn_type = None if b"replaySave" in message else parse_turn_type(message)
+                    message_started = time.perf_counter()
+                    running = self.algo._handle_message(message)
+                    elapsed = time.perf_counter() - message_started
+                    if turn_type == 0:
+                        report.turn_times.append(elapsed)
+                    elif turn_type == 1:
+                        report.frame_times.append(elapsed)
+                    if not running:
+                        break
+                flush_debug()
+        finally:
+            report.total_time = time.perf_counter() - started
+            if self.trace_memory:
+                report.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            set_recorder(None)
+            sink.close()
+        report.commands = capture.turns()
+        if recorded_commands:
+            report.compare(recorded_commands)
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.driver", description="Play a recorded game through a strategy without the engine")
+    parser.add_argument("strategy", help="The strategy file, like wpa.py")
+    parser.add_argument("recordings", nargs="+", help="Replay files or files with one engine message per line")
+    parser.add_argument("--compare", action="store_true", help="Compare the submitted commands with the recorded ones")
+    parser.add_argument("--memory", action="store_true", help="Measure peak memory with tracemalloc")
+    parser.add_argument("--debug", action="store_true", help="Show the strategy's debug output")
+    parser.add_argument("--seed", type=int, default=None, help="Seed the random module before each game")
+    args = parser.parse_args(argv)
+
+    strategy = load_strategy(args.strategy)
+    for path in args.recordings:
+        messages, commands = read_recording(path)
+        if args.seed is not None:
+            random.seed(args.seed)
+        driver = ReplayDriver(strategy(), trace_memory=args.memory, show_debug=args.debug)
+        report = driver.run(messages, commands if args.compare else None)
+        print(path)
+        for line in report.summary():
+            print("  " + line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
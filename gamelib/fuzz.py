@@ -0,0 +1,379 @@
+"""
+Differential fuzzing of faster pathing and targeting against the reference implementations.
+
+Every faster implementation has to give exactly the answers of the engine-faithful ones in GameState.
+The fuzzer draws random legal boards, with structures of both players, upgrades and stacks of mobile
+units, and asks every registered implementation the same questions as the reference:
+
+    * path: The path from a start location, against GameState.find_path_to_edge (ShortestPathFinder)
+    * target: The target of a unit on the board, against GameState.get_target
+    * attackers: The units attacking a location, against GameState.get_attackers
+
+Implementations are registered in CANDIDATES by kind, as a function that takes a GameState and returns
+a function answering one question. A board that gets a different answer is shrunk, by removing units
+while the answer still differs, and reported with the question:
+
+    python -m gamelib.fuzz --config game.replay.gz --boards 500 --seed 1
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+
+from .benchmark import arena_locations, random_board
+from .game_state import GameState
+from .mock_engine import load_config
+from .navigation import FieldPathFinder
+from .simulator import ActionPhaseSimulator
+
+DEFAULT_BOARDS = 200
+DEFAULT_QUERIES = 8
+DEFAULT_MAX_FAILURES = 5
+MAX_STRUCTURES = 150
+MAX_MOBILE_STACKS = 12
+KINDS = ("path", "target", "attackers")
+
+
+def board_entries(state):
+    """Splits a turn state into its unit entries, the pieces a failing board is shrunk by
+
+    Returns:
+        A list of (player index, unit type index, [x, y, health, id]) tuples
+
+    """
+    parsed = json.loads(state)
+    return [(player_index, type_index, entry) for player_index, key in enumerate(("p1Units", "p2Units"))
+            for type_index, entries in enumerate(parsed[key]) for entry in entries]
+
+
+def board_state(entries, turn=10):
+    """Builds a turn state from unit entries
+    """
+    units = [[[] for _ in range(8)], [[] for _ in range(8)]]
+    for player_index, type_index, entry in entries:
+        units[player_index][type_index].append(entry)
+    stats = [30, 25.0, 12.0, 0]
+    return json.dumps({"p1Units": units[0], "p2Units": units[1], "turnInfo": [0, turn, -1],
+                       "p1Stats": stats, "p2Stats": stats, "events": {}})
+
+
+def unit_key(game_state, unit):
+    """Identifies a unit of a game state across copies of the board: its location, owner, type,
+    and how many units of the same owner and type are before it on its tile
+    """
+    if unit is None:
+        return None
+    same = [other for other in game_state.game_map[unit.x, unit.y]
+            if other.player_index == unit.player_index and other.unit_type == unit.unit_type]
+    return unit.x, unit.y, unit.player_index, unit.unit_type, next(index for index, other in enumerate(same) if other is unit)
+
+
+def find_unit(game_state, key):
+    """Finds the unit a unit_key identifies, or None if the board has no such unit
+    """
+    x, y, player_index, unit_type, index = key
+    same = [unit for unit in game_state.game_map[x, y] if unit.player_index == player_index and unit.unit_type == unit_type]
+    return same[index] if index < len(same) else None
+
+
+def reference_paths(game_state):
+    return game_state.find_path_to_edge
+
+
+def reference_targets(game_state):
+    return lambda key: unit_key(game_state, game_state.get_target(find_unit(game_state, key)))
+
+
+def reference_attackers(game_state):
+    def attackers(query):
+        location, player_index = query
+        return sorted(unit_key(game_state, unit) for unit in game_state.get_attackers(location, player_index))
+    return attackers
+
+
+def field_paths(game_state):
+    return FieldPathFinder.from_game_state(game_state).get_path
+
+
+def simulator_targets(game_state):
+    """Targets chosen by ActionPhaseSimulator, on SimUnits made from every unit of the board
+    """
+    simulator = ActionPhaseSimulator(game_state)
+    size = game_state.ARENA_SIZE
+    structure_grid = [[None] * size for _ in range(size)]
+    mobile_grid = [[[] for _ in range(size)] for _ in range(size)]
+    sim_units = {}
+    keys = {}
+    for location in game_state.game_map:
+        for unit in game_state.game_map[location]:
+            sim_unit = simulator._sim_unit(unit)
+            sim_units[unit_key(game_state, unit)] = sim_unit
+            keys[id(sim_unit)] = unit_key(game_state, unit)
+            if unit.stationary:
+                structure_grid[unit.x][unit.y] = sim_unit
+            else:
+                mobile_grid[unit.x][unit.y].append(sim_unit)
+    find_target = simulator.target_finder(structure_grid, mobile_grid)
+
+    def target(key):
+        chosen = find_target(sim_units[key])
+        return None if chosen is None else keys[id(chosen)]
+    return target
+
+
+def scan_attackers(game_state):
+    """Attackers found by checking the range of every unit on the board, the definition get_attackers speeds up
+    """
+    units = [unit for location in game_state.game_map for unit in game_state.game_map[location]
+             if unit.damage_i + unit.damage_f > 0]
+
+    def attackers(query):
+        location, player_index = query
+        return sorted(unit_key(game_state, unit) for unit in units if unit.player_index != player_index
+                      and game_state.game_map.distance_between_locations(location, [unit.x, unit.y]) <= unit.attackRange)
+    return attackers
+
+
+REFERENCES = {"path": reference_paths, "target": reference_targets, "attackers": reference_attackers}
+CANDIDATES = {
+    "path": {"field": field_paths},
+    "target": {"simulator": simulator_targets},
+    "attackers": {"scan": scan_attackers},
+}
+
+
+class Failure:
+    """A question an implementation answered differently from the reference.
+
+    Attributes :
+        * kind (string): "path", "target" or "attackers"
+        * candidate (string): The name of the implementation
+        * query: The question, a start location, a unit_key of the attacker, or a (location, player index) pair
+        * expected: The reference answer on the shrunk board
+        * actual: The implementation's answer on the shrunk board
+        * entries (list): The unit entries of the shrunk board
+        * original_size (int): The number of unit entries of the board before shrinking
+
+    """
+    def __init__(self, kind, candidate, query, expected, actual, entries, original_size):
+        self.kind = kind
+        self.candidate = candidate
+        self.query = query
+        self.expected = expected
+        self.actual = actual
+        self.entries = entries
+        self.original_size = original_size
+
+    def summary(self):
+        return [
+            "{} {} differs for {} on a board of {} units, shrunk from {}:".format(
+                self.candidate, self.kind, self.query, len(self.entries), self.original_size),
+            "  expected {}".format(self.expected),
+            "  got      {}".format(self.actual),
+            "  board    {}".format(board_state(self.entries)),
+        ]
+
+
+class FuzzReport:
+    """What a fuzzing run checked and found.
+
+    Attributes :
+        * boards (int): The number of boards drawn
+        * cases (dict): The number of questions compared, by kind
+        * failures (list): A shrunk Failure for each differing answer found, up to the fuzzer's max_failures
+        * elapsed (float): Seconds the run took, not counting shrinking
+
+    """
+    def __init__(self):
+        self.boards = 0
+        self.cases = {kind: 0 for kind in KINDS}
+        self.failures = []
+        self.elapsed = 0.0
+
+    def cases_per_second(self):
+        return sum(self.cases.values()) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        lines = ["Compared {} answers on {} boards in {:.1f}s, {:.0f} per second".format(
+            sum(self.cases.values()), self.boards, self.elapsed, self.cases_per_second())]
+        lines.append("  " + ", ".join("{} {}".format(kind, count) for kind, count in self.cases.items()))
+        for failure in self.failures:
+            lines.extend(failure.summary())
+        if not self.failures:
+            lines.append("Every implementation matched the reference")
+        return lines
+
+
+class DifferentialFuzzer:
+    """Compares registered implementations with the reference ones on random boards.
+
+    Attributes :
+        * config (JSON): The game config
+        * candidates (dict): The implementations to check, by kind and name, CANDIDATES by default
+        * queries (int): The questions of each kind asked per board
+        * max_failures (int): The run stops after this many failures
+
+    """
+    def __init__(self, config, candidates=None, queries=DEFAULT_QUERIES, max_failures=DEFAULT_MAX_FAILURES):
+        self.config = config
+        self.candidates = CANDIDATES if candidates is None else candidates
+        self.queries = queries
+        self.max_failures = max_failures
+        self._locations = arena_locations(config)
+
+    def random_entries(self, rng):
+        """Draws the unit entries of a random legal board
+        """
+        state = random_board(self.config, rng, structures=rng.randint(0, MAX_STRUCTURES), mobile=rng.randint(0, MAX_MOBILE_STACKS),
+                             upgraded=rng.random())
+        return board_entries(state)
+
+    def _game_state(self, entries):
+        game_state = GameState(self.config, board_state(entries))
+        game_state.suppress_warnings(True)
+        return game_state
+
+    def _queries(self, kind, game_state, rng):
+        if kind == "path":
+            starts = [location for location in self._locations if not game_state.contains_stationary_unit(location)]
+            return rng.sample(starts, min(self.queries, len(starts)))
+        if kind == "target":
+            units = [unit for location in game_state.game_map for unit in game_state.game_map[location]]
+            return [unit_key(game_state, unit) for unit in rng.sample(units, min(self.queries, len(units)))]
+        return [(rng.choice(self._locations), rng.randint(0, 1)) for _ in range(self.queries)]
+
+    def _answers(self, kind, name, game_state, query):
+        expected = REFERENCES[kind](game_state)(query)
+        try:
+            actual = self.candidates[kind][name](game_state)(query)
+        except Exception as e:
+            actual = "raised {!r}".format(e)
+        return expected, actual
+
+    def _differs(self, kind, name, entries, query):
+        game_state = self._game_state(entries)
+        if kind == "target" and find_unit(game_state, query) is None:
+            return None
+        expected, actual = self._answers(kind, name, game_state, query)
+        return (expected, actual) if expected != actual else None
+
+    def check(self, entries, rng, report=None):
+        """Asks every implementation random questions about a board
+
+        Args:
+            entries: The unit entries of the board
+            rng: A random.Random picking the questions
+            report: A FuzzReport to count the questions in
+
+        Returns:
+            A list of (kind, name, query) of every differing answer
+
+        """
+        game_state = self._game_state(entries)
+        differences = []
+        for kind, implementations in self.candidates.items():
+            if not implementations:
+                continue
+            queries = self._queries(kind, game_state, rng)
+            reference = REFERENCES[kind](game_state)
+            expected = [reference(query) for query in queries]
+            for name, factory in implementations.items():
+                try:
+                    answer = factory(game_state)
+                    actual = [answer(query) for query in queries]
+                except Exception:
+                    # Every question is shrunk on its own, and the exception is reported then
+                    actual = None
+                for index, query in enumerate(queries):
+                    if actual is None or actual[index] != expected[index]:
+                        differences.append((kind, name, query))
+                if report is not None:
+                    report.cases[kind] += len(queries)
+        return differences
+
+    def shrink(self, entries, kind, name, query):
+        """Removes units from a board while the implementation still answers the question differently
+
+        Returns:
+            The shrunk unit entries
+
+        """
+        pinned = []
+        if kind == "target":
+            x, y, player_index, unit_type, _ = query
+            shorthand = [unit["shorthand"] for unit in self.config["unitInformation"]]
+            pinned = [entry for entry in entries if entry[0] == player_index and shorthand[entry[1]] == unit_type and entry[2][:2] == [x, y]]
+        removable = [entry for entry in entries if not any(entry is kept for kept in pinned)]
+        chunk = max(1, len(removable) // 2)
+        while removable:
+            shrunk = False
+            start = 0
+            while start < len(removable):
+                candidate = removable[:start] + removable[start + chunk:]
+                if self._differs(kind, name, pinned + candidate, query):
+                    removable = candidate
+                    shrunk = True
+                else:
+                    start += chunk
+            if not shrunk:
+                if chunk == 1:
+                    break
+                chunk = max(1, chunk // 2)
+        return pinned + removable
+
+    def run(self, boards=DEFAULT_BOARDS, seed=None):
+        """Checks the implementations on random boards
+
+        Args:
+            boards: The number of boards to draw
+            seed: Seeds the boards and questions
+
+        Returns:
+            A FuzzReport
+
+        """
+        rng = random.Random(seed)
+        report = FuzzReport()
+        started = time.perf_counter()
+        shrinking = 0.0
+        with open(os.devnull, "w") as sink, contextlib.redirect_stderr(sink):
+            for _ in range(boards):
+                entries = self.random_entries(rng)
+                report.boards += 1
+                for kind, name, query in self.check(entries, rng, report):
+                    if len(report.failures) >= self.max_failures:
+                        break
+                    shrink_started = time.perf_counter()
+                    shrunk = self.shrink(entries, kind, name, query)
+                    expected, actual = self._differs(kind, name, shrunk, query) or self._answers(kind, name, self._game_state(shrunk), query)
+                    report.failures.append(Failure(kind, name, query, expected, actual, shrunk, len(entries)))
+                    shrinking += time.perf_counter() - shrink_started
+                if len(report.failures) >= self.max_failures:
+                    break
+        report.elapsed = time.perf_counter() - started - shrinking
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.fuzz", description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--config", required=True, help="a JSON config file or a recording to read the config from")
+    parser.add_argument("--boards", type=int, default=DEFAULT_BOARDS, help="random boards to draw")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="questions of each kind per board")
+    parser.add_argument("--kinds", nargs="*", choices=KINDS, default=list(KINDS), help="the kinds of questions to check")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--max-failures", type=int, default=DEFAULT_MAX_FAILURES)
+    args = parser.parse_args(argv)
+
+    candidates = {kind: CANDIDATES[kind] for kind in args.kinds}
+    fuzzer = DifferentialFuzzer(load_config(args.config), candidates, args.queries, args.max_failures)
+    report = fuzzer.run(args.boards, args.seed)
+    for line in report.summary():
+        print(line)
+    return 1 if report.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
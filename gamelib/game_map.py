@@ -1,6 +1,7 @@
 import math
 from .unit import GameUnit
 from .util import debug_write
+from .telemetry import instrumented
 
 class GameMap:
     """Holds data about the current game map and provides functions
@@ -18,6 +19,7 @@ class GameMap:
         * TOP_LEFT (int): A constant that represents the top left edge
         * BOTTOM_LEFT (int): Hidden challenge! Can you guess what this constant represents???
         * BOTTOM_RIGHT (int): A constant that represents the bottom right edge
+        * version (int): Counts the changes made to the map with add_unit, remove_unit, assignment or mark_changed
 
     """
     def __init__(self, config):
@@ -37,6 +39,7 @@ class GameMap:
         self.BOTTOM_RIGHT = 3
         self.__map = self.__empty_grid()
         self.__start = [13,0]
+        self.version = 0
     
     def __getitem__(self, location):
         if len(location) == 2 and self.in_arena_bounds(location):
@@ -47,6 +50,7 @@ class GameMap:
     def __setitem__(self, location, val):
         if type(location) == tuple and len(location) == 2 and self.in_arena_bounds(location):
             self.__map[location[0]][location[1]] = val
+            self.version += 1
             return
         self._invalid_coordinates(location)
 
@@ -172,6 +176,7 @@ class GameMap:
             self.__map[x][y].append(new_unit)
         else:
             self.__map[x][y] = [new_unit]
+        self.version += 1
 
     def remove_unit(self, location):
         """Remove all units on the map in the given location.
@@ -187,7 +192,15 @@ class GameMap:
         
         x, y = location
         self.__map[x][y] = []
+        self.version += 1
 
+    def mark_changed(self):
+        """Counts a change to the map made by changing a unit list or a unit directly, so that
+        GameState queries memoized on the map's version are answered again
+        """
+        self.version += 1
+
+    @instrumented("get_locations_in_range")
     def get_locations_in_range(self, location, radius):
         """Gets locations in a circular area around a location
 
@@ -1,11 +1,28 @@
 import math
 import json
 import sys
+import struct
 
 from .navigation import ShortestPathFinder
-from .util import send_command, debug_write
+from .util import send_turn, debug_write
 from .unit import GameUnit
 from .game_map import GameMap
+from .telemetry import instrumented
+
+# The layout of to_bytes: a header, then structure records, stacks of identical mobile units, builds and deploys
+BYTES_MAGIC = b"GS"
+BYTES_VERSION = 1
+# magic, version, turn number, health, SP, MP and time of both players, then the number of each kind of record
+_BYTES_HEADER = struct.Struct("<2sBxi8dIIII")
+# x, y, unit type index, flags, health
+_STRUCTURE_RECORD = struct.Struct("<BBBBd")
+# x, y, unit type index, player index, number of units, health
+_MOBILE_RECORD = struct.Struct("<BBBBHd")
+# unit type index, x, y
+_ORDER_RECORD = struct.Struct("<BBB")
+_PLAYER_FLAG = 1
+_UPGRADED_FLAG = 2
+_REMOVAL_FLAG = 4
 
 def is_stationary(unit_type):
     """
@@ -45,6 +62,10 @@ class GameState:
         * enemy_health (int): Your opponents current remaining health
         * enemy_time (int): Your opponents current remaining time
 
+    The read-only queries contains_stationary_unit, find_path_to_edge and get_attackers are memoized until
+    the map changes, which attempt_spawn, attempt_upgrade and the GameMap functions that change units count
+    in game_map.version. After changing units or unit lists directly, call game_map.mark_changed().
+
     """
 
     def __init__(self, config, serialized_string):
@@ -56,6 +77,12 @@ class GameState:
 
         """
         self.serialized_string = serialized_string
+        self.__setup(config)
+        self.__parse_state(serialized_string)
+        # Parsing fills the unit lists directly
+        self.game_map.mark_changed()
+
+    def __setup(self, config):
         self.config = config
         self.enable_warnings = True
 
@@ -96,8 +123,21 @@ class GameState:
         self._player_resources = [
                 {'SP': 0, 'MP': 0},  # player 0, which is you
                 {'SP': 0, 'MP': 0}]  # player 1, which is the opponent
-        self.__parse_state(serialized_string)
+        self._memos = {}
+        self._memo_version = None
 
+    def _memo(self, query):
+        """Gets the memoized answers of a query, all of them are forgotten when the map's version changes
+        """
+        if self._memo_version != self.game_map.version:
+            self._memo_version = self.game_map.version
+            self._memos = {}
+        memo = self._memos.get(query)
+        if memo is None:
+            memo = self._memos[query] = {}
+        return memo
+
+    @instrumented("parse_state")
     def __parse_state(self, state_line):
         """
         Fills in map based on the serialized game state so that self.game_map[x,y] is a list of GameUnits at that location.
@@ -171,14 +211,113 @@ class GameState:
     def _invalid_unit(self, unit):
         self.warn("Invalid unit {}".format(unit))
 
+    def to_bytes(self):
+        """Encodes the game state compactly, for handing it to other processes or caching it. Stacks
+        of identical mobile units on a location are stored once with their count
+
+        Returns:
+            The encoded game state, a bytes object that from_bytes decodes
+
+        """
+        structures = []
+        mobiles = []
+        for location in self.game_map:
+            x, y = location
+            run = None
+            for unit in self.game_map[x, y]:
+                type_index = UNIT_TYPE_TO_INDEX[unit.unit_type]
+                if unit.stationary:
+                    flags = (_PLAYER_FLAG if unit.player_index else 0) | (_UPGRADED_FLAG if unit.upgraded else 0) | (_REMOVAL_FLAG if unit.pending_removal else 0)
+                    structures.append(_STRUCTURE_RECORD.pack(x, y, type_index, flags, unit.health))
+                    run = None
+                elif run is not None and run[2:4] == [type_index, unit.player_index] and run[5] == unit.health:
+                    run[4] += 1
+                else:
+                    run = [x, y, type_index, unit.player_index, 1, unit.health]
+                    mobiles.append(run)
+        header = _BYTES_HEADER.pack(
+            BYTES_MAGIC, BYTES_VERSION, self.turn_number,
+            self.my_health, self.get_resource(self.SP, 0), self.get_resource(self.MP, 0), self.my_time,
+            self.enemy_health, self.get_resource(self.SP, 1), self.get_resource(self.MP, 1), self.enemy_time,
+            len(structures), len(mobiles), len(self._build_stack), len(self._deploy_stack))
+        return b"".join([header] + structures + [_MOBILE_RECORD.pack(*run) for run in mobiles] +
+                        [_ORDER_RECORD.pack(UNIT_TYPE_TO_INDEX[unit_type], x, y) for unit_type, x, y in self._build_stack + self._deploy_stack])
+
+    @classmethod
+    def from_bytes(cls, config, data):
+        """Decodes a game state encoded with to_bytes
+
+        Args:
+            * config (JSON): The config of the game the state was encoded in
+            * data (bytes): The encoded game state
+
+        Returns:
+            A GameState equal to the encoded one. Its serialized_string is None
+
+        """
+        magic, version, turn_number, my_health, my_SP, my_MP, my_time, enemy_health, enemy_SP, enemy_MP, enemy_time, \
+            structure_count, mobile_count, build_count, deploy_count = _BYTES_HEADER.unpack_from(data)
+        if magic != BYTES_MAGIC or version != BYTES_VERSION:
+            raise ValueError("Not an encoded game state of version {}".format(BYTES_VERSION))
+        self = cls.__new__(cls)
+        self.serialized_string = None
+        self.__setup(config)
+        self.turn_number = turn_number
+        self.my_health = my_health
+        self.my_time = my_time
+        self.enemy_health = enemy_health
+        self.enemy_time = enemy_time
+        self._player_resources = [
+            {'SP': my_SP, 'MP': my_MP},
+            {'SP': enemy_SP, 'MP': enemy_MP}]
+
+        shorthands = [unit.get("shorthand") for unit in config["unitInformation"]]
+        templates = {}
+
+        def template(type_index, player_index, upgraded):
+            # Units are copied from one made per kind, which is much faster than creating each of them
+            key = (type_index, player_index, upgraded)
+            unit = templates.get(key)
+            if unit is None:
+                unit = templates[key] = GameUnit(shorthands[type_index], config, player_index)
+                if upgraded:
+                    unit.upgrade()
+            return unit.__dict__
+
+        new = GameUnit.__new__
+        game_map = self.game_map
+        offset = _BYTES_HEADER.size
+        end = offset + structure_count * _STRUCTURE_RECORD.size
+        for x, y, type_index, flags, health in _STRUCTURE_RECORD.iter_unpack(data[offset:end]):
+            unit = new(GameUnit)
+            unit.__dict__ = dict(template(type_index, flags & _PLAYER_FLAG, bool(flags & _UPGRADED_FLAG)),
+                                 x=x, y=y, health=health, pending_removal=bool(flags & _REMOVAL_FLAG))
+            unit.cost = unit.cost[:]
+            game_map[x, y].append(unit)
+        offset, end = end, end + mobile_count * _MOBILE_RECORD.size
+        for x, y, type_index, player_index, count, health in _MOBILE_RECORD.iter_unpack(data[offset:end]):
+            units = game_map[x, y]
+            attributes = dict(template(type_index, player_index, False), x=x, y=y, health=health)
+            for _ in range(count):
+                unit = new(GameUnit)
+                unit.__dict__ = attributes.copy()
+                unit.cost = unit.cost[:]
+                units.append(unit)
+        offset, end = end, end + (build_count + deploy_count) * _ORDER_RECORD.size
+        orders = [(shorthands[type_index], x, y) for type_index, x, y in _ORDER_RECORD.iter_unpack(data[offset:end])]
+        self._build_stack = orders[:build_count]
+        self._deploy_stack = orders[build_count:]
+        game_map.mark_changed()
+        return self
+
+    @instrumented("submit_turn")
     def submit_turn(self):
         """Submit and end your turn.
             Must be called at the end of your turn or the algo will hang.
         """
         build_string = json.dumps(self._build_stack)
         deploy_string = json.dumps(self._deploy_stack)
-        send_command(build_string)
-        send_command(deploy_string)
+        send_turn(build_string, deploy_string)
 
     def get_resource(self, resource_type, player_index = 0):
         """Gets a players resources
@@ -352,6 +491,7 @@ class GameState:
                 (stationary or on_edge) and
                 (not stationary or num == 1))
 
+    @instrumented("attempt_spawn")
     def attempt_spawn(self, unit_type, locations, num=1):
         """Attempts to spawn new units with the type given in the given locations.
 
@@ -446,6 +586,7 @@ class GameState:
                         self.__set_resource(SP, 0 - costs[SP])
                         self.__set_resource(MP, 0 - costs[MP])
                         existing_unit.upgrade()
+                        self.game_map.mark_changed()
                         self._build_stack.append((UPGRADE, x, y))
                         spawned_units += 1
             else:
@@ -475,6 +616,7 @@ class GameState:
         elif right and top:
             return self.game_map.BOTTOM_LEFT
 
+    @instrumented("find_path_to_edge")
     def find_path_to_edge(self, start_location, target_edge=None):
         """Gets the path a unit at a given location would take. 
         If final point is not on an edge, it is a self destruct path
@@ -495,8 +637,16 @@ class GameState:
         if target_edge is None:
             target_edge = self.get_target_edge(start_location)
 
-        end_points = self.game_map.get_edge_locations(target_edge)
-        return self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+        memo = self._memo("find_path_to_edge")
+        key = (start_location[0], start_location[1], target_edge)
+        path = memo.get(key)
+        if path is None:
+            end_points = self.game_map.get_edge_locations(target_edge)
+            path = self._shortest_path_finder.navigate_multiple_endpoints(start_location, end_points, self)
+            if path is None:
+                return None
+            memo[key] = path
+        return [list(location) for location in path]
 
     def contains_stationary_unit(self, location):
         """Check if a location is blocked, return structures unit if it is
@@ -508,14 +658,22 @@ class GameState:
             A structures unit if there is a stationary unit at the location, False otherwise
             
         """
+        memo = self._memo("contains_stationary_unit")
+        key = (location[0], location[1])
+        found = memo.get(key)
+        if found is not None:
+            return found
         if not self.game_map.in_arena_bounds(location):
             self.warn('Checked for stationary unit outside of arena bounds')
             return False
         x, y = map(int, location)
+        found = False
         for unit in self.game_map[x,y]:
             if unit.stationary:
-                return unit
-        return False
+                found = unit
+                break
+        memo[key] = found
+        return found
 
     def warn(self, message):
         """ Used internally by game_state to print warnings
@@ -535,6 +693,7 @@ class GameState:
         self.enable_warnings = not suppress
         self.game_map.enable_warnings = not suppress
 
+    @instrumented("get_target")
     def get_target(self, attacking_unit):
         """Returns target of given unit based on current map of the game board. 
         A Unit can often have many other units in range, and Units that attack do so once each frame.
@@ -614,6 +773,7 @@ class GameState:
                     target_x_distance = unit_x_distance
         return target
 
+    @instrumented("get_attackers")
     def get_attackers(self, location, player_index):
         """Gets the stationary units threatening a given location
 
@@ -631,6 +791,12 @@ class GameState:
         if not self.game_map.in_arena_bounds(location):
             self.warn("Location {} is not in the arena bounds.".format(location))
 
+        memo = self._memo("get_attackers")
+        key = (location[0], location[1], player_index)
+        attackers = memo.get(key)
+        if attackers is not None:
+            return list(attackers)
+
         attackers = []
         """
         Get locations in the range of TURRET units
@@ -644,4 +810,5 @@ class GameState:
             for unit in self.game_map[location_unit]:
                 if unit.damage_i + unit.damage_f > 0 and unit.player_index != player_index and self.game_map.distance_between_locations(location, location_unit) <= unit.attackRange:
                     attackers.append(unit)
-        return attackers
+        memo[key] = attackers
+        return list(attackers)
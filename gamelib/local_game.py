@@ -0,0 +1,271 @@
+"""
+A headless model of the engine's game loop, for playing games without the engine.
+
+LocalGame keeps the board, health and resources of both players, and produces the same
+messages the engine sends to each algo, from that player's point of view. Commands are validated
+with the same GameState rules the algos use (can_spawn, attempt_upgrade, attempt_remove),
+the action phase is played out by ActionPhaseSimulator, and resources grow between turns as
+GameState.project_future_MP predicts.
+
+This is an approximation of the engine, not a replacement. Action frames carry the breach, damage,
+death and spawn events but only list structures, not moving mobile units.
+"""
+import json
+
+from .game_state import GameState
+from .simulator import ActionPhaseSimulator, DEFAULT_MAX_FRAMES
+from .unit import GameUnit
+
+DEFAULT_MAX_TURNS = 100
+ARENA_SIZE = 28
+REMOVE_INDEX = 6
+UPGRADE_INDEX = 7
+EVENT_OWNER_FIELDS = {"breach": 4, "damage": 4, "death": 3, "spawn": 3}
+# The engine sends every kind of event in every frame, algos may rely on it
+EVENT_KINDS = ("selfDestruct", "breach", "damage", "shield", "move", "spawn", "death", "attack", "melee")
+
+
+def queue_commands(game_state, build_string, deploy_string):
+    """Queues the commands an algo submitted on a game state, with the same checks as the engine.
+    Invalid or unaffordable entries are dropped.
+
+    Args:
+        game_state: The GameState the commands were planned from
+        build_string: The build phase command, as sent by GameState.submit_turn
+        deploy_string: The deploy phase command
+
+    """
+    type_indices = {unit["shorthand"]: index for index, unit in enumerate(game_state.config["unitInformation"]) if "shorthand" in unit}
+    for command, is_build in ((build_string, True), (deploy_string, False)):
+        try:
+            entries = json.loads(command)
+        except (TypeError, ValueError):
+            continue
+        for entry in entries if isinstance(entries, list) else []:
+            try:
+                unit_type, x, y = entry[0], int(entry[1]), int(entry[2])
+                index = type_indices.get(unit_type)
+                if index is None:
+                    continue
+                if index == UPGRADE_INDEX and is_build:
+                    game_state.attempt_upgrade([x, y])
+                elif index == REMOVE_INDEX and is_build:
+                    game_state.attempt_remove([x, y])
+                elif index < REMOVE_INDEX and game_state.game_map.in_arena_bounds([x, y]):
+                    game_state.attempt_spawn(unit_type, [x, y])
+            except (TypeError, ValueError, IndexError):
+                continue
+
+
+def _flip(location):
+    return [ARENA_SIZE - 1 - location[0], ARENA_SIZE - 1 - location[1]]
+
+
+class LocalGame:
+    """The state of a game between two players, advanced one turn at a time.
+
+    Every turn, get each player's turn_message, submit each player's commands, then call play_action_phase.
+    Player 0 sees the board as stored, player 1 sees it rotated so that it is also at the bottom.
+
+    Attributes :
+        * config (JSON): The game config
+        * turn_number (int): The current turn
+        * health ([float, float]): Each player's health
+        * resources (list): Each player's {"SP": float, "MP": float}
+        * times ([int, int]): The milliseconds each player took on their previous turn, reported to the algos
+        * structures (dict): The GameUnit of every structure by (x, y), with player_index 0 or 1
+        * max_turns (int): The game ends after this many turns
+
+    """
+    def __init__(self, config, max_turns=DEFAULT_MAX_TURNS, max_frames=DEFAULT_MAX_FRAMES):
+        self.config = config
+        self.max_turns = max_turns
+        self.max_frames = max_frames
+        resources = config["resources"]
+        self.turn_number = 0
+        self.health = [float(resources["startingHP"])] * 2
+        self.resources = [{"SP": float(resources["startingCores"]), "MP": float(resources["startingBits"])} for _ in range(2)]
+        self.times = [0, 0]
+        self.structures = {}
+        self._ids = {}
+        self._next_id = 0
+        self._type_indices = {unit["shorthand"]: index for index, unit in enumerate(config["unitInformation"]) if "shorthand" in unit}
+        self._pending = [None, None]
+        self._frames = []
+        # GameState sets up the unit type globals GameUnit relies on
+        self.game_state(0)
+
+    def _new_id(self):
+        self._next_id += 1
+        return str(self._next_id)
+
+    def _to_view(self, location, player_index):
+        return list(location) if player_index == 0 else _flip(location)
+
+    def _view_events(self, events, player_index):
+        viewed = {kind: [] for kind in EVENT_KINDS}
+        if player_index == 0:
+            viewed.update(events)
+            return viewed
+        for kind, entries in events.items():
+            owner = EVENT_OWNER_FIELDS.get(kind)
+            viewed[kind] = []
+            for entry in entries:
+                entry = list(entry)
+                entry[0] = _flip(entry[0])
+                if owner is not None:
+                    entry[owner] = 3 - entry[owner]
+                viewed[kind].append(entry)
+        return viewed
+
+    def config_message(self):
+        """Gets the config message sent before the first turn. Algos recognize it by its replaySave entry,
+        which is added if the config does not have one
+        """
+        message = json.dumps(self.config)
+        if "replaySave" not in message:
+            message = json.dumps(dict(self.config, replaySave=0))
+        return message
+
+    def state_message(self, player_index, turn_type=0, frame=-1, events=None):
+        """Gets the message the engine would send a player
+
+        Args:
+            player_index: The player receiving the message
+            turn_type: 0 for a turn state, 1 for an action frame
+            frame: The frame number of an action frame
+            events: The events of an action frame, from player 0's point of view
+
+        Returns:
+            The message as a JSON string
+
+        """
+        units = [[[] for _ in range(len(self.config["unitInformation"]))] for _ in range(2)]
+        for location, unit in self.structures.items():
+            owner = unit.player_index if player_index == 0 else 1 - unit.player_index
+            x, y = self._to_view(location, player_index)
+            unit_id = self._ids[location]
+            units[owner][self._type_indices[unit.unit_type]].append([x, y, unit.health, unit_id])
+            if unit.pending_removal:
+                units[owner][REMOVE_INDEX].append([x, y, 0, unit_id])
+            if unit.upgraded:
+                units[owner][UPGRADE_INDEX].append([x, y, 0, unit_id])
+        stats = [[self.health[player], self.resources[player]["SP"], self.resources[player]["MP"], self.times[player]] for player in (0, 1)]
+        if player_index == 1:
+            stats.reverse()
+        return json.dumps({
+            "p1Units": units[0], "p2Units": units[1],
+            "p1Stats": stats[0], "p2Stats": stats[1],
+            "turnInfo": [turn_type, self.turn_number, frame],
+            "events": self._view_events(events or {}, player_index),
+        })
+
+    def turn_message(self, player_index):
+        """Gets the turn state message for a player
+        """
+        return self.state_message(player_index)
+
+    def game_state(self, player_index):
+        """Gets a GameState of the current turn from a player's point of view
+        """
+        game_state = GameState(self.config, self.state_message(player_index))
+        game_state.suppress_warnings(True)
+        return game_state
+
+    def submit(self, player_index, build_string, deploy_string):
+        """Validates a player's commands for this turn. Invalid or unaffordable entries are dropped, as the engine does.
+
+        Args:
+            player_index: The player submitting
+            build_string: The build phase command, as sent by GameState.submit_turn
+            deploy_string: The deploy phase command
+
+        """
+        game_state = self.game_state(player_index)
+        queue_commands(game_state, build_string, deploy_string)
+        self._pending[player_index] = game_state
+
+    def play_action_phase(self):
+        """Applies both players' builds, simulates the action phase and moves on to the next turn.
+        Players that did not submit anything this turn build and deploy nothing.
+
+        Returns:
+            The SimulationResult of the action phase
+
+        """
+        resources = self.config["resources"]
+        deploys = [[], []]
+        next_mp = [0.0, 0.0]
+        for player_index in (0, 1):
+            game_state = self._pending[player_index] or self.game_state(player_index)
+            for unit_type, x, y in game_state._build_stack:
+                location = tuple(self._to_view([x, y], player_index))
+                index = self._type_indices[unit_type]
+                if index == UPGRADE_INDEX:
+                    unit = self.structures[location]
+                    previous_max = unit.max_health
+                    unit.upgrade()
+                    unit.health += unit.max_health - previous_max
+                elif index == REMOVE_INDEX:
+                    self.structures[location].pending_removal = True
+                else:
+                    self.structures[location] = GameUnit(unit_type, self.config, player_index, None, location[0], location[1])
+                    self._ids[location] = self._new_id()
+            for unit_type, x, y in game_state._deploy_stack:
+                deploys[player_index].append((unit_type,) + tuple(self._to_view([x, y], player_index)))
+            self.resources[player_index] = dict(game_state._player_resources[0])
+            next_mp[player_index] = game_state.project_future_MP(1, 0)
+        self._pending = [None, None]
+
+        result = ActionPhaseSimulator(self.game_state(0), self.max_frames).simulate(deploys[0], deploys[1], record_events=True)
+        spawns = []
+        for player_index in (0, 1):
+            for unit_type, x, y in deploys[player_index]:
+                spawns.append([[x, y], self._type_indices[unit_type], self._new_id(), player_index + 1])
+        self._frames = [(0, {"spawn": spawns})] + [(frame, events) for frame, events in enumerate(result.frame_events, 1)]
+
+        for player_index in (0, 1):
+            self.health[player_index] -= result.health_lost[player_index]
+            self.resources[player_index]["SP"] += resources.get("coresForPlayerDamage", 0) * result.health_lost[1 - player_index]
+        standing = {(unit.x, unit.y): unit.health for unit in result.structures}
+        for location in list(self.structures):
+            if location not in standing:
+                del self.structures[location]
+                continue
+            unit = self.structures[location]
+            unit.health = standing[location]
+            if unit.pending_removal:
+                refund = self.config["unitInformation"][self._type_indices[unit.unit_type]].get("refundPercentage", 0)
+                self.resources[unit.player_index]["SP"] += refund * unit.cost[0] * unit.health / unit.max_health
+                del self.structures[location]
+
+        for player_index in (0, 1):
+            self.resources[player_index]["SP"] += resources["coresPerRound"]
+            self.resources[player_index]["MP"] = next_mp[player_index]
+        self.turn_number += 1
+        return result
+
+    def action_frames(self, player_index):
+        """Gets the action frame messages of the last action phase for a player
+        """
+        return [self.state_message(player_index, 1, frame, events) for frame, events in self._frames]
+
+    def finished(self):
+        """Returns True once a player has no health left or the last turn has been played
+        """
+        return min(self.health) <= 0 or self.turn_number >= self.max_turns
+
+    def winner(self):
+        """Returns the index of the player with more health left, or None for a draw
+        """
+        if self.health[0] == self.health[1]:
+            return None
+        return 0 if self.health[0] > self.health[1] else 1
+
+    def end_message(self, player_index):
+        """Gets the end of game message for a player
+        """
+        winner = self.winner()
+        if winner is not None and player_index == 1:
+            winner = 1 - winner
+        return json.dumps({"turnInfo": [2, self.turn_number, 0], "endStats": {"winner": None if winner is None else winner + 1}})
@@ -0,0 +1,176 @@
+"""
+Per-turn memory accounting with tracemalloc.
+
+When it is turned on, Python's allocations are traced for the whole game. Each turn, tracemalloc snapshots
+taken around on_turn and around the action phase are compared, and a JSON line is appended to a file with:
+
+    * current, peak: The bytes allocated at the end of on_turn, and the most allocated at once during the turn
+    * on_turn_growth, action_phase_growth: Net bytes allocated by on_turn and by the on_action_frame calls before it
+    * top: The source lines that allocated the most during on_turn
+    * growing_attributes: Attributes of the algo whose size grew on each of the last few turns, which
+      often means strategy state like a list of scored on locations grows without bound
+
+Tracing slows the algo down noticeably, so it is meant for local runs. Turn it on by setting GAMELIB_MEMORY
+to the output file, or by setting an algo's memory_monitor to a MemoryMonitor.
+"""
+import os
+import json
+import tracemalloc
+
+from .util import debug_write
+
+MEMORY_ENV = "GAMELIB_MEMORY"
+DEFAULT_TOP = 10
+DEFAULT_GROWTH_TURNS = 5
+_IGNORED = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"), tracemalloc.Filter(False, "<unknown>"))
+
+
+def attribute_sizes(obj):
+    """Gets the number of items in every container attribute of an object
+
+    Args:
+        obj: An object, usually an algo
+
+    Returns:
+        A dict of len() of every attribute that has one
+
+    """
+    sizes = {}
+    for name, value in vars(obj).items():
+        if isinstance(value, (str, bytes)):
+            continue
+        try:
+            sizes[name] = len(value)
+        except TypeError:
+            continue
+    return sizes
+
+
+class MemoryMonitor:
+    """Traces allocations and writes a memory report per turn.
+
+    Attributes :
+        * path (string): The JSON-lines file reports are appended to
+        * top (int): The number of allocation sites reported per turn
+        * growth_turns (int): Attributes that grew on this many turns in a row are flagged
+        * history (dict): The sizes of the algo's container attributes, one entry per turn, by attribute name
+        * reports (list): The reports written so far
+
+    """
+    def __init__(self, path, top=DEFAULT_TOP, growth_turns=DEFAULT_GROWTH_TURNS):
+        self.path = path
+        self.top = top
+        self.growth_turns = growth_turns
+        self.history = {}
+        self.reports = []
+        self._file = open(path, "a")
+        self._started_tracing = False
+        self._phase_start = None
+        self._turn_start = None
+        self._frame_growth = 0
+        self._turn_number = None
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def start(self):
+        """Starts tracing allocations, if they are not traced already
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._phase_start = self._snapshot()
+
+    def begin_turn(self, turn_number):
+        """Called before on_turn. Ends the accounting of the previous action phase
+        """
+        if not tracemalloc.is_tracing():
+            self.start()
+        self._turn_number = turn_number
+        self._turn_start = self._snapshot()
+        tracemalloc.reset_peak()
+
+    def end_turn(self, algo):
+        """Called after on_turn. Writes the turn's report
+
+        Args:
+            algo: The algo whose attributes are checked for growth
+
+        Returns:
+            The report, a dict
+
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        turn_diff = snapshot.compare_to(self._turn_start, "lineno")
+        top = []
+        for stat in sorted(turn_diff, key=lambda stat: stat.size_diff, reverse=True)[:self.top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            top.append({"site": "{}:{}".format(frame.filename, frame.lineno), "size_diff": stat.size_diff, "count_diff": stat.count_diff})
+        action_phase_growth = None
+        if self._phase_start is not None:
+            action_phase_growth = sum(stat.size_diff for stat in self._turn_start.compare_to(self._phase_start, "filename"))
+        report = {
+            "turn": self._turn_number,
+            "current": current,
+            "peak": peak,
+            "on_turn_growth": sum(stat.size_diff for stat in turn_diff),
+            "action_phase_growth": action_phase_growth,
+            "frame_growth": self._frame_growth,
+            "top": top,
+            "growing_attributes": self._growing_attributes(algo),
+        }
+        self._phase_start = snapshot
+        self._frame_growth = 0
+        self._turn_start = None
+        self._file.write(json.dumps(report) + "\n")
+        self._file.flush()
+        self.reports.append(report)
+        return report
+
+    def _growing_attributes(self, algo):
+        growing = []
+        for name, size in attribute_sizes(algo).items():
+            sizes = self.history.setdefault(name, [])
+            sizes.append(size)
+            recent = sizes[-self.growth_turns - 1:]
+            if len(recent) > self.growth_turns and all(later > earlier for earlier, later in zip(recent, recent[1:])):
+                growing.append({"attribute": name, "size": size, "growth": recent[-1] - recent[0]})
+        return growing
+
+    def measure_frame(self):
+        """Returns the bytes allocated now, cheaply, to measure an action frame with
+        """
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def add_frame(self, before):
+        """Adds the net allocations of an on_action_frame call, given the measure_frame value from before it
+        """
+        self._frame_growth += self.measure_frame() - before
+
+    def close(self):
+        """Closes the report file and stops tracing, if this monitor started it
+        """
+        self._file.close()
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def memory_monitor_from_environment():
+    """Creates a MemoryMonitor if the GAMELIB_MEMORY environment variable is set
+
+    Returns:
+        The MemoryMonitor, or None
+
+    """
+    path = os.environ.get(MEMORY_ENV)
+    if not path:
+        return None
+    try:
+        return MemoryMonitor(path)
+    except OSError as e:
+        debug_write("Could not write memory reports to {}: {}".format(path, e))
+        return None
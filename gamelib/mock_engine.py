@@ -0,0 +1,400 @@
+"""
+A local stand-in for the engine process, speaking the stdin/stdout protocol to a strategy.
+
+The strategy script is started as a subprocess, exactly as the engine starts it, and is sent the config
+and then turn states and action frames, one JSON message per line. After every turn state it has to answer
+with its build and deploy commands, two lines, within the turn time limit. The messages either come from
+a recording, or from a LocalGame played against a second strategy process or an idle opponent:
+
+    python -m gamelib.mock_engine wpa.py --replay game.replay.gz
+    python -m gamelib.mock_engine wpa.py --config game.replay.gz --opponent sunny-2.py --turns 20
+
+Round trip latencies are reported per message type, including the time taken to write large messages
+to the strategy, which the in-process driver does not see.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import subprocess
+
+from .algocore import parse_turn_type
+from .budget import default_turn_limit
+from .driver import percentile, PERCENTILES
+from .local_game import LocalGame, DEFAULT_MAX_TURNS
+from .replay import read_messages
+
+MESSAGE_TYPES = ("config", "turn", "frame", "end")
+EMPTY_COMMAND = "[]"
+
+
+def hard_turn_limit(config):
+    """Gets the engine's hard time limit for a turn in seconds, after which an algo is stopped
+
+    Args:
+        config: The game config
+
+    Returns:
+        The waitTimeBotMax value of the config in seconds, or None if the config does not have one
+
+    """
+    timing = (config or {}).get("timingAndReplay", {})
+    if "waitTimeBotMax" in timing:
+        return timing["waitTimeBotMax"] / 1000
+    return None
+
+
+def load_config(path):
+    """Reads a game config from a JSON file, or from the first message of a recording
+    """
+    with open(path, "rb") as file:
+        start = file.read(1)
+    if start == b"{":
+        with open(path) as file:
+            return json.loads(file.readline())
+    for message in read_messages(path):
+        return json.loads(message)
+    raise ValueError("{} does not contain a config".format(path))
+
+
+def read_positions(paths):
+    """Reads the config and every turn state of some recordings
+
+    Args:
+        paths: Recording files
+
+    Returns:
+        The config, and a list of turn state strings
+
+    """
+    config = None
+    positions = []
+    for path in paths:
+        for message in read_messages(path):
+            if b"replaySave" in message:
+                config = config or json.loads(message)
+            elif parse_turn_type(message) == 0:
+                positions.append(message.decode("utf-8"))
+    if config is None:
+        raise ValueError("The recordings do not contain a config")
+    return config, positions
+
+
+class StrategyProcess:
+    """A strategy script running as a subprocess, read from on a background thread so reads can time out.
+
+    Attributes :
+        * path (string): The strategy file
+        * process (subprocess.Popen): The running script
+        * late_lines (int): Lines still expected from turns that timed out, they are discarded when they arrive
+        * last_arrival (float): The time.perf_counter value at which the line last returned by read_line arrived
+
+    """
+    def __init__(self, path, stderr=None):
+        self.path = os.path.abspath(path)
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", self.path], cwd=os.path.dirname(self.path),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr or subprocess.DEVNULL)
+        self.late_lines = 0
+        self.last_arrival = None
+        self._lines = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self._lines.put((time.perf_counter(), line.decode("utf-8").strip()))
+        self._lines.put(None)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def send(self, message):
+        """Writes a message line, returns False if the process has exited
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        try:
+            self.process.stdin.write(message.rstrip(b"\n") + b"\n")
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError):
+            return False
+
+    def read_line(self, deadline):
+        """Reads the next command line, waiting at most until deadline, a time.perf_counter value
+
+        Returns:
+            The line, or None if the deadline passed or the process exited
+
+        """
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if line is None:
+                self._lines.put(None)
+                return None
+            if self.late_lines:
+                self.late_lines -= 1
+                continue
+            self.last_arrival, line = line
+            return line
+
+    def close(self, timeout=5.0):
+        """Closes stdin so the script can exit on its own, and kills it if it does not
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._reader.join(timeout)
+        self.process.stdout.close()
+
+
+class EngineReport:
+    """Latencies and time limit violations of a strategy process.
+
+    Attributes :
+        * latencies (dict): Seconds taken per message, by message type. For turns it is the time until both
+          command lines arrived, for other messages the time to write them to the process
+        * first_line_latencies (list): Seconds until the build command arrived, for each answered turn
+        * commands (list): The [build, deploy] commands received each turn
+        * timeouts (list): Turn numbers where the strategy missed the soft limit and played an empty turn
+        * crashed_turn (int): The turn the strategy exited or hit the hard limit on, None if it did not
+        * winner (int): The index of the winning player of a simulated game, None for a draw or a replay
+
+    """
+    def __init__(self):
+        self.latencies = {message_type: [] for message_type in MESSAGE_TYPES}
+        self.first_line_latencies = []
+        self.commands = []
+        self.timeouts = []
+        self.crashed_turn = None
+        self.winner = None
+
+    def summary(self):
+        """Returns the report as readable lines of text
+        """
+        lines = []
+        for message_type in MESSAGE_TYPES:
+            times = self.latencies[message_type]
+            if times:
+                lines.append("{}: {} messages, ms {}, max {:.2f}".format(message_type, len(times), ", ".join(
+                    "p{} {:.2f}".format(q, percentile(times, q) * 1000) for q in PERCENTILES), max(times) * 1000))
+        if self.first_line_latencies:
+            lines.append("Build command latency ms: {}".format(", ".join(
+                "p{} {:.2f}".format(q, percentile(self.first_line_latencies, q) * 1000) for q in PERCENTILES)))
+        lines.append("Turns over the time limit: {}".format(self.timeouts or "none"))
+        if self.crashed_turn is not None:
+            lines.append("Stopped responding on turn {}".format(self.crashed_turn))
+        return lines
+
+
+class MockEngine:
+    """Plays games against strategy subprocesses the way the engine does.
+
+    Attributes :
+        * config (JSON): The game config sent to the strategies
+        * turn_limit (float): Seconds a strategy has to answer a turn before an empty turn is played for it
+        * hard_limit (float): Seconds after which a strategy that has not answered is stopped, None for no limit
+        * stderr (file): Where the strategies' debug output goes, discarded if None
+
+    """
+    def __init__(self, config, turn_limit=None, hard_limit=None, stderr=None):
+        self.config = config
+        self.turn_limit = turn_limit if turn_limit is not None else default_turn_limit(config)
+        self.hard_limit = hard_limit if hard_limit is not None else hard_turn_limit(config)
+        self.stderr = stderr
+
+    def _send(self, process, message, message_type, report):
+        started = time.perf_counter()
+        sent = process.send(message)
+        report.latencies[message_type].append(time.perf_counter() - started)
+        return sent
+
+    def _request_turn(self, process, message, turn_number, report):
+        """Sends a turn state and waits for the two command lines
+
+        Returns:
+            The [build, deploy] commands, or None if the process stopped responding
+
+        """
+        started = self._send_turn(process, message, turn_number, report)
+        if started is None:
+            return None
+        return self._collect_turn(process, started, turn_number, report)[0]
+
+    def _send_turn(self, process, message, turn_number, report):
+        """Sends a turn state without waiting for the answer
+
+        Returns:
+            The time.perf_counter value the turn started at, or None if the process has exited
+
+        """
+        started = time.perf_counter()
+        if not process.send(message):
+            report.crashed_turn = turn_number
+            return None
+        return started
+
+    def _collect_turn(self, process, started, turn_number, report):
+        """Waits for the two command lines of a turn sent at started. Latencies are measured to when the
+        lines arrived, so they are not affected by waiting for another player first.
+
+        Returns:
+            The [build, deploy] commands, or None if the process stopped responding, and the seconds the turn took
+
+        """
+        commands = []
+        wait = self.turn_limit if self.hard_limit is None else max(self.turn_limit, self.hard_limit)
+        while len(commands) < 2:
+            line = process.read_line(started + wait)
+            if line is None:
+                break
+            if len(commands) == 0:
+                report.first_line_latencies.append(process.last_arrival - started)
+            commands.append(line)
+        elapsed = process.last_arrival - started if len(commands) == 2 else time.perf_counter() - started
+        if len(commands) < 2:
+            if not process.alive() or self.hard_limit is not None:
+                report.crashed_turn = turn_number
+                return None, elapsed
+            process.late_lines += 2 - len(commands)
+        report.latencies["turn"].append(elapsed)
+        if len(commands) < 2 or elapsed > self.turn_limit:
+            report.timeouts.append(turn_number)
+            commands = [EMPTY_COMMAND, EMPTY_COMMAND]
+        report.commands.append(commands)
+        return commands, elapsed
+
+    def run_replay(self, strategy, messages):
+        """Sends recorded messages to a strategy, waiting for its commands after each turn state.
+        The commands do not change the game, the recorded states are sent regardless.
+
+        Args:
+            strategy: The strategy file
+            messages: The recorded messages as bytes, starting with the config
+
+        Returns:
+            An EngineReport
+
+        """
+        report = EngineReport()
+        process = StrategyProcess(strategy, self.stderr)
+        try:
+            for message in messages:
+                if b"replaySave" in message:
+                    sent = self._send(process, message, "config", report)
+                else:
+                    turn_type = parse_turn_type(message)
+                    if turn_type == 0:
+                        sent = self._request_turn(process, message, json.loads(message)["turnInfo"][1], report) is not None
+                    else:
+                        sent = self._send(process, message, "frame" if turn_type == 1 else "end", report)
+                if not sent:
+                    break
+        finally:
+            process.close()
+        return report
+
+    def run_game(self, strategy, opponent=None, max_turns=DEFAULT_MAX_TURNS):
+        """Plays a game with LocalGame between a strategy and an opponent strategy, or an opponent that does nothing
+
+        Args:
+            strategy: The strategy file of player 0
+            opponent: The strategy file of player 1, None for an idle opponent
+
+        Returns:
+            An EngineReport for each player, the opponent's is None if it is idle
+
+        """
+        game = LocalGame(self.config, max_turns)
+        processes = [StrategyProcess(strategy, self.stderr), StrategyProcess(opponent, self.stderr) if opponent else None]
+        reports = [EngineReport(), EngineReport() if opponent else None]
+        config = game.config_message()
+        try:
+            for process, report in zip(processes, reports):
+                if process:
+                    self._send(process, config, "config", report)
+            while not game.finished():
+                # Both players get the turn before either answer is read, so they think at the same time as on the engine
+                started = [self._send_turn(process, game.turn_message(player_index), game.turn_number, report) if process else None
+                           for player_index, (process, report) in enumerate(zip(processes, reports))]
+                for player_index, (process, report) in enumerate(zip(processes, reports)):
+                    if process is None:
+                        continue
+                    commands = None
+                    if started[player_index] is not None:
+                        commands, elapsed = self._collect_turn(process, started[player_index], game.turn_number, report)
+                        game.times[player_index] = int(elapsed * 1000)
+                    if commands is None:
+                        # A strategy that stops responding loses, as it would on the engine
+                        game.health[player_index] = 0
+                        continue
+                    game.submit(player_index, *commands)
+                if game.finished():
+                    break
+                game.play_action_phase()
+                for player_index, (process, report) in enumerate(zip(processes, reports)):
+                    if process:
+                        for frame in game.action_frames(player_index):
+                            self._send(process, frame, "frame", report)
+            for player_index, (process, report) in enumerate(zip(processes, reports)):
+                if process:
+                    self._send(process, game.end_message(player_index), "end", report)
+                    report.winner = game.winner()
+        finally:
+            for process in processes:
+                if process:
+                    process.close()
+        return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.mock_engine", description="Play a strategy as a subprocess, the way the engine does")
+    parser.add_argument("strategy", help="The strategy file, like wpa.py")
+    parser.add_argument("--replay", help="Send the messages of this recording")
+    parser.add_argument("--config", help="Play a simulated game with the config of this JSON file or recording")
+    parser.add_argument("--opponent", help="The strategy file of the simulated opponent, which does nothing by default")
+    parser.add_argument("--turns", type=int, default=DEFAULT_MAX_TURNS, help="The number of turns of a simulated game")
+    parser.add_argument("--limit", type=float, default=None, help="The turn time limit in seconds")
+    parser.add_argument("--debug", action="store_true", help="Show the strategies' debug output")
+    args = parser.parse_args(argv)
+    if not args.replay and not args.config:
+        parser.error("one of --replay or --config is required")
+
+    stderr = sys.stderr if args.debug else None
+    if args.replay:
+        messages = list(read_messages(args.replay))
+        engine = MockEngine(json.loads(messages[0]), args.limit, stderr=stderr)
+        reports = [engine.run_replay(args.strategy, messages)]
+    else:
+        engine = MockEngine(load_config(args.config), args.limit, stderr=stderr)
+        reports = engine.run_game(args.strategy, args.opponent, args.turns)
+    for name, report in zip((args.strategy, args.opponent), reports):
+        if report is None:
+            continue
+        print(name)
+        for line in report.summary():
+            print("  " + line)
+    if args.config:
+        winner = reports[0].winner
+        print("Winner: {}".format("draw" if winner is None else (args.strategy, args.opponent or "idle opponent")[winner]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
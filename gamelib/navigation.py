@@ -2,7 +2,7 @@ import heapq
 import math
 import sys
 import queue
-from .util import debug_write
+from .util import debug_write, _buffer_debug
 
 class Node:
     """A path-finding node
@@ -298,19 +298,296 @@ class ShortestPathFinder:
             return
 
         for y in range(28):
+            row = ""
             for x in range(28):
                 node = self.game_map[x][28 - y - 1]
                 if not node.blocked and not node.pathlength == -1:
-                    self._print_justified(node.pathlength)
+                    row += self._print_justified(node.pathlength)
                 else:
-                    sys.stderr.write("   ")
-            debug_write("")
+                    row += "   "
+            _buffer_debug(row + "\n")
 
     def _print_justified(self, number):
-        """Prints a number between 100 and -10 in 3 spaces
+        """Formats a number between 100 and -10 in 3 spaces
 
         """
         if number < 10 and number > -1:
-            sys.stderr.write(" ")
-        sys.stderr.write(str(number))
-        sys.stderr.write(" ")
+            return " " + str(number) + " "
+        return str(number) + " "
+
+
+def _edge_locations(arena_size):
+    """The edge locations in the same order as GameMap.get_edges
+    """
+    half = arena_size // 2
+    top_right = [(half + n, arena_size - 1 - n) for n in range(half)]
+    top_left = [(half - 1 - n, arena_size - 1 - n) for n in range(half)]
+    bottom_left = [(half - 1 - n, n) for n in range(half)]
+    bottom_right = [(half + n, n) for n in range(half)]
+    return [top_right, top_left, bottom_left, bottom_right]
+
+class FieldPathFinder:
+    """Path-finding that gives the same paths as ShortestPathFinder, but reuses its work between queries.
+
+    ShortestPathFinder rebuilds its node grid and runs two searches for every path it finds.
+    This class keeps a grid of blocked tiles and caches one distance field per target edge and
+    pocket of connected tiles, so once a field exists every path and every step along it is cheap.
+    Fields are thrown away whenever a tile is blocked or unblocked.
+
+    Attributes :
+        * HORIZONTAL (int): A constant representing a horizontal movement
+        * VERTICAL (int): A constant representing a vertical movement
+        * arena_size (int): The size of the arena
+        * blocked (list): blocked[x][y] is True if a structure stands at [x, y]
+
+    """
+    def __init__(self, arena_size=28):
+        self.HORIZONTAL = 1
+        self.VERTICAL = 2
+        self.arena_size = arena_size
+        half = arena_size // 2
+        self._in_bounds = [[(y < half and half - y - 1 <= x <= half + y) or
+                            (y >= half and y - half <= x <= arena_size + half - y - 1)
+                            for y in range(arena_size)] for x in range(arena_size)]
+        self._neighbors = [[self._valid_neighbors(x, y) for y in range(arena_size)] for x in range(arena_size)]
+        self._edges = _edge_locations(arena_size)
+        self._edge_sets = [set(edge) for edge in self._edges]
+        self._directions = [self._edge_direction(edge) for edge in self._edges]
+        self.blocked = [[False] * arena_size for _ in range(arena_size)]
+        self._clear_fields()
+
+    @classmethod
+    def from_game_state(cls, game_state):
+        """Creates a path finder with every structure on the given game state's map blocked
+
+        Args:
+            game_state: A GameState
+
+        Returns:
+            A FieldPathFinder for the board of game_state
+
+        """
+        finder = cls(game_state.ARENA_SIZE)
+        for location in game_state.game_map:
+            if game_state.contains_stationary_unit(location):
+                finder.blocked[location[0]][location[1]] = True
+        return finder
+
+    def copy(self):
+        """Creates a path finder for the same board that can be changed independently.
+        Distance fields computed so far are shared until either board changes.
+        """
+        finder = FieldPathFinder.__new__(FieldPathFinder)
+        finder.__dict__.update(self.__dict__)
+        finder.blocked = [column[:] for column in self.blocked]
+        return finder
+
+    def new_board(self):
+        """Creates a path finder with no tiles blocked that shares the arena geometry of this one,
+        which is cheaper than creating one for every board
+        """
+        finder = FieldPathFinder.__new__(FieldPathFinder)
+        finder.__dict__.update(self.__dict__)
+        finder.blocked = [[False] * self.arena_size for _ in range(self.arena_size)]
+        finder._clear_fields()
+        return finder
+
+    def _valid_neighbors(self, x, y):
+        neighbors = []
+        for nx, ny in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)):
+            if 0 <= nx < self.arena_size and 0 <= ny < self.arena_size and self._in_bounds[nx][ny]:
+                neighbors.append((nx, ny))
+        return neighbors
+
+    def _edge_direction(self, edge):
+        x, y = edge[0]
+        half = self.arena_size // 2
+        return (-1 if x < half else 1, -1 if y < half else 1)
+
+    def _clear_fields(self):
+        self._components = None
+        self._fields = {}
+
+    def in_arena_bounds(self, location):
+        x, y = location
+        return 0 <= x < self.arena_size and 0 <= y < self.arena_size and self._in_bounds[x][y]
+
+    def set_blocked(self, location, blocked=True):
+        """Marks a tile as blocked or unblocked
+
+        Args:
+            location: The [x, y] location of the tile
+            blocked: True if a structure now stands on the tile, False if it was removed
+
+        """
+        x, y = location
+        if self.blocked[x][y] != blocked:
+            self.blocked[x][y] = blocked
+            self._clear_fields()
+
+    def get_target_edge(self, start_location):
+        """Gets the edge a unit spawned at the given location would try to reach, like GameState.get_target_edge
+        """
+        half = self.arena_size // 2
+        left = start_location[0] < half
+        bottom = start_location[1] < half
+        if left:
+            return 0 if bottom else 3
+        return 1 if bottom else 2
+
+    def _label_components(self):
+        """Splits the open tiles into pockets of connected tiles
+        """
+        size = self.arena_size
+        components = [[-1] * size for _ in range(size)]
+        count = 0
+        for x in range(size):
+            for y in range(size):
+                if not self._in_bounds[x][y] or self.blocked[x][y] or components[x][y] != -1:
+                    continue
+                components[x][y] = count
+                current = [(x, y)]
+                for cx, cy in current:
+                    for nx, ny in self._neighbors[cx][cy]:
+                        if components[nx][ny] == -1 and not self.blocked[nx][ny]:
+                            components[nx][ny] = count
+                            current.append((nx, ny))
+                count += 1
+        self._components = components
+
+    def _get_field(self, location, target_edge):
+        """Gets the pathlength field a unit at location uses to reach target_edge
+        """
+        if self._components is None:
+            self._label_components()
+        component = self._components[location[0]][location[1]]
+        key = (target_edge, component)
+        field = self._fields.get(key)
+        if field is not None:
+            return field
+
+        edge = self._edges[target_edge]
+        if any(self._components[x][y] == component for x, y in edge):
+            # Every pocket that reaches the edge shares the field that starts from the whole edge
+            field = self._fields.get((target_edge, None))
+            if field is None:
+                field = self._search(edge)
+                self._fields[(target_edge, None)] = field
+        else:
+            field = self._search([self._most_ideal(component, target_edge)])
+        self._fields[key] = field
+        return field
+
+    def _most_ideal(self, component, target_edge):
+        """The best self destruct location in a pocket, see ShortestPathFinder._get_idealness
+        """
+        direction = self._directions[target_edge]
+        best = None
+        best_idealness = -1
+        last = self.arena_size - 1
+        for x in range(self.arena_size):
+            for y in range(self.arena_size):
+                if self._components[x][y] != component:
+                    continue
+                idealness = self.arena_size * (y if direction[1] == 1 else last - y) + (x if direction[0] == 1 else last - x)
+                if idealness > best_idealness:
+                    best_idealness = idealness
+                    best = (x, y)
+        return best
+
+    def _search(self, sources):
+        """Breadth first search from the sources, see ShortestPathFinder._validate
+        """
+        size = self.arena_size
+        field = [[-1] * size for _ in range(size)]
+        current = []
+        for x, y in sources:
+            field[x][y] = 0
+            if not self.blocked[x][y]:
+                current.append((x, y))
+        for x, y in current:
+            pathlength = field[x][y] + 1
+            for nx, ny in self._neighbors[x][y]:
+                if field[nx][ny] == -1 and not self.blocked[nx][ny]:
+                    field[nx][ny] = pathlength
+                    current.append((nx, ny))
+        return field
+
+    def next_move(self, location, previous_move_direction, target_edge):
+        """Gets the next step a unit takes, see ShortestPathFinder._choose_next_move
+
+        Args:
+            location: The unit's current location, must not be blocked
+            previous_move_direction: HORIZONTAL, VERTICAL, or 0 if the unit has not moved yet
+            target_edge: The edge the unit is trying to reach
+
+        Returns:
+            A (location, move_direction) tuple, or None if the unit has reached the end of its path
+
+        """
+        field = self._get_field(location, target_edge)
+        x, y = location
+        best_pathlength = field[x][y]
+        if best_pathlength == 0:
+            return None
+        direction = self._directions[target_edge]
+        best = (x, y)
+        for neighbor in self._neighbors[x][y]:
+            nx, ny = neighbor
+            if self.blocked[nx][ny]:
+                continue
+            pathlength = field[nx][ny]
+            if pathlength > best_pathlength:
+                continue
+            if pathlength == best_pathlength and not self._better_direction(location, neighbor, best, previous_move_direction, direction):
+                continue
+            best = neighbor
+            best_pathlength = pathlength
+        move_direction = self.VERTICAL if best[0] == x else self.HORIZONTAL
+        return best, move_direction
+
+    def _better_direction(self, prev_tile, new_tile, prev_best, previous_move_direction, direction):
+        """Compare two tiles and return True if the unit would rather move to the new one, see ShortestPathFinder._better_direction
+        """
+        if previous_move_direction == self.HORIZONTAL and not new_tile[0] == prev_best[0]:
+            return not prev_tile[1] == new_tile[1]
+        if previous_move_direction == self.VERTICAL and not new_tile[1] == prev_best[1]:
+            return not prev_tile[0] == new_tile[0]
+        if previous_move_direction == 0:
+            return not prev_tile[1] == new_tile[1]
+        if new_tile[1] == prev_best[1]:
+            return (direction[0] == 1 and new_tile[0] > prev_best[0]) or (direction[0] == -1 and new_tile[0] < prev_best[0])
+        if new_tile[0] == prev_best[0]:
+            return (direction[1] == 1 and new_tile[1] > prev_best[1]) or (direction[1] == -1 and new_tile[1] < prev_best[1])
+        return True
+
+    def get_path(self, start_location, target_edge=None):
+        """Gets the path a unit at a given location would take, see GameState.find_path_to_edge
+
+        Args:
+            start_location: The location of a hypothetical unit
+            target_edge: The edge the unit wants to reach. Induced from start_location if None.
+
+        Returns:
+            A list of locations from start_location to the end of the path, or None if start_location is blocked
+
+        """
+        x, y = start_location
+        if self.blocked[x][y]:
+            return None
+        if target_edge is None:
+            target_edge = self.get_target_edge(start_location)
+        path = [[x, y]]
+        location = (x, y)
+        move_direction = 0
+        while True:
+            step = self.next_move(location, move_direction, target_edge)
+            if step is None:
+                return path
+            location, move_direction = step
+            path.append([location[0], location[1]])
+
+    def is_on_edge(self, location, target_edge):
+        """Returns True if location is one of the tiles of target_edge
+        """
+        return tuple(location) in self._edge_sets[target_edge]
@@ -0,0 +1,119 @@
+"""
+Declared strategy parameters, the constants a strategy may want tuned.
+
+A strategy declares its parameters in the PARAMETERS dict of its AlgoStrategy class and reads the values
+from self.parameters instead of hard coding them:
+
+    class AlgoStrategy(gamelib.AlgoCore):
+        PARAMETERS = {
+            "attack_interval": gamelib.Parameter(3, values=[2, 3, 4]),
+            "survival_threshold": gamelib.Parameter(0.7, low=0.5, high=0.9),
+        }
+
+        def on_turn(self, turn_state):
+            if game_state.turn_number % self.parameters["attack_interval"] == 0:
+                ...
+
+The defaults are used unless values are set with AlgoCore.set_parameters, or given as a JSON object
+in the GAMELIB_PARAMETERS environment variable when the algo runs as a subprocess. sweep.py searches
+over the declared values.
+"""
+import json
+import os
+
+from .util import debug_write
+
+PARAMETERS_ENV = "GAMELIB_PARAMETERS"
+DEFAULT_GRID_STEPS = 5
+
+
+class Parameter:
+    """A tunable constant of a strategy and the values it may take.
+
+    Attributes :
+        * default: The value used when none is set
+        * values (list): The values to try, if the parameter is discrete
+        * low: The lowest value to try, if the parameter is a range
+        * high: The highest value to try, if the parameter is a range
+        * integer (bool): Whether a range only holds whole numbers. Defaults to True if low, high and default are ints
+        * steps (int): The number of evenly spaced values a grid search tries from a range of floats
+
+    """
+    def __init__(self, default, values=None, low=None, high=None, integer=None, steps=DEFAULT_GRID_STEPS):
+        if values is None and (low is None or high is None):
+            values = [default]
+        self.default = default
+        self.values = list(values) if values is not None else None
+        self.low = low
+        self.high = high
+        if integer is None:
+            integer = all(isinstance(value, int) for value in (default, low, high) if value is not None)
+        self.integer = integer
+        self.steps = steps
+
+    def grid(self):
+        """Returns the values a grid search tries
+        """
+        if self.values is not None:
+            return list(self.values)
+        if self.integer:
+            return list(range(self.low, self.high + 1))
+        if self.steps < 2:
+            return [self.default]
+        return [self.low + (self.high - self.low) * step / (self.steps - 1) for step in range(self.steps)]
+
+    def sample(self, rng):
+        """Draws a random value
+
+        Args:
+            rng: A random.Random
+
+        """
+        if self.values is not None:
+            return rng.choice(self.values)
+        if self.integer:
+            return rng.randint(self.low, self.high)
+        return rng.uniform(self.low, self.high)
+
+    def __repr__(self):
+        if self.values is not None:
+            return "Parameter({!r}, values={!r})".format(self.default, self.values)
+        return "Parameter({!r}, low={!r}, high={!r})".format(self.default, self.low, self.high)
+
+
+def resolve_parameters(declared, values=None):
+    """Gets the value of every declared parameter
+
+    Args:
+        declared: The PARAMETERS dict of a strategy
+        values: Values to use instead of the defaults. Undeclared names are ignored with a warning
+
+    Returns:
+        A dict of every declared parameter's value
+
+    """
+    resolved = {name: parameter.default for name, parameter in declared.items()}
+    for name, value in (values or {}).items():
+        if name not in declared:
+            debug_write("Ignoring undeclared parameter {}".format(name))
+            continue
+        resolved[name] = value
+    return resolved
+
+
+def environment_parameters():
+    """Reads the parameter values set in the GAMELIB_PARAMETERS environment variable
+
+    Returns:
+        A dict of values, empty if the variable is not set or is not a JSON object
+
+    """
+    text = os.environ.get(PARAMETERS_ENV)
+    if not text:
+        return {}
+    try:
+        values = json.loads(text)
+    except ValueError:
+        debug_write("Could not read {} as JSON: {}".format(PARAMETERS_ENV, text))
+        return {}
+    return values if isinstance(values, dict) else {}
@@ -0,0 +1,166 @@
+"""
+A sampling profiler for on_turn that only uses the standard library.
+
+While on_turn runs, a background thread looks at the main thread's stack at a fixed interval and counts
+how often each stack was seen. Unlike cProfile this does not slow every function call down, so pathing
+heavy turns keep their shape. The counts are written in the collapsed stack format flamegraph tools read,
+one "outer;inner;innermost count" line per stack.
+
+Profiling is turned on with environment variables, no code changes needed:
+
+    * GAMELIB_PROFILE: A directory for one turn-NNNN.folded file per turn, or a file for the stacks of the whole game
+    * GAMELIB_PROFILE_INTERVAL: Seconds between samples, DEFAULT_INTERVAL by default
+
+"""
+import os
+import sys
+import atexit
+import threading
+from collections import Counter
+
+from .util import debug_write
+
+PROFILE_ENV = "GAMELIB_PROFILE"
+PROFILE_INTERVAL_ENV = "GAMELIB_PROFILE_INTERVAL"
+DEFAULT_INTERVAL = 0.002
+
+
+def _frame_name(code):
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def write_collapsed(stacks, path):
+    """Writes stack counts in the collapsed stack format
+
+    Args:
+        stacks: A Counter of stacks, each a tuple of frame names from the outermost
+        path: The file to write
+
+    """
+    with open(path, "w") as file:
+        for stack, samples in stacks.most_common():
+            file.write("{} {}\n".format(";".join(stack), samples))
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread.
+
+    Attributes :
+        * interval (float): Seconds between samples
+        * thread_id (int): The thread sampled, the thread that created the sampler by default
+        * stacks (Counter): How many times each stack was seen since the sampler started
+
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._codes = {}
+
+    def _stack(self, frame):
+        names = []
+        codes = self._codes
+        while frame is not None:
+            code = frame.f_code
+            name = codes.get(code)
+            if name is None:
+                name = codes[code] = _frame_name(code)
+            names.append(name)
+            frame = frame.f_back
+        names.reverse()
+        return tuple(names)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._stack(frame)] += 1
+
+    def start(self):
+        """Starts sampling with an empty set of stacks
+        """
+        self.stacks = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="gamelib-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling
+
+        Returns:
+            The Counter of stacks seen
+
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.stacks
+
+
+class TurnProfiler:
+    """Samples every on_turn and writes the stacks per turn or for the whole game.
+
+    Attributes :
+        * path (string): A directory to write a file per turn to, or a file to write the whole game's stacks to
+        * per_turn (bool): Whether path is a directory of per turn files
+        * stacks (Counter): The stacks of every turn so far
+        * sampler (StackSampler): Samples the thread on_turn runs on
+
+    """
+    def __init__(self, path, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.per_turn = os.path.isdir(path) or path.endswith(os.sep)
+        if self.per_turn:
+            os.makedirs(path, exist_ok=True)
+        self.stacks = Counter()
+        self.sampler = StackSampler(interval)
+        self._turn_number = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def begin_turn(self, turn_number):
+        self._turn_number = turn_number
+        self.sampler.thread_id = threading.get_ident()
+        self.sampler.start()
+
+    def end_turn(self):
+        stacks = self.sampler.stop()
+        self.stacks.update(stacks)
+        if self.per_turn:
+            write_collapsed(stacks, os.path.join(self.path, "turn-{:04d}.folded".format(self._turn_number or 0)))
+
+    def close(self):
+        """Writes the whole game's stacks, if they are not written per turn. Called automatically at exit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self.sampler.stop()
+        if not self.per_turn:
+            write_collapsed(self.stacks, self.path)
+
+
+def profiler_from_environment():
+    """Creates a TurnProfiler if the GAMELIB_PROFILE environment variable is set
+
+    Returns:
+        The TurnProfiler, or None
+
+    """
+    path = os.environ.get(PROFILE_ENV)
+    if not path:
+        return None
+    try:
+        interval = float(os.environ.get(PROFILE_INTERVAL_ENV, DEFAULT_INTERVAL))
+    except ValueError:
+        debug_write("Invalid {}, sampling every {}s".format(PROFILE_INTERVAL_ENV, DEFAULT_INTERVAL))
+        interval = DEFAULT_INTERVAL
+    try:
+        return TurnProfiler(path, interval)
+    except OSError as e:
+        debug_write("Could not profile to {}: {}".format(path, e))
+        return None
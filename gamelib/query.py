@@ -0,0 +1,372 @@
+"""
+Indexed queries over a replay corpus, see corpus.py.
+
+build_indexes adds secondary indexes to a corpus directory, again whenever games are added to it:
+
+    * turns.bin: One row per turn, with the turn state row and the range of its action frame rows
+    * bitboards.bin: For every turn and player, a bitboard of the tiles holding each structure type, and of upgraded structures
+    * breaches.bin: Every breach by the turn it happened in, sorted by location and player
+    * attacks.bin: Every group of mobile units a player spawned on one tile in a turn, with how many of them scored
+
+Queries are small objects that select turns from these indexes with vectorized NumPy operations.
+CorpusQueryEngine runs them over ranges of turns in a process pool and returns the matching (game, turn) pairs:
+
+    engine = CorpusQueryEngine("corpus")
+    engine.run(BreachQuery([13, 27], player_index=1, min_turn=21))
+    engine.run(LayoutQuery([(TURRET_INDEX, 3, 15, True), (TURRET_INDEX, 4, 15, True)], player_index=1))
+    engine.run(AttackQuery([14, 0], min_lost=0.5))
+
+NumPy is required for this module.
+"""
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .corpus import ReplayCorpus, EVENT_KINDS, TURN_STATE_FRAME
+
+INDEX_VERSION = 1
+ARENA_TILES = 28 * 28
+BITBOARD_BYTES = ARENA_TILES // 8
+# Bitboard layers: the three structure type indexes, then upgraded structures (unit type index 7 in the engine's unit lists)
+STRUCTURE_LAYERS = {0: 0, 1: 1, 2: 2, 7: 3}
+UPGRADED_LAYER = 3
+MOBILE_TYPES = (3, 4, 5)
+BITBOARD_CHUNK = 4096
+PARALLEL_MIN_TURNS = 50000
+
+TURN_DTYPE = np.dtype([("game", "<u4"), ("turn", "<i4"), ("state", "<u4"), ("frame_start", "<u4"), ("frame_stop", "<u4")])
+BREACH_DTYPE = np.dtype([("location", "<u2"), ("player", "u1"), ("turn_index", "<u4")])
+ATTACK_DTYPE = np.dtype([("turn_index", "<u4"), ("player", "u1"), ("type", "u1"), ("x", "u1"), ("y", "u1"),
+                         ("spawned", "<u4"), ("scored", "<u4")])
+
+
+def _location_code(x, y):
+    return x * 28 + y
+
+
+def _turn_of_states(states):
+    """Maps every state row to the index of the turn it belongs to, -1 for frames before a game's first turn
+    """
+    is_turn = states["frame"] == TURN_STATE_FRAME
+    turn_index = np.cumsum(is_turn) - 1
+    turn_games = states["game"][is_turn]
+    # Frames must not be attributed to the last turn of the previous game
+    orphaned = (turn_index < 0) | (turn_games[np.maximum(turn_index, 0)] != states["game"]) if len(turn_games) else turn_index < 0
+    turn_index[orphaned] = -1
+    return turn_index
+
+
+def build_indexes(directory):
+    """Builds the secondary indexes of a corpus directory, replacing any that exist
+
+    Args:
+        directory: A directory written by corpus.CorpusWriter
+
+    """
+    corpus = ReplayCorpus(directory)
+    states = corpus.states
+    turn_of_state = _turn_of_states(states)
+    turn_rows = np.flatnonzero(states["frame"] == TURN_STATE_FRAME)
+    turn_count = len(turn_rows)
+
+    turns = np.zeros(turn_count, dtype=TURN_DTYPE)
+    turns["game"] = states["game"][turn_rows]
+    turns["turn"] = states["turn"][turn_rows]
+    turns["state"] = turn_rows
+    turns["frame_start"] = turn_rows + 1
+    # A turn's frames end at the next turn, or at the end of its game
+    turns["frame_stop"] = np.minimum(np.r_[turn_rows[1:], len(states)], np.searchsorted(states["game"], turns["game"], side="right"))
+
+    bitboard_path = os.path.join(directory, "bitboards.bin")
+    with open(bitboard_path, "wb") as file:
+        for chunk_start in range(0, turn_count, BITBOARD_CHUNK):
+            chunk_stop = min(chunk_start + BITBOARD_CHUNK, turn_count)
+            boards = np.zeros((chunk_stop - chunk_start, 2, len(STRUCTURE_LAYERS), ARENA_TILES), dtype=bool)
+            first = int(states["unit_start"][turn_rows[chunk_start]])
+            last_row = turn_rows[chunk_stop - 1]
+            last = int(states["unit_start"][last_row] + states["unit_count"][last_row])
+            units = corpus.units[first:last]
+            unit_turns = turn_of_state[units["state"]]
+            in_turn_state = states["frame"][units["state"]] == TURN_STATE_FRAME
+            layers = np.full(8, -1)
+            for unit_type, layer in STRUCTURE_LAYERS.items():
+                layers[unit_type] = layer
+            unit_layers = layers[np.minimum(units["type"], 7)]
+            keep = in_turn_state & (unit_layers >= 0)
+            boards[unit_turns[keep] - chunk_start, units["player"][keep], unit_layers[keep],
+                   _location_code(units["x"][keep].astype(np.int64), units["y"][keep].astype(np.int64))] = True
+            file.write(np.packbits(boards, axis=-1).tobytes())
+
+    events = corpus.events
+    breaches_mask = events["kind"] == EVENT_KINDS.index("breach")
+    breach_events = events[breaches_mask]
+    breaches = np.zeros(len(breach_events), dtype=BREACH_DTYPE)
+    breaches["location"] = _location_code(breach_events["x"].astype(np.int64), breach_events["y"].astype(np.int64))
+    breaches["player"] = breach_events["player"]
+    breaches["turn_index"] = turn_of_state[breach_events["state"]]
+    breaches = breaches[turn_of_state[breach_events["state"]] >= 0]
+    breaches = breaches[np.lexsort((breaches["turn_index"], breaches["player"], breaches["location"]))]
+
+    spawn_mask = (events["kind"] == EVENT_KINDS.index("spawn")) & np.isin(events["type"], MOBILE_TYPES)
+    spawns = events[spawn_mask]
+    spawn_turns = turn_of_state[spawns["state"]]
+    spawns, spawn_turns = spawns[spawn_turns >= 0], spawn_turns[spawn_turns >= 0]
+    breach_keys = (turn_of_state[breach_events["state"]].astype(np.int64) << 32) | (breach_events["id"] & 0xFFFFFFFF)
+    spawn_keys = (spawn_turns.astype(np.int64) << 32) | (spawns["id"] & 0xFFFFFFFF)
+    scored = np.isin(spawn_keys, breach_keys)
+    groups = np.zeros(len(spawns), dtype=[("turn_index", "<u4"), ("player", "u1"), ("type", "u1"), ("x", "u1"), ("y", "u1")])
+    groups["turn_index"] = spawn_turns
+    for name in ("player", "type", "x", "y"):
+        groups[name] = spawns[name]
+    unique, inverse = np.unique(groups, return_inverse=True)
+    attacks = np.zeros(len(unique), dtype=ATTACK_DTYPE)
+    for name in unique.dtype.names:
+        attacks[name] = unique[name]
+    attacks["spawned"] = np.bincount(inverse.ravel(), minlength=len(unique))
+    attacks["scored"] = np.bincount(inverse.ravel(), weights=scored, minlength=len(unique))
+
+    turns.tofile(os.path.join(directory, "turns.bin"))
+    breaches.tofile(os.path.join(directory, "breaches.bin"))
+    attacks.tofile(os.path.join(directory, "attacks.bin"))
+    with open(os.path.join(directory, "indexes.json"), "w") as file:
+        json.dump({"version": INDEX_VERSION, "turns": turn_count, "breaches": len(breaches), "attacks": len(attacks),
+                   "corpus": _corpus_size(directory)}, file)
+
+
+def _corpus_size(directory):
+    with open(os.path.join(directory, "index.json")) as file:
+        index = json.load(file)
+    return {"games": len(index["games"]), "counts": index["counts"]}
+
+
+def indexes_are_current(directory):
+    """Checks if a corpus directory has indexes, built from every game now in the corpus
+
+    Args:
+        directory: A directory written by corpus.CorpusWriter
+
+    Returns:
+        False if the indexes are missing, of another version, or older than games added to the corpus since
+
+    """
+    path = os.path.join(directory, "indexes.json")
+    if not os.path.exists(path):
+        return False
+    with open(path) as file:
+        indexes = json.load(file)
+    return indexes["version"] == INDEX_VERSION and indexes.get("corpus") == _corpus_size(directory)
+
+
+class CorpusIndexes:
+    """Memory-mapped access to the secondary indexes of a corpus directory.
+
+    Attributes :
+        * games (list): The names of the games
+        * turns (numpy.memmap): TURN_DTYPE rows, a turn index is a row of this array
+        * bitboards (numpy.memmap): Packed bitboards, shaped (turns, 2 players, 4 layers, 98 bytes)
+        * breaches (numpy.memmap): BREACH_DTYPE rows sorted by location, player and turn
+        * attacks (numpy.memmap): ATTACK_DTYPE rows sorted by turn
+
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, "indexes.json")) as file:
+            counts = json.load(file)
+        if counts["version"] != INDEX_VERSION:
+            raise ValueError("Index version {} is not supported, rebuild the indexes".format(counts["version"]))
+        with open(os.path.join(directory, "index.json")) as file:
+            self.games = json.load(file)["games"]
+        self.turns = self._open(directory, "turns", TURN_DTYPE, (counts["turns"],))
+        self.bitboards = self._open(directory, "bitboards", np.uint8, (counts["turns"], 2, len(STRUCTURE_LAYERS), BITBOARD_BYTES))
+        self.breaches = self._open(directory, "breaches", BREACH_DTYPE, (counts["breaches"],))
+        self.attacks = self._open(directory, "attacks", ATTACK_DTYPE, (counts["attacks"],))
+
+    def _open(self, directory, name, dtype, shape):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(directory, name + ".bin"), dtype=dtype, mode="r", shape=shape)
+
+
+class BreachQuery:
+    """Turns in which units scored at a location.
+
+    Attributes :
+        * location ([x, y]): Where the units scored
+        * player_index (int): The owner of the scoring units, 1 for turns where your opponent scored on you
+        * min_turn (int): Only turns numbered at least this, or None
+        * max_turn (int): Only turns numbered at most this, or None
+
+    """
+    def __init__(self, location, player_index=1, min_turn=None, max_turn=None):
+        self.location = location
+        self.player_index = player_index
+        self.min_turn = min_turn
+        self.max_turn = max_turn
+
+    def select(self, indexes, start, stop):
+        breaches = indexes.breaches
+        key = _location_code(*self.location)
+        # Breaches are sorted by location, then player, then turn, so the matching rows are one slice
+        locations = breaches["location"]
+        low = np.searchsorted(locations, key, side="left")
+        high = np.searchsorted(locations, key, side="right")
+        rows = breaches[low:high]
+        rows = rows[rows["player"] == self.player_index]
+        turns = np.unique(rows["turn_index"])
+        turns = turns[(turns >= start) & (turns < stop)]
+        return _filter_turn_numbers(indexes, turns, self.min_turn, self.max_turn)
+
+
+class LayoutQuery:
+    """Turns that start with a player's structures in a given layout.
+
+    Attributes :
+        * structures (list): (unit_type_index, x, y, upgraded) entries that must all be on the board
+        * player_index (int): The owner of the structures, 1 for your opponent
+
+    """
+    def __init__(self, structures, player_index=1):
+        self.structures = structures
+        self.player_index = player_index
+
+    def masks(self):
+        """Returns the bits each layer must have set, packed like the bitboards
+        """
+        required = np.zeros((len(STRUCTURE_LAYERS), ARENA_TILES), dtype=bool)
+        for unit_type, x, y, upgraded in self.structures:
+            required[STRUCTURE_LAYERS[unit_type], _location_code(x, y)] = True
+            if upgraded:
+                required[UPGRADED_LAYER, _location_code(x, y)] = True
+        return np.packbits(required, axis=-1)
+
+    def select(self, indexes, start, stop):
+        masks = self.masks()
+        layers = np.flatnonzero(masks.any(axis=1))
+        boards = indexes.bitboards[start:stop, self.player_index]
+        matches = np.ones(stop - start, dtype=bool)
+        for layer in layers:
+            columns = np.flatnonzero(masks[layer])
+            matches &= ((boards[:, layer, columns] & masks[layer, columns]) == masks[layer, columns]).all(axis=1)
+        return np.flatnonzero(matches) + start
+
+
+class AttackQuery:
+    """Turns in which a group of mobile units spawned on one tile lost at least some share of its units.
+
+    Attributes :
+        * location ([x, y]): Where the units were spawned
+        * player_index (int): The owner of the units, 0 for yourself
+        * unit_type (int): The unit type index of the units, or None for any mobile unit
+        * min_lost (float): The smallest share of the group that must not have scored
+        * min_spawned (int): The smallest group considered
+
+    """
+    def __init__(self, location, player_index=0, unit_type=None, min_lost=0.5, min_spawned=1):
+        self.location = location
+        self.player_index = player_index
+        self.unit_type = unit_type
+        self.min_lost = min_lost
+        self.min_spawned = min_spawned
+
+    def select(self, indexes, start, stop):
+        attacks = indexes.attacks
+        low = np.searchsorted(attacks["turn_index"], start, side="left")
+        high = np.searchsorted(attacks["turn_index"], stop, side="left")
+        rows = attacks[low:high]
+        mask = ((rows["x"] == self.location[0]) & (rows["y"] == self.location[1])
+                & (rows["player"] == self.player_index) & (rows["spawned"] >= self.min_spawned))
+        if self.unit_type is not None:
+            mask &= rows["type"] == self.unit_type
+        rows = rows[mask]
+        lost = (rows["spawned"] - rows["scored"]) / np.maximum(rows["spawned"], 1)
+        # Turns where several unit types spawned on the tile are judged per type, any one losing enough matches
+        return np.unique(rows["turn_index"][lost > self.min_lost])
+
+
+def _filter_turn_numbers(indexes, turns, min_turn, max_turn):
+    numbers = indexes.turns["turn"][turns]
+    mask = np.ones(len(turns), dtype=bool)
+    if min_turn is not None:
+        mask &= numbers >= min_turn
+    if max_turn is not None:
+        mask &= numbers <= max_turn
+    return turns[mask]
+
+
+_worker_indexes = None
+
+
+def _open_worker(directory):
+    global _worker_indexes
+    _worker_indexes = CorpusIndexes(directory)
+
+
+def _select_in_worker(query, start, stop):
+    return query.select(_worker_indexes, start, stop)
+
+
+class CorpusQueryEngine:
+    """Runs queries over the indexes of a corpus, in parallel across processes for large corpora.
+
+    Attributes :
+        * directory (string): The corpus directory
+        * indexes (CorpusIndexes): The indexes, built first if the corpus has none or games were added since
+        * workers (int): The number of worker processes, defaults to the number of CPUs
+
+    """
+    def __init__(self, directory, workers=None):
+        self.directory = directory
+        if not indexes_are_current(directory):
+            build_indexes(directory)
+        self.indexes = CorpusIndexes(directory)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def run(self, query, parallel=None):
+        """Runs a query over every turn of the corpus
+
+        Args:
+            query: A query object with a select(indexes, start, stop) method, like BreachQuery
+            parallel: Whether to split the turns across worker processes. By default only large corpora are split
+
+        Returns:
+            A list of (game name, turn number) pairs, in corpus order
+
+        """
+        turn_count = len(self.indexes.turns)
+        if parallel is None:
+            parallel = self.workers > 1 and turn_count >= PARALLEL_MIN_TURNS
+        if not parallel:
+            turns = query.select(self.indexes, 0, turn_count)
+        else:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, initializer=_open_worker, initargs=(self.directory,))
+            step = -(-turn_count // self.workers)
+            ranges = [(start, min(start + step, turn_count)) for start in range(0, turn_count, step)]
+            parts = self._pool.map(_select_in_worker, [query] * len(ranges), *zip(*ranges))
+            turns = np.concatenate(list(parts)) if ranges else np.zeros(0, dtype=np.int64)
+        rows = self.indexes.turns[np.asarray(turns, dtype=np.int64)]
+        return [(self.indexes.games[game], int(turn)) for game, turn in zip(rows["game"], rows["turn"])]
+
+    def close(self):
+        """Shuts down the worker processes
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("Usage: python -m gamelib.query CORPUS_DIRECTORY")
+        return 2
+    build_indexes(argv[0])
+    print("Built the indexes of {}".format(argv[0]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Recording of the messages exchanged with the engine.
+
+A replay file is a gzip stream that starts with REPLAY_MAGIC, followed by one record per message.
+Each record is a RECORD_HEADER (kind, payload length, seconds since the recording started) and then the payload,
+the message exactly as it was read from stdin or written to stdout without its trailing newline.
+"""
+import os
+import gzip
+import time
+import queue
+import struct
+import threading
+
+REPLAY_MAGIC = b"C1REPLAY1\n"
+RECORD_HEADER = struct.Struct("<BId")
+INPUT = 0
+OUTPUT = 1
+COMPRESS_LEVEL = 5
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def replay_file_name(directory):
+    """Gets a new replay file name in a directory, unique per game process
+    """
+    return os.path.join(directory, "game-{}-{}.replay.gz".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+
+
+class ReplayRecorder:
+    """Appends engine messages to a replay file from a background thread, so recording never waits on the disk.
+
+    Attributes :
+        * path (string): The replay file being written
+        * records (int): The number of records queued so far
+
+    """
+    def __init__(self, path, compress_level=COMPRESS_LEVEL):
+        """Opens the replay file and starts the writer thread
+
+        Args:
+            path: The file to write, or an existing directory to create a new replay file in
+            compress_level: The gzip compression level
+
+        """
+        if os.path.isdir(path):
+            path = replay_file_name(path)
+        self.path = path
+        self.records = 0
+        self._file = gzip.open(path, "wb", compresslevel=compress_level)
+        self._file.write(REPLAY_MAGIC)
+        self._started = time.perf_counter()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, name="gamelib-replay-writer", daemon=True)
+        self._writer.start()
+
+    def record_input(self, message):
+        """Queues a message read from the engine
+
+        Args:
+            message: The message as bytes, without its trailing newline
+
+        """
+        self._record(INPUT, message)
+
+    def record_output(self, command):
+        """Queues a command sent to the engine
+
+        Args:
+            command: The command as a string or bytes, without its trailing newline
+
+        """
+        if isinstance(command, str):
+            command = command.encode("utf-8")
+        self._record(OUTPUT, command)
+
+    def _record(self, kind, payload):
+        if self._queue is None:
+            return
+        self.records += 1
+        self._queue.put((kind, time.perf_counter() - self._started, payload))
+
+    def _write(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            kind, elapsed, payload = record
+            self._file.write(RECORD_HEADER.pack(kind, len(payload), elapsed))
+            self._file.write(payload)
+
+    def close(self):
+        """Writes out every queued record and closes the file. Called automatically at exit.
+        """
+        if self._queue is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._queue = None
+        self._file.close()
+
+
+def read_replay(path):
+    """Reads the records of a replay file
+
+    Args:
+        path: The replay file
+
+    Returns:
+        A generator of (kind, seconds, payload) tuples, where kind is INPUT or OUTPUT and payload is bytes
+
+    """
+    with gzip.open(path, "rb") as replay:
+        if replay.read(len(REPLAY_MAGIC)) != REPLAY_MAGIC:
+            raise ValueError("{} is not a replay file".format(path))
+        while True:
+            try:
+                header = replay.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                kind, length, elapsed = RECORD_HEADER.unpack(header)
+                payload = replay.read(length)
+            except EOFError:
+                # A replay cut short by the process being killed ends in the middle of the stream
+                return
+            if len(payload) < length:
+                return
+            yield kind, elapsed, payload
+
+
+def read_messages(path):
+    """Reads just the engine messages of a recording, in the order they were received.
+    The recording may be a replay file or a plain text file with one message per line, like a saved copy of stdin.
+    """
+    with open(path, "rb") as recording:
+        compressed = recording.read(2) == GZIP_MAGIC
+    if not compressed:
+        with open(path, "rb") as recording:
+            for line in recording:
+                line = line.rstrip(b"\r\n")
+                if line:
+                    yield line
+        return
+    for kind, _, payload in read_replay(path):
+        if kind == INPUT:
+            yield payload
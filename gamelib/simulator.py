@@ -0,0 +1,393 @@
+"""
+Local simulation of the action phase.
+
+ActionPhaseSimulator steps the action phase frame by frame from the board of a GameState.
+Each frame runs in the same order as the engine:
+
+    1. Each support shields friendly mobile units in range that it has not shielded yet
+    2. Each mobile unit moves if it is its turn to move, scoring when it reaches its target edge
+       and self destructing when it reaches the end of a path that does not lead there
+    3. Each unit attacks the target GameState.get_target would choose
+    4. Units with no health left are removed, and mobile units re-path if a structure was destroyed
+
+Unit stats come from the config, so no values are hard coded here.
+"""
+import math
+
+from .navigation import FieldPathFinder
+from .unit import GameUnit
+
+DEFAULT_MAX_FRAMES = 1000
+DEFAULT_SELF_DESTRUCT_RANGE = 1.5
+DEFAULT_SELF_DESTRUCT_STEPS = 5
+
+
+class SimUnit:
+    """A unit taking part in a simulated action phase.
+
+    Attributes :
+        * unit_type (string): This unit's type
+        * player_index (integer): The player that controls this unit. 0 for you, 1 for your opponent.
+        * x (integer): The x coordinate of the unit
+        * y (integer): The y coordinate of the unit
+        * health (float): The current health of this unit, including shields
+        * stationary (bool): Whether or not this unit is a structure
+        * target_edge (int): The edge a mobile unit is trying to reach
+        * steps (int): The number of tiles a mobile unit has moved
+
+    """
+    __slots__ = ("unit_type", "type_index", "player_index", "x", "y", "health", "stationary", "upgraded",
+                 "damage_f", "damage_i", "attack_range", "shield_range", "shield_amount",
+                 "move_interval", "move_timer", "move_direction", "target_edge", "steps", "shielded_by",
+                 "breach_damage", "self_destruct_damage_f", "self_destruct_damage_i",
+                 "self_destruct_range", "self_destruct_steps")
+
+    def __init__(self, unit, type_index, type_config, arena_size):
+        self.unit_type = unit.unit_type
+        self.type_index = type_index
+        self.player_index = unit.player_index
+        self.x = unit.x
+        self.y = unit.y
+        self.health = unit.health
+        self.stationary = unit.stationary
+        self.upgraded = unit.upgraded
+        self.damage_f = unit.damage_f
+        self.damage_i = unit.damage_i
+        self.attack_range = unit.attackRange
+        self.shield_range = unit.shieldRange
+        # Supports further up the board give bigger shields, y is counted from each player's own edge
+        rows_forward = self.y if self.player_index == 0 else arena_size - 1 - self.y
+        self.shield_amount = unit.shieldPerUnit + unit.shieldBonusPerY * rows_forward
+        self.move_interval = max(1, int(round(1 / unit.speed))) if unit.speed > 0 else 0
+        self.move_timer = self.move_interval
+        self.move_direction = 0
+        self.target_edge = None
+        self.steps = 0
+        self.shielded_by = set()
+        self.breach_damage = type_config.get("playerBreachDamage", 1.0)
+        self.self_destruct_damage_f = type_config.get("selfDestructDamageTower", unit.max_health)
+        self.self_destruct_damage_i = type_config.get("selfDestructDamageWalker", unit.max_health)
+        self.self_destruct_range = type_config.get("selfDestructRange", DEFAULT_SELF_DESTRUCT_RANGE)
+        self.self_destruct_steps = type_config.get("selfDestructStepsRequired", DEFAULT_SELF_DESTRUCT_STEPS)
+
+    def __repr__(self):
+        owner = "Friendly" if self.player_index == 0 else "Enemy"
+        return "{} {}, health: {} location: {}".format(owner, self.unit_type, self.health, [self.x, self.y])
+
+
+class SimulationResult:
+    """The outcome of a simulated action phase.
+
+    Attributes :
+        * frames (int): The number of frames simulated
+        * breaches (list): [x, y, unit_type, player_index, frame] for every unit that reached its target edge
+        * self_destructs (list): [x, y, unit_type, player_index, frame] for every unit that self destructed
+        * destroyed_structures (list): [x, y, unit_type, player_index, frame] for every structure destroyed
+        * health_lost ([float, float]): The health each player lost to breaches
+        * structure_damage ([float, float]): The damage each player's units dealt to enemy structures
+        * mobile_damage ([float, float]): The damage each player's units dealt to enemy mobile units
+        * deployed ([int, int]): The number of mobile units each player deployed
+        * survivors ([int, int]): The number of each player's mobile units that reached their target edge
+        * remaining (list): Mobile units still on the board if the simulation stopped at max_frames
+        * structures (list): The structures still standing at the end, with their remaining health
+        * frame_events (list): If events were recorded, a dict per frame with the frame's "breach", "damage" and "death" events,
+          formatted like the events of the engine's action frames. Frame 1 is at index 0
+
+    """
+    def __init__(self):
+        self.frames = 0
+        self.breaches = []
+        self.self_destructs = []
+        self.destroyed_structures = []
+        self.health_lost = [0.0, 0.0]
+        self.structure_damage = [0.0, 0.0]
+        self.mobile_damage = [0.0, 0.0]
+        self.deployed = [0, 0]
+        self.survivors = [0, 0]
+        self.remaining = []
+        self.structures = []
+        self.frame_events = []
+
+    def damage_dealt(self, player_index=0):
+        """Returns the total damage the given player's units dealt to enemy units
+        """
+        return self.structure_damage[player_index] + self.mobile_damage[player_index]
+
+    def __repr__(self):
+        return "SimulationResult(frames={}, survivors={}, deployed={}, health_lost={}, structures_destroyed={})".format(
+            self.frames, self.survivors, self.deployed, self.health_lost, len(self.destroyed_structures))
+
+
+class ActionPhaseSimulator:
+    """Simulates the action phase that follows a GameState's deploy phase.
+
+    The simulator is meant to be created once per turn and then used to compare many candidate attacks,
+    path distance fields for the starting board are shared between simulations.
+
+    Attributes :
+        * config (JSON): Contains information about the game
+        * arena_size (int): The size of the arena
+        * max_frames (int): Simulations stop after this many frames even if mobile units remain
+
+    """
+    def __init__(self, game_state, max_frames=DEFAULT_MAX_FRAMES, template=None):
+        """Reads the structures on the board of a game state
+
+        Args:
+            game_state: The GameState to simulate from. Structures queued with attempt_spawn or attempt_upgrade are included
+            max_frames: Simulations stop after this many frames
+            template: A simulator of another board with the same config, whose arena geometry, range offsets and
+                unit templates are reused instead of being computed again
+
+        """
+        self.config = game_state.config
+        self.arena_size = game_state.ARENA_SIZE
+        self.max_frames = max_frames
+        self.game_state = game_state
+        self._hit_radius = self.config["unitInformation"][0].get("getHitRadius", 0)
+        if template is None:
+            self._type_indices = {unit["shorthand"]: index for index, unit in enumerate(self.config["unitInformation"]) if "shorthand" in unit}
+            self._range_offsets = {}
+            self._mobile_templates = {}
+            self._finder = FieldPathFinder(self.arena_size)
+        else:
+            self._type_indices = template._type_indices
+            self._range_offsets = template._range_offsets
+            self._mobile_templates = template._mobile_templates
+            self._finder = template._finder.new_board()
+
+        self._structures = []
+        for location in game_state.game_map:
+            for unit in game_state.game_map[location]:
+                if unit.stationary:
+                    self._structures.append(unit)
+                    self._finder.blocked[unit.x][unit.y] = True
+        self._finder._label_components()
+
+    def _sim_unit(self, unit):
+        index = self._type_indices[unit.unit_type]
+        return SimUnit(unit, index, self.config["unitInformation"][index], self.arena_size)
+
+    def _mobile_unit(self, unit_type, x, y, player_index):
+        key = (unit_type, player_index)
+        template = self._mobile_templates.get(key)
+        if template is None:
+            template = GameUnit(unit_type, self.config, player_index)
+            self._mobile_templates[key] = template
+        template.x = x
+        template.y = y
+        unit = self._sim_unit(template)
+        unit.health = template.max_health
+        unit.target_edge = self._finder.get_target_edge([x, y])
+        return unit
+
+    def _offsets(self, radius):
+        """The offsets of tiles within radius of a location, in the order GameMap.get_locations_in_range returns them
+        """
+        offsets = self._range_offsets.get(radius)
+        if offsets is None:
+            search_radius = math.ceil(radius)
+            offsets = []
+            for dx in range(-search_radius, search_radius + 1):
+                for dy in range(-search_radius, search_radius + 1):
+                    distance = math.sqrt(dx * dx + dy * dy)
+                    if distance < radius + self._hit_radius:
+                        offsets.append((dx, dy, distance))
+            self._range_offsets[radius] = offsets
+        return offsets
+
+    def target_finder(self, structure_grid, mobile_grid):
+        """Creates the function that picks the target of an attacker, with the same priorities as GameState.get_target
+
+        Args:
+            structure_grid: structure_grid[x][y] is the SimUnit structure at [x, y], or None
+            mobile_grid: mobile_grid[x][y] is the list of SimUnit mobile units at [x, y]
+
+        Returns:
+            A function that takes an attacking SimUnit and returns the SimUnit it attacks, or None
+
+        """
+        size = self.arena_size
+        in_bounds = self._finder._in_bounds
+
+        def find_target(attacker):
+            best = None
+            best_key = None
+            ax, ay = attacker.x, attacker.y
+            enemy = 1 - attacker.player_index
+            hits_structures = attacker.damage_f > 0
+            hits_mobiles = attacker.damage_i > 0
+            y_sign = 1 if attacker.player_index == 0 else -1
+            for dx, dy, distance in self._offsets(attacker.attack_range):
+                tx = ax + dx
+                ty = ay + dy
+                if tx < 0 or ty < 0 or tx >= size or ty >= size or not in_bounds[tx][ty]:
+                    continue
+                if hits_mobiles:
+                    for unit in mobile_grid[tx][ty]:
+                        if unit.player_index != enemy or unit.health <= 0:
+                            continue
+                        key = (0, distance, unit.health, y_sign * ty, -abs(size / 2 - 0.5 - tx))
+                        if best_key is None or key < best_key:
+                            best, best_key = unit, key
+                if hits_structures and (best_key is None or best_key[0] == 1):
+                    unit = structure_grid[tx][ty]
+                    if unit is not None and unit.player_index == enemy and unit.health > 0:
+                        key = (1, distance, unit.health, y_sign * ty, -abs(size / 2 - 0.5 - tx))
+                        if best_key is None or key < best_key:
+                            best, best_key = unit, key
+            return best
+
+        return find_target
+
+    def simulate(self, deploys=None, enemy_deploys=None, record_events=False):
+        """Simulates the action phase
+
+        Args:
+            deploys: Your deploys as (unit_type, x, y) entries, like GameState._deploy_stack. Defaults to the units queued on the game state
+            enemy_deploys: Your opponent's deploys as (unit_type, x, y) entries
+            record_events: Whether to record the events of every frame in the result's frame_events, which is slower
+
+        Returns:
+            A SimulationResult
+
+        """
+        if deploys is None:
+            deploys = self.game_state._deploy_stack
+        result = SimulationResult()
+        size = self.arena_size
+        finder = self._finder.copy()
+        in_bounds = finder._in_bounds
+        structure_grid = [[None] * size for _ in range(size)]
+        mobile_grid = [[[] for _ in range(size)] for _ in range(size)]
+
+        structures = []
+        for unit in self._structures:
+            structure = self._sim_unit(unit)
+            structures.append(structure)
+            structure_grid[structure.x][structure.y] = structure
+        supports = [unit for unit in structures if unit.shield_amount > 0 and unit.shield_range > 0]
+
+        mobiles = []
+        for player_index, stack in ((0, deploys), (1, enemy_deploys or [])):
+            for unit_type, x, y in stack:
+                if finder.blocked[x][y]:
+                    continue
+                unit = self._mobile_unit(unit_type, x, y, player_index)
+                mobiles.append(unit)
+                mobile_grid[x][y].append(unit)
+                result.deployed[player_index] += 1
+
+        find_target = self.target_finder(structure_grid, mobile_grid)
+
+        events = None
+
+        def deal_damage(attacker, target, damage):
+            if events is not None:
+                events["damage"].append([[target.x, target.y], damage, target.type_index, None, target.player_index + 1])
+            dealt = min(damage, target.health)
+            target.health -= damage
+            if target.stationary:
+                result.structure_damage[attacker.player_index] += dealt
+            else:
+                result.mobile_damage[attacker.player_index] += dealt
+
+        def self_destruct(unit, frame):
+            result.self_destructs.append([unit.x, unit.y, unit.unit_type, unit.player_index, frame])
+            if unit.steps >= unit.self_destruct_steps:
+                for dx, dy, _ in self._offsets(unit.self_destruct_range):
+                    tx = unit.x + dx
+                    ty = unit.y + dy
+                    if tx < 0 or ty < 0 or tx >= size or ty >= size or not in_bounds[tx][ty]:
+                        continue
+                    structure = structure_grid[tx][ty]
+                    if structure is not None and structure.player_index != unit.player_index and structure.health > 0:
+                        deal_damage(unit, structure, unit.self_destruct_damage_f)
+                    for other in mobile_grid[tx][ty]:
+                        if other.player_index != unit.player_index and other.health > 0:
+                            deal_damage(unit, other, unit.self_destruct_damage_i)
+            unit.health = 0
+
+        frame = 0
+        while mobiles and frame < self.max_frames:
+            frame += 1
+            if record_events:
+                events = {"breach": [], "damage": [], "death": []}
+                result.frame_events.append(events)
+
+            for support in supports:
+                if support.health <= 0:
+                    continue
+                for dx, dy, _ in self._offsets(support.shield_range):
+                    tx = support.x + dx
+                    ty = support.y + dy
+                    if tx < 0 or ty < 0 or tx >= size or ty >= size:
+                        continue
+                    for unit in mobile_grid[tx][ty]:
+                        if unit.player_index == support.player_index and support not in unit.shielded_by:
+                            unit.shielded_by.add(support)
+                            unit.health += support.shield_amount
+
+            for unit in mobiles:
+                if unit.health <= 0:
+                    continue
+                unit.move_timer -= 1
+                if unit.move_timer > 0:
+                    continue
+                unit.move_timer = unit.move_interval
+                step = finder.next_move((unit.x, unit.y), unit.move_direction, unit.target_edge)
+                if step is None:
+                    self_destruct(unit, frame)
+                    continue
+                (nx, ny), unit.move_direction = step
+                mobile_grid[unit.x][unit.y].remove(unit)
+                unit.x, unit.y = nx, ny
+                unit.steps += 1
+                if finder.is_on_edge((nx, ny), unit.target_edge):
+                    result.breaches.append([nx, ny, unit.unit_type, unit.player_index, frame])
+                    if events is not None:
+                        events["breach"].append([[nx, ny], unit.breach_damage, unit.type_index, None, unit.player_index + 1])
+                    result.health_lost[1 - unit.player_index] += unit.breach_damage
+                    result.survivors[unit.player_index] += 1
+                    unit.health = 0
+                else:
+                    mobile_grid[nx][ny].append(unit)
+
+            for attacker in structures:
+                if attacker.health > 0 and (attacker.damage_i > 0 or attacker.damage_f > 0):
+                    target = find_target(attacker)
+                    if target is not None:
+                        deal_damage(attacker, target, attacker.damage_f if target.stationary else attacker.damage_i)
+            for attacker in mobiles:
+                if attacker.health > 0:
+                    target = find_target(attacker)
+                    if target is not None:
+                        deal_damage(attacker, target, attacker.damage_f if target.stationary else attacker.damage_i)
+
+            alive = []
+            for unit in mobiles:
+                if unit.health > 0:
+                    alive.append(unit)
+                elif unit in mobile_grid[unit.x][unit.y]:
+                    mobile_grid[unit.x][unit.y].remove(unit)
+                    if events is not None:
+                        events["death"].append([[unit.x, unit.y], unit.type_index, None, unit.player_index + 1, False])
+            mobiles = alive
+            if any(structure.health <= 0 for structure in structures):
+                standing = []
+                for structure in structures:
+                    if structure.health > 0:
+                        standing.append(structure)
+                        continue
+                    result.destroyed_structures.append([structure.x, structure.y, structure.unit_type, structure.player_index, frame])
+                    if events is not None:
+                        events["death"].append([[structure.x, structure.y], structure.type_index, None, structure.player_index + 1, False])
+                    structure_grid[structure.x][structure.y] = None
+                    finder.set_blocked((structure.x, structure.y), False)
+                structures = standing
+                supports = [unit for unit in supports if unit.health > 0]
+
+        result.frames = frame
+        result.remaining = mobiles
+        result.structures = structures
+        return result
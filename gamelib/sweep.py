@@ -0,0 +1,372 @@
+"""
+Parameter sweeps over the declared parameters of a strategy, see parameters.py.
+
+Settings of the parameters come from a grid or are drawn at random, and each one is scored by an evaluator.
+MatchEvaluator plays LocalGame matches against opponent strategies. PositionEvaluator runs the strategy
+on recorded turn states and simulates the action phase its commands lead to. Settings are evaluated in
+rounds on worker processes. After min_rounds, a setting whose mean score is more than stop_margin below
+the best one is dropped, so clearly losing settings do not use up the sweep. Scores are cached in a JSON
+file by the strategy file's contents, the setting and the evaluation, so a sweep can be extended or resumed
+without repeating work:
+
+    python -m gamelib.sweep sunny-2.py --config game.replay.gz --opponents wpa.py --random 20 --rounds 4
+    python -m gamelib.sweep sunny-2.py --positions game.replay.gz --grid attack_interval finisher_min_mp
+
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .driver import CommandCapture
+from .game_state import GameState
+from .local_game import LocalGame, DEFAULT_MAX_TURNS, queue_commands
+from .mock_engine import load_config, read_positions
+from .simulator import ActionPhaseSimulator
+from .tournament import play_match, strategy_class, handle_message
+
+DEFAULT_MIN_ROUNDS = 2
+DEFAULT_STOP_MARGIN = 0.25
+DEFAULT_POSITIONS_PER_ROUND = 8
+STRUCTURE_DAMAGE_WEIGHT = 0.01
+
+
+def _file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def _key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def grid_settings(declared, names=None):
+    """Gets every combination of the grid values of some parameters
+
+    Args:
+        declared: The PARAMETERS dict of a strategy
+        names: The parameters to vary, all of them if None. The others keep their default
+
+    Returns:
+        A list of settings, dicts of parameter values
+
+    """
+    names = list(declared) if names is None else list(names)
+    grids = [declared[name].grid() for name in names]
+    return [dict(zip(names, values)) for values in itertools.product(*grids)]
+
+
+def random_settings(declared, count, seed=0, names=None):
+    """Draws random settings of some parameters, without repeats
+
+    Args:
+        declared: The PARAMETERS dict of a strategy
+        count: The number of settings wanted. Fewer are returned if there are not that many distinct ones
+        seed: Seeds the draws
+        names: The parameters to vary, all of them if None
+
+    Returns:
+        A list of settings, dicts of parameter values
+
+    """
+    names = list(declared) if names is None else list(names)
+    rng = random.Random(seed)
+    settings = {}
+    for _ in range(count * 20):
+        if len(settings) >= count:
+            break
+        setting = {name: declared[name].sample(rng) for name in names}
+        settings.setdefault(_key(setting), setting)
+    return list(settings.values())
+
+
+class MatchEvaluator:
+    """Scores a setting by the matches it wins against opponent strategies, 1 per win and 0.5 per draw.
+    Each round plays every opponent once from each side of the board.
+
+    Attributes :
+        * config (JSON): The game config
+        * opponents (list): The opponent strategy files. The tuned strategy file may be one of them, it then plays with its defaults
+        * max_turns (int): Matches are decided on health after this many turns
+
+    """
+    def __init__(self, config, opponents, max_turns=DEFAULT_MAX_TURNS):
+        self.config = config
+        self.opponents = list(opponents)
+        self.max_turns = max_turns
+
+    def key(self):
+        """Identifies the evaluation in the cache
+        """
+        return _key(["matches", hashlib.sha1(_key(self.config).encode()).hexdigest(),
+                     [_file_hash(path) for path in self.opponents], self.max_turns])
+
+    def tasks(self, round_index):
+        """Returns the matches of a round, as [opponent index, side, seed]
+        """
+        return [[opponent, side, round_index] for opponent in range(len(self.opponents)) for side in (0, 1)]
+
+    def evaluate(self, strategy, setting, task):
+        opponent, side, seed = task
+        strategies = [strategy, self.opponents[opponent]]
+        parameters = [setting, None]
+        if side:
+            strategies.reverse()
+            parameters.reverse()
+        match = play_match(strategies, self.config, self.max_turns, seed, parameters=parameters)
+        if match.winner is None:
+            return 0.5
+        return 1.0 if match.winner == side else 0.0
+
+
+class PositionEvaluator:
+    """Scores a setting by the damage of the attacks it plays from recorded turn states.
+    The strategy takes its turn on each position and the action phase of its commands is simulated, without enemy deploys.
+    A position scores the enemy health lost plus STRUCTURE_DAMAGE_WEIGHT per point of damage to enemy structures.
+
+    Attributes :
+        * config (JSON): The game config
+        * positions (list): The recorded turn states, as strings
+        * per_round (int): The positions evaluated each round. The sweep ends when they run out
+
+    """
+    def __init__(self, config, positions, per_round=DEFAULT_POSITIONS_PER_ROUND):
+        self.config = config
+        self.positions = list(positions)
+        self.per_round = per_round
+
+    @classmethod
+    def from_recordings(cls, paths, per_round=DEFAULT_POSITIONS_PER_ROUND):
+        """Reads the config and every turn state of some recordings
+        """
+        config, positions = read_positions(paths)
+        return cls(config, positions, per_round)
+
+    def key(self):
+        return _key(["positions", hashlib.sha1(_key([self.config, self.positions]).encode()).hexdigest()])
+
+    def tasks(self, round_index):
+        """Returns the indexes of the positions of a round
+        """
+        start = round_index * self.per_round
+        return list(range(start, min(start + self.per_round, len(self.positions))))
+
+    def evaluate(self, strategy, setting, task):
+        position = self.positions[task]
+        game = LocalGame(self.config)
+        algo = strategy_class(strategy)()
+        algo.set_parameters(setting)
+        capture = CommandCapture()
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            handle_message(algo, capture, game.config_message())
+            commands = (handle_message(algo, capture, position) + ["[]", "[]"])[:2]
+        game_state = GameState(self.config, position)
+        game_state.suppress_warnings(True)
+        queue_commands(game_state, *commands)
+        result = ActionPhaseSimulator(game_state).simulate()
+        return result.health_lost[1] + STRUCTURE_DAMAGE_WEIGHT * result.structure_damage[0]
+
+
+class SweepResult:
+    """The scores of one setting.
+
+    Attributes :
+        * setting (dict): The parameter values
+        * scores (list): The score of every evaluation, in order
+        * stopped_round (int): The round after which the setting was dropped as clearly losing, None if it was not
+
+    """
+    def __init__(self, setting):
+        self.setting = setting
+        self.scores = []
+        self.stopped_round = None
+
+    def mean(self):
+        return sum(self.scores) / len(self.scores) if self.scores else 0.0
+
+
+class SweepReport:
+    """The results of a sweep.
+
+    Attributes :
+        * results (list): A SweepResult for each setting
+        * rounds (int): The number of rounds run
+        * evaluations (int): The number of evaluations run
+        * cached (int): The number of evaluations read from the cache instead
+        * total_time (float): Seconds taken by the sweep
+
+    """
+    def __init__(self, settings):
+        self.results = [SweepResult(setting) for setting in settings]
+        self.rounds = 0
+        self.evaluations = 0
+        self.cached = 0
+        self.total_time = 0.0
+
+    def ranking(self):
+        """Returns the results from the highest mean score to the lowest, settings that ran to the end first
+        """
+        return sorted(self.results, key=lambda result: (result.stopped_round is None, result.mean()), reverse=True)
+
+    def best(self):
+        return self.ranking()[0] if self.results else None
+
+    def summary(self, top=10):
+        """Returns the report as readable lines of text
+        """
+        lines = ["{} settings, {} rounds, {} evaluations ({} cached) in {:.1f}s".format(
+            len(self.results), self.rounds, self.evaluations, self.cached, self.total_time)]
+        for result in self.ranking()[:top]:
+            stopped = "" if result.stopped_round is None else ", stopped after round {}".format(result.stopped_round)
+            lines.append("{:.3f} over {} evaluations{}: {}".format(result.mean(), len(result.scores), stopped, _key(result.setting)))
+        return lines
+
+
+_worker_state = {}
+
+
+def _init_worker(evaluator, strategy):
+    _worker_state["evaluator"] = evaluator
+    _worker_state["strategy"] = strategy
+
+
+def _evaluate(job):
+    setting, task = job
+    return _worker_state["evaluator"].evaluate(_worker_state["strategy"], setting, task)
+
+
+class ParameterSweep:
+    """Evaluates settings of a strategy's declared parameters, dropping clearly losing ones as it goes.
+
+    Attributes :
+        * strategy (string): The strategy file being tuned
+        * evaluator (MatchEvaluator or PositionEvaluator): Scores a setting on a task
+        * workers (int): The number of worker processes, 1 to evaluate in this process
+        * cache_path (string): The JSON file scores are cached in, None to not cache
+        * min_rounds (int): Settings are not dropped before this many rounds
+        * stop_margin (float): Settings whose mean score is more than this below the best are dropped
+
+    """
+    def __init__(self, strategy, evaluator, workers=None, cache_path=None, min_rounds=DEFAULT_MIN_ROUNDS, stop_margin=DEFAULT_STOP_MARGIN):
+        self.strategy = os.path.abspath(strategy)
+        self.evaluator = evaluator
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_path = cache_path
+        self.min_rounds = min_rounds
+        self.stop_margin = stop_margin
+
+    def declared(self):
+        """Returns the PARAMETERS dict of the strategy
+        """
+        return strategy_class(self.strategy).PARAMETERS
+
+    def _load_cache(self):
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path) as file:
+                return json.load(file)
+        return {}
+
+    def _save_cache(self, cache):
+        if self.cache_path:
+            temporary = self.cache_path + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump(cache, file)
+            os.replace(temporary, self.cache_path)
+
+    def run(self, settings, rounds=4):
+        """Evaluates settings for up to a number of rounds
+
+        Args:
+            settings: The settings to evaluate, from grid_settings or random_settings
+            rounds: The most rounds to run. Fewer are run if the evaluator runs out of tasks
+
+        Returns:
+            A SweepReport
+
+        """
+        report = SweepReport(settings)
+        cache = self._load_cache()
+        prefix = _key([_file_hash(self.strategy), self.evaluator.key()])
+        started = time.perf_counter()
+        executor = None
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.evaluator, self.strategy))
+        else:
+            _init_worker(self.evaluator, self.strategy)
+        try:
+            for round_index in range(rounds):
+                tasks = self.evaluator.tasks(round_index)
+                active = [result for result in report.results if result.stopped_round is None]
+                if not tasks or not active:
+                    break
+                jobs = []
+                for result in active:
+                    for task in tasks:
+                        key = _key([prefix, result.setting, task])
+                        if key in cache:
+                            result.scores.append(cache[key])
+                            report.cached += 1
+                        else:
+                            jobs.append((result, key, (result.setting, task)))
+                payloads = [payload for _, _, payload in jobs]
+                scores = executor.map(_evaluate, payloads) if executor else map(_evaluate, payloads)
+                for (result, key, _), score in zip(jobs, scores):
+                    result.scores.append(score)
+                    cache[key] = score
+                report.evaluations += len(jobs)
+                report.rounds = round_index + 1
+                self._save_cache(cache)
+                if report.rounds >= self.min_rounds:
+                    best = max(result.mean() for result in active)
+                    for result in active:
+                        if result.mean() < best - self.stop_margin:
+                            result.stopped_round = report.rounds
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        report.total_time = time.perf_counter() - started
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.sweep", description="Search for the best values of a strategy's declared parameters")
+    parser.add_argument("strategy", help="The strategy file, which declares PARAMETERS")
+    parser.add_argument("--config", help="Play matches with the config of this JSON file or recording")
+    parser.add_argument("--opponents", nargs="+", help="The opponents of the matches, the strategy with its defaults by default")
+    parser.add_argument("--turns", type=int, default=DEFAULT_MAX_TURNS, help="The number of turns of a match")
+    parser.add_argument("--positions", nargs="+", help="Evaluate on the turn states of these recordings instead of matches")
+    parser.add_argument("--grid", nargs="*", default=None, help="Try every combination of these parameters, all of them if none are named")
+    parser.add_argument("--random", type=int, default=None, help="Try this many random settings of all parameters")
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, all cores by default")
+    parser.add_argument("--cache", default="sweep-cache.json", help="The score cache file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if bool(args.config) == bool(args.positions):
+        parser.error("one of --config or --positions is required")
+
+    if args.positions:
+        evaluator = PositionEvaluator.from_recordings(args.positions)
+    else:
+        evaluator = MatchEvaluator(load_config(args.config), args.opponents or [args.strategy], args.turns)
+    sweep = ParameterSweep(args.strategy, evaluator, args.workers, args.cache)
+    declared = sweep.declared()
+    if not declared:
+        parser.error("{} does not declare any PARAMETERS".format(args.strategy))
+    if args.random:
+        settings = random_settings(declared, args.random, args.seed)
+    else:
+        settings = grid_settings(declared, args.grid or None)
+    for line in sweep.run(settings, args.rounds).summary():
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Per-turn timing telemetry of the hot paths of gamelib and of strategies.
+
+Functions are marked with the instrumented decorator, which leaves them untouched. Only while telemetry
+is enabled are the marked functions replaced by timing wrappers, so disabled telemetry costs nothing.
+Strategies can add spans of their own with span() and counters with count(), which only check a global
+while disabled.
+
+Enable it by setting the GAMELIB_TELEMETRY environment variable to a file path before the algo starts,
+or with enable(path). One JSON object is appended to the file per turn:
+
+    {"turn": 5, "on_turn": 0.412, "spans": {"find_path_to_edge": {"calls": 48, "time": 0.201}, ...}, "counters": {...}}
+
+The spans of a turn cover on_turn and the action frames that follow it. Span times include the time of nested spans.
+
+Setting GAMELIB_TRACE to a file path, or passing trace_path to enable, also writes every span as a Chrome
+trace event with its thread id. The file can be opened in Perfetto or chrome://tracing to see the timeline
+of message handling, on_turn, nested gamelib calls and background threads, and marks like deadline misses.
+"""
+import os
+import sys
+import json
+import time
+import threading
+import functools
+
+from .util import debug_write
+
+TELEMETRY_ENV = "GAMELIB_TELEMETRY"
+TRACE_ENV = "GAMELIB_TRACE"
+
+_active = None
+_marked = []
+_originals = []
+
+
+class TraceWriter:
+    """Writes Chrome trace events to a JSON array file, as they are flushed.
+
+    Attributes :
+        * path (string): The trace file
+        * events (list): Events not written yet
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._pid = os.getpid()
+        self._origin = time.perf_counter()
+        self._threads = set()
+        self._file = open(path, "w")
+        self._file.write("[")
+        self._separator = "\n"
+
+    def _timestamp(self, perf_time):
+        return round((perf_time - self._origin) * 1e6, 3)
+
+    def _thread(self):
+        thread = threading.current_thread()
+        if thread.ident not in self._threads:
+            self._threads.add(thread.ident)
+            self.events.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": thread.ident, "args": {"name": thread.name}})
+        return thread.ident
+
+    def complete(self, name, started, elapsed, category="gamelib"):
+        """Adds a span, started being a time.perf_counter value
+        """
+        self.events.append({"name": name, "cat": category, "ph": "X", "ts": self._timestamp(started),
+                            "dur": round(elapsed * 1e6, 3), "pid": self._pid, "tid": self._thread()})
+
+    def instant(self, name, args=None):
+        """Adds a mark at the current time
+        """
+        event = {"name": name, "ph": "i", "s": "t", "ts": self._timestamp(time.perf_counter()), "pid": self._pid, "tid": self._thread()}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def flush(self):
+        events, self.events = self.events, []
+        for event in events:
+            self._file.write(self._separator + json.dumps(event))
+            self._separator = ",\n"
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.write("\n]\n")
+        self._file.close()
+
+
+class Telemetry:
+    """Collects span times and counters, and writes them to a JSON-lines file once per turn.
+
+    Attributes :
+        * path (string): The file records are appended to, None to only write a trace
+        * trace (TraceWriter): Writes every span as a trace event, None if no trace is written
+        * spans (dict): [calls, seconds] of every span name since the last record
+        * counters (dict): The value of every counter since the last record
+        * turn_number (int): The turn being recorded, None before the first turn
+
+    """
+    def __init__(self, path=None, trace_path=None):
+        self.path = path
+        self.spans = {}
+        self.counters = {}
+        self.turn_number = None
+        self._turn_time = None
+        self._turn_started = None
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path else None
+        self.trace = TraceWriter(trace_path) if trace_path else None
+
+    def add_span(self, name, started, elapsed):
+        """Adds a finished span
+
+        Args:
+            name: The span name
+            started: When it started, a time.perf_counter value
+            elapsed: Seconds it took
+
+        """
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+            if self.trace is not None:
+                self.trace.complete(name, started, elapsed)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def mark(self, name, args=None):
+        """Marks a moment on the trace timeline, like a missed deadline, and counts it
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            if self.trace is not None:
+                self.trace.instant(name, args)
+
+    def begin_turn(self, turn_number):
+        """Writes the record of the previous turn and starts recording a new one
+        """
+        self.flush()
+        self.turn_number = turn_number
+        self._turn_started = time.perf_counter()
+
+    def end_turn(self):
+        """Marks the end of on_turn, the rest of the turn's record is the action phase
+        """
+        if self._turn_started is not None:
+            self._turn_time = time.perf_counter() - self._turn_started
+
+    def flush(self):
+        """Writes a record of what was collected since the last one, if anything was
+        """
+        with self._lock:
+            spans, self.spans = self.spans, {}
+            counters, self.counters = self.counters, {}
+            if self.trace is not None:
+                self.trace.flush()
+        if self._file is None or (self.turn_number is None and not spans and not counters):
+            return
+        record = {
+            "turn": self.turn_number,
+            "on_turn": None if self._turn_time is None else round(self._turn_time, 6),
+            "spans": {name: {"calls": calls, "time": round(elapsed, 6)} for name, (calls, elapsed) in spans.items()},
+            "counters": counters,
+        }
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._turn_time = None
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        if self.trace is not None:
+            self.trace.close()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.telemetry.add_span(self.name, self.started, time.perf_counter() - self.started)
+        return False
+
+
+def span(name):
+    """Times a block of code as a span while telemetry is enabled:
+
+        with gamelib.telemetry.span("plan_defense"):
+            ...
+
+    """
+    if _active is None:
+        return _NULL_SPAN
+    return _Span(_active, name)
+
+
+def count(name, amount=1):
+    """Adds to a counter while telemetry is enabled
+    """
+    if _active is not None:
+        _active.count(name, amount)
+
+
+def mark(name, args=None):
+    """Marks a moment on the trace timeline while telemetry is enabled
+    """
+    if _active is not None:
+        _active.mark(name, args)
+
+
+def traced(function, name=None):
+    """Wraps a function to be timed as a span if telemetry is enabled, for work handed to other threads.
+    Returns the function itself while disabled.
+    """
+    if _active is None:
+        return function
+    return _timed(function, name or getattr(function, "__name__", "task"))
+
+
+def instrumented(name):
+    """Marks a function or method to be timed as a span while telemetry is enabled. The function itself is not changed.
+    Module level functions are only timed where they are looked up through their module.
+    """
+    def mark(function):
+        _marked.append((function, name))
+        return function
+    return mark
+
+
+def _owner(function):
+    """Finds the class or module a marked function is an attribute of, and the attribute's name
+    """
+    owner = sys.modules[function.__module__]
+    *path, attribute = function.__qualname__.split(".")
+    for part in path:
+        owner = getattr(owner, part)
+    if attribute.startswith("__") and not attribute.endswith("__"):
+        attribute = "_{}{}".format(path[-1].lstrip("_"), attribute)
+    return owner, attribute
+
+
+def _timed(function, name):
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        telemetry = _active
+        if telemetry is None:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            telemetry.add_span(name, started, time.perf_counter() - started)
+    return timed
+
+
+def _instrument():
+    for function, name in _marked:
+        owner, attribute = _owner(function)
+        if owner.__dict__.get(attribute) is function:
+            setattr(owner, attribute, _timed(function, name))
+            _originals.append((owner, attribute, function))
+
+
+def _uninstrument():
+    while _originals:
+        owner, attribute, function = _originals.pop()
+        setattr(owner, attribute, function)
+
+
+def active():
+    """Returns the enabled Telemetry, or None
+    """
+    return _active
+
+
+def enable(path=None, trace_path=None):
+    """Starts recording telemetry, replacing any telemetry already enabled
+
+    Args:
+        path: The JSON-lines file of per-turn records, None to not write one
+        trace_path: The Chrome trace file, None to not write one
+
+    Returns:
+        The Telemetry, or None if a file could not be opened
+
+    """
+    global _active
+    disable()
+    try:
+        _active = Telemetry(path, trace_path)
+    except OSError as e:
+        debug_write("Could not write telemetry to {}: {}".format(path or trace_path, e))
+        return None
+    _instrument()
+    return _active
+
+
+def enable_from_environment():
+    """Enables telemetry if the GAMELIB_TELEMETRY or GAMELIB_TRACE environment variable is set
+    """
+    path = os.environ.get(TELEMETRY_ENV)
+    trace_path = os.environ.get(TRACE_ENV)
+    if (path or trace_path) and _active is None:
+        enable(path, trace_path)
+    return _active
+
+
+def disable():
+    """Writes the last record, closes the file and restores the instrumented functions
+    """
+    global _active
+    telemetry, _active = _active, None
+    _uninstrument()
+    if telemetry is not None:
+        telemetry.close()
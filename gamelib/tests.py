@@ -1,7 +1,52 @@
 import unittest
 import json
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import random
 from .game_state import GameState
 from .unit import GameUnit
+from .util import StdinTransport, send_turn
+from .algocore import AlgoCore, parse_turn_type, frame_is_settled, message_is_settled
+from .async_algocore import AsyncAlgoCore
+from .navigation import FieldPathFinder
+from .simulator import ActionPhaseSimulator
+from .validation import validate_messages
+from .replay import read_replay, INPUT, OUTPUT
+from .driver import ReplayDriver, percentile
+from .local_game import LocalGame
+from .mock_engine import MockEngine
+from .tournament import Tournament, play_match
+from .parameters import Parameter
+from .game_map import GameMap
+from . import telemetry
+from .profiler import TurnProfiler
+from .memory import MemoryMonitor
+from .benchmark import random_board, run_benchmarks, run_turn_benchmarks, results_document, compare, captured_boards
+from .cache import CacheRegistry, PER_TURN, PER_BOARD
+from . import cache
+from .fuzz import DifferentialFuzzer, CANDIDATES, reference_targets
+from .sweep import ParameterSweep, PositionEvaluator, grid_settings, random_settings
+from .budget import TurnBudget, TurnTimer, PlanningStages, parse_player_time, default_turn_limit
+try:
+    import numpy
+    from .batch_simulator import BatchSimulator
+    from .corpus import CorpusWriter, ReplayCorpus
+    from .query import CorpusQueryEngine, BreachQuery, LayoutQuery, AttackQuery
+    from . import workers
+except ImportError:
+    numpy = None
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+import asyncio
+
+def _slow_evaluation(board, seconds):
+    time.sleep(seconds)
+    return board.generation
+
 
 class BasicTests(unittest.TestCase):
 
@@ -240,6 +285,63 @@ class BasicTests(unittest.TestCase):
         self.assertEqual(1, len(game.game_map.get_locations_in_range([13,13], 0)), "We should be in 0 range of ourself")
         self.assertEqual(37, len(game.game_map.get_locations_in_range([13,13], 3.5)), "Wrong number of tiles in range")
 
+    def test_memoized_queries(self):
+        game = self.make_turn_0_map()
+        game.attempt_spawn("DF", [[13, 11]])
+        path = game.find_path_to_edge([13, 0])
+        self.assertEqual(path, game._shortest_path_finder.navigate_multiple_endpoints(
+            [13, 0], game.game_map.get_edge_locations(game.get_target_edge([13, 0])), game))
+        path.append([99, 99])
+        self.assertEqual(path[:-1], game.find_path_to_edge([13, 0]), "Changing a returned path should not change the memoized one")
+        self.assertIs(game.contains_stationary_unit([13, 11]), game.contains_stationary_unit([13, 11]))
+
+        version = game.game_map.version
+        game.game_map.add_unit("DF", [13, 14], 1)
+        self.assertGreater(game.game_map.version, version, "Adding a unit should change the map's version")
+        attackers = game.get_attackers([13, 12], 0)
+        self.assertEqual(1, len(attackers))
+        attackers.clear()
+        self.assertEqual(1, len(game.get_attackers([13, 12], 0)), "Changing returned attackers should not change the memoized ones")
+        game.game_map.add_unit("DF", [12, 14], 1)
+        self.assertEqual(2, len(game.get_attackers([13, 12], 0)), "Adding an attacker should be seen by get_attackers")
+
+        self.assertFalse(game.contains_stationary_unit([12, 11]))
+        game.attempt_spawn("FF", [[12, 11]])
+        self.assertTrue(game.contains_stationary_unit([12, 11]), "Spawning should be seen by contains_stationary_unit")
+        self.assertEqual([], game.get_attackers([13, 14], 1))
+        game.attempt_upgrade([[13, 11]])
+        self.assertEqual(1, len(game.get_attackers([13, 14], 1)), "Upgrading should be seen by get_attackers")
+
+    def test_bytes_round_trip(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 14], 1)
+        game.game_map[13, 14][0].upgrade()
+        game.game_map[13, 14][0].health = 12.25
+        game.game_map.add_unit("FF", [12, 14], 1)
+        game.game_map[12, 14][0].pending_removal = True
+        for health in (15, 15, 7.5, 15):
+            game.game_map.add_unit("PI", [13, 0], 0)
+            game.game_map[13, 0][-1].health = health
+        game.game_map.add_unit("EI", [13, 0], 0)
+        game.attempt_spawn("FF", [[13, 2]])
+        game.attempt_upgrade([[13, 2]])
+        game.attempt_spawn("SI", [[14, 0]], 2)
+
+        data = game.to_bytes()
+        decoded = GameState.from_bytes(game.config, data)
+        self.assertEqual(data, decoded.to_bytes())
+        for location in game.game_map:
+            self.assertEqual([unit.__dict__ for unit in game.game_map[location]], [unit.__dict__ for unit in decoded.game_map[location]],
+                             "The units at {} should be decoded as they were".format(location))
+        self.assertEqual((game._build_stack, game._deploy_stack), (decoded._build_stack, decoded._deploy_stack))
+        self.assertEqual((game.turn_number, game.my_health, game.enemy_health, game.my_time, game.enemy_time, game._player_resources),
+                         (decoded.turn_number, decoded.my_health, decoded.enemy_health, decoded.my_time, decoded.enemy_time, decoded._player_resources))
+        decoded.game_map[13, 0][0].cost[0] = 99
+        self.assertEqual(0, decoded.game_map[13, 0][1].cost[0], "Decoded units should not share attributes")
+        self.assertLess(len(data), len(game.serialized_string))
+        with self.assertRaises(ValueError):
+            GameState.from_bytes(game.config, b"JSON" + data)
+
     def _test_get_attackers(self):
         game = self.make_turn_0_map()
         
@@ -256,6 +358,504 @@ class BasicTests(unittest.TestCase):
         game.game_map.add_unit("DF", [14,14], 1)
         self.assertEqual(3, len(game.get_attackers([13,13], 0)), "We should be in danger from 3 places")
 
+    def test_field_path_finder(self):
+        game = self.make_turn_0_map()
+        for location in [[10, 12], [11, 12], [12, 12], [13, 12], [14, 12], [15, 12], [16, 12], [5, 10], [22, 13]]:
+            game.game_map.add_unit("FF", location, 0)
+        for location in [[13, 17], [14, 17], [15, 17], [12, 16], [3, 14], [24, 15]]:
+            game.game_map.add_unit("DF", location, 1)
+        finder = FieldPathFinder.from_game_state(game)
+        for start in [[13, 0], [14, 0], [3, 10], [24, 10], [13, 27], [0, 14], [13, 13]]:
+            self.assertEqual(game.find_path_to_edge(start), finder.get_path(start), "Paths from {} differ".format(start))
+
+    def test_simulate_action_phase(self):
+        game = self.make_turn_0_map()
+        result = ActionPhaseSimulator(game).simulate([("PI", 13, 0)] * 5)
+        self.assertEqual([5, 0], result.survivors, "Scouts should cross an empty board")
+        self.assertEqual(5, result.health_lost[1], "Every breach should cost the enemy health")
+
+        game.game_map.add_unit("DF", [13, 3], 1)
+        game.game_map[13, 3][0].upgrade()
+        result = ActionPhaseSimulator(game).simulate([("PI", 13, 0)] * 3)
+        self.assertEqual([0, 0], result.survivors, "An upgraded turret next to the spawn should stop 3 scouts")
+        self.assertEqual(45, result.mobile_damage[1], "The turret should have dealt all the scouts' health")
+
+    def test_simulate_self_destruct(self):
+        game = self.make_turn_0_map()
+        for x in range(28):
+            if game.game_map.in_arena_bounds([x, 14]):
+                game.game_map.add_unit("FF", [x, 14], 1)
+        result = ActionPhaseSimulator(game).simulate([("PI", 13, 0)])
+        self.assertEqual([[27, 13, "PI", 0, 28]], result.self_destructs, "A blocked scout should self destruct at the end of its path")
+        self.assertEqual(0, result.survivors[0])
+
+    @unittest.skipUnless(numpy, "BatchSimulator requires numpy")
+    def test_batch_simulation_matches_simulator(self):
+        game = self.make_turn_0_map()
+        game.game_map.add_unit("DF", [13, 3], 1)
+        for x in range(10, 18):
+            game.game_map.add_unit("FF", [x, 16], 1)
+        deploys = [[("PI", 13, 0)] * 3, [("PI", 13, 0)] * 8, [("EI", 14, 0)] * 2, []]
+        builds = [[], [("EF", 13, 2, 0)], [], []]
+        results = BatchSimulator(game).simulate(deploys, builds=builds)
+        for index, scenario in enumerate(deploys):
+            for unit_type, x, y, player_index in builds[index]:
+                game.game_map.add_unit(unit_type, [x, y], player_index)
+            expected = ActionPhaseSimulator(game).simulate(scenario)
+            for unit_type, x, y, player_index in builds[index]:
+                game.game_map.remove_unit([x, y])
+            outcome = results.outcome(index)
+            self.assertEqual(expected.frames, outcome["frames"], "Scenario {} should run as many frames".format(index))
+            self.assertEqual(expected.survivors, outcome["survivors"], "Scenario {} should breach the same".format(index))
+            for key in ("health_lost", "structure_damage", "mobile_damage"):
+                for got, want in zip(outcome[key], getattr(expected, key)):
+                    self.assertAlmostEqual(want, got, 6, "Scenario {} should have the same {}".format(index, key))
+
+    @unittest.skipUnless(numpy, "WorkerPool requires numpy")
+    def test_worker_pool(self):
+        game = self.make_turn_0_map()
+        for x in range(10, 18):
+            game.game_map.add_unit("DF", [x, 16], 1)
+        game.attempt_spawn("FF", [[13, 2]])
+        game.attempt_upgrade([[13, 2]])
+        game.game_map[13, 2][0].health = 70.5
+        starts = [[13, 0], [5, 8], [20, 6]]
+        attacks = [[("PI", 13, 0)] * 5, [("EI", 14, 0)] * 2]
+        with workers.WorkerPool(game.config, workers=1) as pool:
+            generation = pool.publish(game)
+            self.assertEqual([game.find_path_to_edge(start) for start in starts], pool.map(workers.path_to_edge, starts))
+            results = pool.map(workers.simulate, attacks)
+            for attack, result in zip(attacks, results):
+                self.assertEqual(ActionPhaseSimulator(game).simulate(attack).survivors, result.survivors)
+            placed = pool.submit(workers.simulate, attacks[1], None, [("FF", 14, 3, 0)]).result()
+            game.game_map.add_unit("FF", [14, 3], 0)
+            self.assertEqual(ActionPhaseSimulator(game).simulate(attacks[1]).frames, placed.frames, "Builds should be placed before simulating")
+            game.game_map.remove_unit([14, 3])
+
+            slow = [pool.submit(_slow_evaluation, 0.5), pool.submit(_slow_evaluation, 0)]
+            self.assertEqual([None, None], pool.gather(slow, timeout=0.05), "Results that are not ready in time should be the default")
+            self.assertEqual(2, pool.late)
+            self.assertEqual(generation + 1, pool.publish(game))
+
+        with workers.WorkerPool(game.config, workers=0) as pool:
+            pool.publish(game)
+            copy = pool.submit(lambda board: board.new_game_state()).result()
+            unit = copy.contains_stationary_unit([13, 2])
+            self.assertEqual((70.5, True), (unit.health, unit.upgraded), "Workers should see the published health and upgrades")
+            self.assertEqual(game.get_resource(game.SP), copy.get_resource(copy.SP))
+            shared = pool.submit(lambda board: (board.path_finder._neighbors, board.simulator._range_offsets)).result()
+            self.assertIs(pool._worker.path_finder._neighbors, shared[0], "Boards should reuse the worker's arena geometry")
+            self.assertIs(pool._worker.simulator._range_offsets, shared[1])
+            with self.assertRaises(workers.StaleBoardError):
+                pool._worker.evaluate(pool.generation - 1, _slow_evaluation, (0,))
+
+            with workers.WorkerPool(game.config, workers=0) as other:
+                other.publish(self.make_turn_0_map())
+                self.assertEqual(0, other.submit(lambda board: len(board.simulator._structures)).result())
+                self.assertEqual(9, pool.submit(lambda board: len(board.simulator._structures)).result(),
+                                 "Pools in the same process should each see their own board")
+            self.assertEqual(9, pool.submit(lambda board: len(board.simulator._structures)).result())
+        pool.close()
+
+    @unittest.skipUnless(numpy, "BatchSimulator requires numpy")
+    def test_batch_simulation_matches_simulator_with_builds(self):
+        config = self.make_turn_0_map().config
+        edges = [location for edge in GameMap(config).get_edges() for location in edge]
+        # Turrets built by different scenarios in front of the board's own, where attack order decides which interceptor dies
+        for seed in range(12, 20):
+            rng = random.Random(seed)
+            game = GameState(config, random_board(config, rng, structures=rng.randint(5, 40), mobile=0))
+            free = [location for location in GameMap(config) if not game.contains_stationary_unit(location) and location not in edges]
+            deploys, enemy_deploys, builds = [], [], []
+            for _ in range(4):
+                deploys.append([(rng.choice(["PI", "EI", "EI"]),) + tuple(rng.choice(edges[:28])) for _ in range(rng.randint(4, 12))])
+                enemy_deploys.append([(rng.choice(["PI", "EI", "SI"]),) + tuple(rng.choice(edges[28:])) for _ in range(rng.randint(0, 4))])
+                builds.append([(rng.choice(["DF", "DF", "FF"]), x, y, 1) for x, y in rng.sample([location for location in free if location[1] >= 12], rng.randint(1, 4))])
+            results = BatchSimulator(game).simulate(deploys, enemy_deploys, builds)
+            for index, scenario_builds in enumerate(builds):
+                for unit_type, x, y, player_index in scenario_builds:
+                    game.game_map.add_unit(unit_type, [x, y], player_index)
+                expected = ActionPhaseSimulator(game).simulate(deploys[index], enemy_deploys[index])
+                for unit_type, x, y, player_index in scenario_builds:
+                    game.game_map.remove_unit([x, y])
+                outcome = results.outcome(index)
+                self.assertEqual((expected.frames, expected.survivors), (outcome["frames"], outcome["survivors"]),
+                                 "Board {} scenario {} should run the same".format(seed, index))
+                for key in ("health_lost", "structure_damage", "mobile_damage"):
+                    for got, want in zip(outcome[key], getattr(expected, key)):
+                        self.assertAlmostEqual(want, got, 6, "Board {} scenario {} should have the same {}".format(seed, index, key))
+
+    def test_validate_simulator(self):
+        game = self.make_turn_0_map()
+        start = {"p1Units": [[], [], [], [[13, 0, 15, str(i)] for i in range(5)], [], [], [], []],
+                 "p2Units": [[], [], [[13, 3, 75, "t"]], [], [], [], [], []],
+                 "turnInfo": [1, 3, 0], "p1Stats": [30, 0, 0, 0], "p2Stats": [30, 0, 0, 0], "events": {}}
+        game.game_map.add_unit("DF", [13, 3], 1)
+        simulated = ActionPhaseSimulator(game).simulate([("PI", 13, 0)] * 5, record_events=True)
+        frames = [dict(start, turnInfo=[1, 3, frame], events=events) for frame, events in enumerate(simulated.frame_events, 1)]
+        messages = [json.dumps(game.config), json.dumps(start)] + [json.dumps(frame) for frame in frames]
+
+        report = validate_messages(messages + ['{"turnInfo": [0, 4, -1]}'])
+        self.assertEqual(1, report.phases)
+        self.assertEqual(0, report.diverged_frames, "A recording of the simulator should match it")
+        self.assertGreater(report.events["damage"].matched, 0)
+        self.assertEqual(report.breach_totals[0], report.breach_totals[1])
+
+        frames[-1]["events"]["breach"] = []
+        messages = messages[:2] + [json.dumps(frame) for frame in frames]
+        report = validate_messages(messages)
+        self.assertEqual(1, report.diverged_frames, "A missing breach should diverge")
+        self.assertEqual([[3, len(frames)]], report.first_divergence)
+        self.assertGreater(report.events["breach"].extra, 0)
+
+        # Two scouts pass an enemy turret. It deals 5 damage per frame to the first scout, which dies on frame 3, and
+        # then to the second until it leaves the range of 2.5. The scouts deal 2 damage each to the turret while it is
+        # within their range of 3.5. The survivor breaches after the 28 moves from [13, 0] to the top right edge.
+        scout_hits = {1: [13, 1], 2: [13, 2], 3: [14, 2], 4: [14, 3], 5: [15, 3]}
+        turret_hits = {1: 2, 2: 2, 3: 1, 4: 1, 5: 1, 6: 1}
+        events = {frame: {"damage": [[[14, 1], 2.0, 2, "t", 2]] * count} for frame, count in turret_hits.items()}
+        for frame, location in scout_hits.items():
+            events[frame]["damage"].append([location, 5.0, 3, "1" if frame <= 3 else "2", 1])
+        events[3]["death"] = [[[14, 2], 3, "1", 1, False]]
+        events[28] = {"breach": [[[26, 15], 1.0, 3, "2", 1]]}
+        start = {"p1Units": [[], [], [], [[13, 0, 15, "1"], [13, 0, 15, "2"]], [], [], [], []],
+                 "p2Units": [[], [], [[14, 1, 90, "t"]], [], [], [], [], []],
+                 "turnInfo": [1, 5, 0], "p1Stats": [30, 0, 0, 0], "p2Stats": [30, 0, 0, 0], "events": {}}
+        frames = [dict(start, turnInfo=[1, 5, frame], events=events.get(frame, {})) for frame in range(1, 29)]
+        report = validate_messages([json.dumps(game.config), json.dumps(start)] + [json.dumps(frame) for frame in frames])
+        self.assertEqual(0, report.diverged_frames, "The simulator should match the engine's events")
+        self.assertEqual((13, 1, 1), (report.events["damage"].matched, report.events["death"].matched, report.events["breach"].matched))
+        self.assertEqual([[1, 0], [1, 0]], report.breach_totals)
+
+        events[3]["death"] = []
+        events[4]["death"] = [[[14, 3], 3, "1", 1, False]]
+        frames = [dict(start, turnInfo=[1, 5, frame], events=events.get(frame, {})) for frame in range(1, 29)]
+        report = validate_messages([json.dumps(game.config), json.dumps(start)] + [json.dumps(frame) for frame in frames])
+        self.assertEqual([[5, 3]], report.first_divergence, "A death on another frame should diverge")
+
+    def test_local_game(self):
+        config = self.make_turn_0_map().config
+        game = LocalGame(config, max_turns=2)
+        starting_sp = game.resources[0]["SP"]
+        game.submit(0, '[["FF", 13, 13], ["FF", 0, 0]]', "[]")
+        game.submit(1, "[]", '[["PI", 13, 0], ["PI", 13, 0]]')
+        game.play_action_phase()
+        self.assertEqual([(13, 13)], list(game.structures), "The wall outside the arena should be dropped")
+        self.assertEqual(38, game.health[0], "Both of the enemy's scouts should breach")
+        self.assertEqual(starting_sp - 1 + 5, game.resources[0]["SP"], "The wall costs 1 SP and every turn gives 5")
+        self.assertEqual(starting_sp + 2 + 5, game.resources[1]["SP"], "Every point of damage to the enemy gives 1 SP")
+        enemy_view = json.loads(game.turn_message(1))
+        self.assertEqual([[14, 14, 75.0, game._ids[(13, 13)]]], enemy_view["p2Units"][0], "The enemy sees the board rotated")
+        self.assertEqual(38, enemy_view["p2Stats"][0])
+        breaches = [entry for frame in game.action_frames(1) for entry in json.loads(frame)["events"]["breach"]]
+        self.assertEqual(2, len(breaches))
+        self.assertTrue(all(entry[4] == 1 and entry[0][1] >= 14 for entry in breaches), "The enemy sees its own breaches at the top")
+        self.assertFalse(game.finished())
+
+    def test_async_turn_deadline(self):
+        make_turn_0_map = self.make_turn_0_map
+
+        class Slow(AsyncAlgoCore):
+            async def on_turn(self, game_state_string):
+                game_state = make_turn_0_map()
+                game_state.attempt_spawn("DF", [13, 6])
+                self.propose_plan(game_state)
+                game_state.attempt_spawn("DF", [14, 6])
+                await asyncio.sleep(10)
+
+        algo = Slow()
+        algo.turn_deadline = 0.01
+        output = io.StringIO()
+        with redirect_stdout(output):
+            asyncio.run(algo._play_turn("{}"))
+        self.assertEqual('[["DF", 13, 6]]\n[]\n', output.getvalue(), "The proposed plan was not submitted at the deadline")
+
+        class Quick(AsyncAlgoCore):
+            async def on_turn(self, game_state_string):
+                return make_turn_0_map()
+
+        algo = Quick()
+        algo.config = make_turn_0_map().config
+        self.assertEqual(default_turn_limit(algo.config), algo.get_turn_deadline(), "Without a turn budget the soft limit applies")
+        with redirect_stdout(io.StringIO()):
+            asyncio.run(algo._play_turn("{}"))
+
+    def test_mock_engine_game(self):
+        # Both players are sent the turn before either answer is read, as on the engine
+        script = "\n".join([
+            "import sys, json, time",
+            "for line in sys.stdin:",
+            "    if json.loads(line).get('turnInfo', [None])[0] == 0:",
+            "        time.sleep(0.3)",
+            "        print('[]')",
+            "        print('[]', flush=True)",
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name in ("first.py", "second.py"):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w") as file:
+                    file.write(script)
+            started = time.perf_counter()
+            reports = MockEngine(self.make_turn_0_map().config, turn_limit=0.5, hard_limit=2.0).run_game(paths[0], paths[1], max_turns=3)
+            elapsed = time.perf_counter() - started
+        self.assertLess(elapsed, 6 * 0.3, "The players' turns should overlap")
+        for report in reports:
+            self.assertEqual(3, len(report.commands))
+            self.assertEqual([], report.timeouts, "Waiting for the other player should not count against a player")
+            self.assertTrue(all(latency < 0.45 for latency in report.latencies["turn"]), report.latencies["turn"])
+
+    def test_tournament(self):
+        attacker = "\n".join([
+            "import gamelib",
+            "class AlgoStrategy(gamelib.AlgoCore):",
+            "    def on_turn(self, turn_state):",
+            "        game_state = gamelib.GameState(self.config, turn_state)",
+            "        game_state.attempt_spawn('PI', [13, 0], 100)",
+            "        game_state.submit_turn()",
+        ])
+        idle = attacker.replace("game_state.attempt_spawn('PI', [13, 0], 100)", "pass")
+        with tempfile.TemporaryDirectory() as directory:
+            paths = []
+            for name, script in (("attacker.py", attacker), ("idle.py", idle)):
+                paths.append(os.path.join(directory, name))
+                with open(paths[-1], "w") as file:
+                    file.write(script)
+            report = Tournament(paths, self.make_turn_0_map().config, max_turns=6, workers=1).run()
+        self.assertEqual(2, len(report.matches), "Each strategy should play from both sides")
+        self.assertEqual(paths, report.ranking())
+        self.assertEqual(1.0, report.records[paths[0]].win_rate(), "Scouts on an empty board should win every match")
+        self.assertTrue(all(match.health[match.strategies.index(paths[1])] < 40 for match in report.matches))
+        self.assertEqual(12, len(report.records[paths[1]].turn_times))
+
+        # Strategies keep state in module globals, which an algo playing its own file must not share
+        mirrored = "\n".join([
+            "import gamelib",
+            "SEATS = []",
+            "class AlgoStrategy(gamelib.AlgoCore):",
+            "    def on_game_start(self, config):",
+            "        self.config = config",
+            "        SEATS.append(self)",
+            "        assert len(SEATS) == 1, 'globals are shared'",
+            "    def on_turn(self, turn_state):",
+            "        gamelib.GameState(self.config, turn_state).submit_turn()",
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "mirrored.py")
+            with open(path, "w") as file:
+                file.write(mirrored)
+            match = play_match([path, path], self.make_turn_0_map().config, max_turns=2)
+        self.assertEqual([None, None], match.errors)
+
+    def test_parameters(self):
+        class Tuned(AlgoCore):
+            PARAMETERS = {"interval": Parameter(3, values=[2, 3]), "threshold": Parameter(0.7, low=0.5, high=0.9, steps=3)}
+
+        algo = Tuned()
+        self.assertEqual({"interval": 3, "threshold": 0.7}, algo.parameters, "Parameters should start at their defaults")
+        with redirect_stdout(io.StringIO()):
+            algo.set_parameters({"interval": 2, "unknown": 1})
+        self.assertEqual({"interval": 2, "threshold": 0.7}, algo.parameters, "Undeclared parameters should be ignored")
+        self.assertEqual(6, len(grid_settings(Tuned.PARAMETERS)))
+        self.assertEqual([0.5, 0.7, 0.9], [round(value, 6) for value in Tuned.PARAMETERS["threshold"].grid()])
+        settings = random_settings(Tuned.PARAMETERS, 4, names=["interval"])
+        self.assertEqual(2, len(settings), "Random settings should not repeat")
+
+    def test_sweep_stops_losing_settings(self):
+        script = "\n".join([
+            "import gamelib",
+            "class AlgoStrategy(gamelib.AlgoCore):",
+            "    PARAMETERS = {'scouts': gamelib.Parameter(0, values=[0, 2, 5])}",
+            "    def on_turn(self, turn_state):",
+            "        game_state = gamelib.GameState(self.config, turn_state)",
+            "        game_state.attempt_spawn('PI', [13, 0], self.parameters['scouts'])",
+            "        game_state.submit_turn()",
+        ])
+        game = self.make_turn_0_map()
+        position = json.dumps({"p1Units": [[]] * 8, "p2Units": [[]] * 8, "turnInfo": [0, 1, -1],
+                               "p1Stats": [30, 25, 5, 0], "p2Stats": [30, 25, 5, 0], "events": {}})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "tuned.py")
+            with open(path, "w") as file:
+                file.write(script)
+            evaluator = PositionEvaluator(game.config, [position] * 3, per_round=1)
+            sweep = ParameterSweep(path, evaluator, workers=1, cache_path=os.path.join(directory, "cache.json"), min_rounds=1, stop_margin=1)
+            settings = grid_settings(sweep.declared())
+            report = sweep.run(settings, rounds=3)
+            self.assertEqual({"scouts": 5}, report.best().setting)
+            self.assertEqual([5.0] * 3, report.best().scores, "Every scout should breach the empty board")
+            self.assertEqual([1, 1, None], [result.stopped_round for result in report.results], "Settings far behind should stop after the first round")
+            self.assertEqual(5, report.evaluations)
+            report = sweep.run(settings, rounds=3)
+            self.assertEqual((0, 5), (report.evaluations, report.cached), "A repeated sweep should be read from the cache")
+
+    def test_telemetry(self):
+        original = GameMap.get_locations_in_range
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "telemetry.jsonl")
+            telemetry.enable(path).begin_turn(3)
+            try:
+                game = self.make_turn_0_map()
+                game.game_map.get_locations_in_range([13, 13], 2)
+                game.game_map.get_locations_in_range([13, 13], 3)
+                with telemetry.span("plan"):
+                    telemetry.count("candidates", 5)
+            finally:
+                telemetry.disable()
+            with open(path) as file:
+                records = [json.loads(line) for line in file]
+        self.assertIs(original, GameMap.get_locations_in_range, "Disabling should restore the instrumented functions")
+        self.assertEqual(1, len(records))
+        self.assertEqual(3, records[0]["turn"])
+        self.assertEqual(2, records[0]["spans"]["get_locations_in_range"]["calls"])
+        self.assertEqual(1, records[0]["spans"]["parse_state"]["calls"], "Name mangled methods should be instrumented too")
+        self.assertIn("plan", records[0]["spans"])
+        self.assertEqual({"candidates": 5}, records[0]["counters"])
+
+    def test_benchmark(self):
+        config = self.make_turn_0_map().config
+        board = random_board(config, random.Random(1), structures=30, mobile=4)
+        game = GameState(config, board)
+        game.suppress_warnings(True)
+        for player_index, structures in ((0, range(0, 14)), (1, range(14, 28))):
+            locations = [[unit.x, unit.y] for x in range(28) for y in range(28) if game.game_map.in_arena_bounds([x, y])
+                         for unit in game.game_map[x, y] if unit.stationary and unit.player_index == player_index]
+            self.assertEqual(30, len(locations))
+            self.assertTrue(all(y in structures for _, y in locations), "Structures should be on their owner's half")
+            self.assertEqual(len(locations), len({tuple(location) for location in locations}))
+
+        results = run_benchmarks(config, {"board": board}, ["game_state", "submit_turn"], repeat=3, min_time=0.001)
+        self.assertEqual(["game_state[board]", "submit_turn[board]"], [result.name for result in results])
+        document = results_document(results)
+        self.assertGreater(document["results"]["game_state[board]"]["ops_per_sec"], 0)
+        self.assertEqual([], compare(results, document))
+        document["results"]["game_state[board]"]["median"] /= 2
+        self.assertEqual(["game_state[board]"], [name for name, _, _ in compare(results, document)])
+
+        # Two recordings of the same turns
+        positions = [json.dumps({"turnInfo": [0, turn, -1], "recording": recording}) for recording in range(2) for turn in range(4)]
+        boards = captured_boards(positions, 8)
+        self.assertEqual(8, len(boards), "Boards of different recordings with the same turn number should all be kept")
+        self.assertEqual(positions[4], boards["turn-0-4"])
+
+    def test_turn_benchmark(self):
+        hoarder = "\n".join([
+            "import gamelib",
+            "class AlgoStrategy(gamelib.AlgoCore):",
+            "    def on_turn(self, turn_state):",
+            "        gamelib.debug_write('planning')",
+            "        self.kept = [[x, x] for x in range(1000)]",
+            "        game_state = gamelib.GameState(self.config, turn_state)",
+            "        game_state.submit_turn()",
+        ])
+        game = self.make_turn_0_map()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hoarder.py")
+            with open(path, "w") as file:
+                file.write(hoarder)
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                results = run_turn_benchmarks([path], game.config, {"turn-0": game.serialized_string}, repeat=2)
+        self.assertEqual("", stdout.getvalue(), "The strategy's commands should be captured")
+        self.assertEqual(["hoarder.py[turn-0]"], [result.name for result in results])
+        self.assertEqual(2, len(results[0].samples))
+        self.assertGreater(results[0].retained_blocks, 1000, "The list kept by the algo should count as retained")
+        self.assertGreater(results[0].peak_bytes, 50000)
+
+    def test_differential_fuzz(self):
+        config = self.make_turn_0_map().config
+        report = DifferentialFuzzer(config, queries=4).run(boards=15, seed=3)
+        self.assertEqual([], report.failures, "\n".join(report.summary()))
+        self.assertEqual({"path": 60, "target": 60, "attackers": 60}, report.cases)
+
+        def misses_with_supports(game_state):
+            reference = reference_targets(game_state)
+            supported = any(unit.unit_type == "EF" for location in game_state.game_map for unit in game_state.game_map[location])
+            return lambda key: None if supported else reference(key)
+
+        fuzzer = DifferentialFuzzer(config, {"target": {"broken": misses_with_supports}}, queries=4, max_failures=1)
+        report = fuzzer.run(boards=20, seed=3)
+        self.assertEqual(1, len(report.failures))
+        failure = report.failures[0]
+        self.assertIn(1, [type_index for _, type_index, _ in failure.entries], "The support should survive shrinking")
+        self.assertLessEqual(len(failure.entries), 6, "Units not needed for the failure should be removed")
+        self.assertIsNone(failure.actual)
+        self.assertEqual(set(CANDIDATES), {"path", "target", "attackers"})
+
+    def test_cache_registry(self):
+        registry = CacheRegistry(budget=1000)
+        paths = registry.register("paths", lambda key, value: 300)
+        threats = registry.register("threats", lambda key, value: 300, policy=PER_TURN)
+        boards = registry.register("boards", lambda key, value: 10, policy=PER_BOARD)
+        self.assertIs(paths, registry.register("paths"), "Registering a name again should return the same cache")
+        paths.put("a", 1)
+        threats.put("b", 2)
+        paths.put("c", 3)
+        self.assertEqual(1, paths.get("a"), "Getting an entry should make it the most recently used")
+        threats.put("d", 4)
+        self.assertEqual(900, registry.size)
+        self.assertNotIn("b", threats, "The least recently used entry of any cache should make room")
+        self.assertEqual(1, threats.evictions)
+        self.assertEqual(2, paths.get_or_compute("x", lambda: 2), "Computed values should be stored")
+        self.assertEqual(2, paths.get_or_compute("x", lambda: 5))
+        self.assertLessEqual(registry.size, registry.budget)
+        self.assertNotIn("c", paths)
+
+        boards.set_board(1)
+        boards.put("e", 5)
+        boards.set_board(1)
+        self.assertIn("e", boards)
+        boards.set_board(2)
+        self.assertNotIn("e", boards, "Entries of another board should be dropped")
+        registry.begin_turn()
+        self.assertEqual(0, len(threats))
+        self.assertEqual(600, registry.size)
+        stats = registry.stats()["paths"]
+        self.assertEqual((2, 1), (stats["hits"], stats["misses"]))
+
+        # Precompute and executor threads use the caches while the main thread starts turns
+        shared = CacheRegistry(budget=5000)
+        caches = [shared.register("lru", lambda key, value: 100), shared.register("turn", lambda key, value: 100, policy=PER_TURN)]
+        errors = []
+
+        def use(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(20000):
+                    cache_ = rng.choice(caches)
+                    key = rng.randrange(200)
+                    if cache_.get(key) is None:
+                        cache_.put(key, key)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=use, args=(seed,)) for seed in range(3)]
+        # Switch threads often, so unguarded updates would interleave
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                shared.begin_turn()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual([], errors)
+        self.assertEqual(sum(100 * len(cache_) for cache_ in caches), shared.size, "Sizes should match the entries left")
+        self.assertEqual([100 * len(cache_) for cache_ in caches], [cache_.size for cache_ in caches])
+
+        class Idle(AlgoCore):
+            def on_game_start(self, config):
+                self.entries = len(cache.registry.caches["test_game"])
+
+        game_cache = cache.register("test_game")
+        game_cache.put("stale", 1)
+        algo = Idle()
+        algo._handle_message(json.dumps(self.make_turn_0_map().config).encode())
+        self.assertEqual(0, algo.entries, "Caches should be empty when a game starts")
+
     def test_print_unit(self):
         game = self.make_turn_0_map()
 
@@ -275,3 +875,294 @@ class BasicTests(unittest.TestCase):
         actual = game.project_future_MP(turns)
         self.assertAlmostEqual(actual, expected, 0, "Expected {} MP {} turns from now, got {}".format(expected, turns, actual))
 
+
+class TransportTests(unittest.TestCase):
+
+    def test_split_lines(self):
+        stream = io.BufferedReader(io.BytesIO(b'{"a":1}\n\n{"b":2}\n{"c":3}'))
+        transport = StdinTransport(stream, buffer_size=4)
+        self.assertEqual(b'{"a":1}', transport.read_line(), "First line was not split correctly")
+        self.assertEqual(b'', transport.read_line(), "Empty lines should be kept")
+        self.assertEqual(b'{"b":2}', transport.read_line(), "Lines spanning reads were not joined")
+        self.assertEqual(b'{"c":3}', transport.read_line(), "The last line has no newline but is still a message")
+        self.assertEqual(None, transport.read_line(), "Expected None at the end of the stream")
+
+    def test_turn_type(self):
+        self.assertEqual(0, parse_turn_type(b'{"turnInfo":[0,3,-1]}'))
+        self.assertEqual(1, parse_turn_type(b'{"p1Units":[], "turnInfo": [1, 3, 12]}'))
+        self.assertEqual(2, parse_turn_type(b'{"turnInfo":[2,40,0]}'))
+        self.assertEqual(None, parse_turn_type(b'{"replaySave":1}'))
+
+    def test_precompute_from_settled_frame(self):
+        empty = [[], [], [], [], [], [], []]
+        moving = [[], [], [], [[13, 0, 15.0, "1"]], [], [], []]
+        self.assertFalse(frame_is_settled({"p1Units": moving, "p2Units": empty, "events": {}}), "Mobile units are still moving")
+        self.assertFalse(frame_is_settled({"p1Units": empty, "p2Units": empty, "events": {"spawn": [[[13, 0], 3, "1", 1]]}}), "Units were just spawned")
+        frames = [
+            {"p1Units": moving, "p2Units": empty, "events": {}},
+            {"p1Units": empty, "p2Units": moving, "events": {"spawn": []}},
+            {"p1Units": empty, "p2Units": empty, "events": {"spawn": [[[13, 0], 3, "1", 1]]}},
+            {"p1Units": [[[3, 13, 60.0, "7"]], [], [], [], [], [[4, 12, 20.0, "8"]], []], "p2Units": empty, "events": {"spawn": []}},
+            {"p1Units": [[[3, 13, 60.0, "7"]], [], [[5, 5, 75.0, "9"]], [], [], [], []], "p2Units": empty, "events": {"spawn": []}},
+        ]
+        for frame in frames:
+            for separators in ((",", ":"), (", ", ": ")):
+                message = json.dumps(frame, separators=separators).encode()
+                self.assertEqual(frame_is_settled(frame), message_is_settled(message), message)
+
+        class Precomputing(AlgoCore):
+            def precompute_turn(self, game_state_string, precomputation):
+                precomputation.results["turn"] = precomputation.turn_number
+
+        algo = Precomputing()
+        algo.config = {}
+        algo._worker = ThreadPoolExecutor(max_workers=1)
+        algo._watch_message(json.dumps({"turnInfo": [1, 4, 20], "p1Units": moving, "p2Units": empty, "events": {}}).encode())
+        self.assertIsNone(algo._precomputation, "Precomputation started before the board settled")
+        algo._watch_message(json.dumps({"turnInfo": [1, 4, 21], "p1Units": empty, "p2Units": empty, "events": {}}).encode())
+        algo._worker.shutdown(wait=True)
+        algo._collect_precomputed()
+        self.assertEqual({"turn": 5}, algo.precomputed, "Precomputed results were not handed to the next turn")
+
+    def test_record_game(self):
+        messages = [b'{"replaySave":1}', b'{"turnInfo":[0,0,-1]}', b'{"turnInfo":[1,0,0]}', b'{"turnInfo":[2,1,0]}']
+        stdin = sys.stdin
+        sys.stdin = io.TextIOWrapper(io.BytesIO(b"\n".join(messages) + b"\n"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "game.replay.gz")
+            try:
+                with redirect_stdout(io.StringIO()):
+                    AlgoCore().start(record=path)
+            finally:
+                sys.stdin = stdin
+            records = [(kind, payload) for kind, _, payload in read_replay(path)]
+        expected = [(INPUT, messages[0]), (INPUT, messages[1]), (OUTPUT, b"[]"), (OUTPUT, b"[]"), (INPUT, messages[2]), (INPUT, messages[3])]
+        self.assertEqual(expected, records, "Every message and command should be recorded in order")
+
+    def test_replay_driver(self):
+        class Echo(AlgoCore):
+            def on_turn(self, game_state):
+                turn = json.loads(game_state)["turnInfo"][1]
+                print("strategies print to stdout too")
+                send_turn("[]", '[["PI", 13, 0, {}]]'.format(turn))
+
+        messages = [b'{"replaySave":1}', b'{"turnInfo":[0,0,-1]}', b'{"turnInfo":[1,0,0]}', b'{"turnInfo":[0,1,-1]}', b'{"turnInfo":[2,2,0]}']
+        recorded = [["[]", '[["PI", 13, 0, 0]]'], ["[]", "[]"]]
+        report = ReplayDriver(Echo()).run(messages, recorded)
+        self.assertEqual([["[]", '[["PI", 13, 0, 0]]'], ["[]", '[["PI", 13, 0, 1]]']], report.commands, "Printed text should not be taken for commands")
+        self.assertEqual((2, 1), (len(report.turn_times), len(report.frame_times)))
+        self.assertEqual([1], report.mismatched_turns, "Only the second turn differs from the recording")
+        self.assertEqual(2.5, percentile([4, 1, 3, 2], 50))
+
+    def test_chrome_trace(self):
+        class Traced(AlgoCore):
+            def on_turn(self, game_state):
+                worker = threading.Thread(target=telemetry.traced(lambda: None, "worker_task"), name="planner")
+                worker.start()
+                worker.join()
+                send_turn("[]", "[]")
+
+        algo = Traced()
+        algo.config = {}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.json")
+            telemetry.enable(trace_path=path)
+            try:
+                with redirect_stdout(io.StringIO()):
+                    algo._begin_turn(b'{"turnInfo":[0,2,-1]}')
+                    algo._handle_message(b'{"turnInfo":[0,2,-1]}')
+                    algo._end_turn()
+            finally:
+                telemetry.disable()
+            with open(path) as file:
+                events = json.load(file)
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+        threads = {event["args"]["name"]: event["tid"] for event in events if event["ph"] == "M"}
+        self.assertEqual(threads["planner"], spans["worker_task"]["tid"], "Work on other threads should keep its thread id")
+        self.assertNotEqual(spans["on_turn"]["tid"], spans["worker_task"]["tid"])
+        self.assertLessEqual(spans["on_turn"]["ts"], spans["worker_task"]["ts"], "The worker ran within on_turn")
+
+    def test_sampling_profiler(self):
+        def busy_planning():
+            finish = time.perf_counter() + 0.05
+            while time.perf_counter() < finish:
+                pass
+
+        class Busy(AlgoCore):
+            def on_turn(self, game_state):
+                busy_planning()
+                send_turn("[]", "[]")
+
+        algo = Busy()
+        algo.config = {}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "game.folded")
+            algo.profiler = TurnProfiler(path, interval=0.001)
+            with redirect_stdout(io.StringIO()):
+                for turn in range(2):
+                    algo._handle_message(json.dumps({"turnInfo": [0, turn, -1]}).encode())
+            algo.profiler.close()
+            with open(path) as file:
+                lines = file.read().splitlines()
+            os.remove(path)
+            algo.profiler.close()
+            self.assertFalse(os.path.exists(path), "Closing again, as at exit, should not write the stacks twice")
+        self.assertTrue(lines, "Busy turns should have been sampled")
+        stack, samples = lines[0].rsplit(" ", 1)
+        self.assertIn("on_turn", stack)
+        self.assertEqual("busy_planning", stack.split(";")[-1].split(" ")[0], "Most samples should be in the busy function")
+        self.assertGreater(int(samples), 10)
+
+    def test_memory_monitor(self):
+        class Hoarder(AlgoCore):
+            def __init__(self):
+                super().__init__()
+                self.scored_on_locations = []
+                self.settings = {"interval": 3}
+
+            def on_turn(self, game_state):
+                self.scored_on_locations.extend([x, 13] for x in range(2000))
+                send_turn("[]", "[]")
+
+        algo = Hoarder()
+        algo.config = {}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "memory.jsonl")
+            algo.memory_monitor = MemoryMonitor(path, growth_turns=3)
+            with redirect_stdout(io.StringIO()):
+                for turn in range(5):
+                    algo._handle_message(json.dumps({"turnInfo": [0, turn, -1]}).encode())
+                    algo._handle_message(json.dumps({"turnInfo": [1, turn, 0]}).encode())
+            algo.memory_monitor.close()
+            with open(path) as file:
+                reports = [json.loads(line) for line in file]
+        self.assertEqual(list(range(5)), [report["turn"] for report in reports])
+        self.assertGreater(reports[1]["on_turn_growth"], 100000)
+        self.assertGreaterEqual(reports[1]["peak"], reports[1]["current"])
+        self.assertTrue(any("tests.py:" in site["site"] for site in reports[1]["top"]))
+        self.assertEqual([], reports[2]["growing_attributes"])
+        self.assertEqual(["scored_on_locations"], [entry["attribute"] for entry in reports[3]["growing_attributes"]])
+
+    def test_mock_engine(self):
+        script = "\n".join([
+            "import sys, json, time",
+            "for line in sys.stdin:",
+            "    turn_info = json.loads(line).get('turnInfo', [None])",
+            "    if turn_info[0] == 0:",
+            "        time.sleep(0.25 if turn_info[1] == 1 else 0)",
+            "        print('[]')",
+            "        print('[[\"PI\", 13, 0, %d]]' % turn_info[1], flush=True)",
+        ])
+        messages = [b'{"replaySave":1}'] + [json.dumps({"turnInfo": [0, turn, -1]}).encode() for turn in range(3)] + [b'{"turnInfo":[2,3,0]}']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "strategy.py")
+            with open(path, "w") as file:
+                file.write(script)
+            report = MockEngine({}, turn_limit=0.2).run_replay(path, messages)
+        self.assertEqual([1], report.timeouts, "The slow turn should be over the limit")
+        self.assertEqual(["[]", '[["PI", 13, 0, 2]]'], report.commands[2], "The late commands should not be taken for the next turn's")
+        self.assertEqual(3, len(report.latencies["turn"]))
+        self.assertIsNone(report.crashed_turn)
+
+    @unittest.skipUnless(numpy, "The replay corpus requires numpy")
+    def test_replay_corpus(self):
+        units = [[], [], [[13, 3, 75.0, "7"]], [[13, 0, 15.0, "8"]], [], [], [], []]
+        messages = [b'{"replaySave":1}',
+                    json.dumps({"turnInfo": [0, 5, -1], "p1Stats": [30, 4, 5, 120], "p2Stats": [28, 1, 2, 90], "p1Units": units, "p2Units": units, "events": {}}).encode(),
+                    json.dumps({"turnInfo": [1, 5, 3], "p1Units": units, "p2Units": units,
+                                "events": {"breach": [[[13, 27], 1, 3, "8", 1]], "death": [[[13, 3], 2, "7", 2, False]]}}).encode(),
+                    b'{"turnInfo":[2,6,0]}']
+        with tempfile.TemporaryDirectory() as directory:
+            with CorpusWriter(directory) as writer:
+                writer.add_messages(messages, "first")
+                writer.add_messages(messages[:2], "second")
+            corpus = ReplayCorpus(directory)
+            self.assertEqual(["first", "second"], corpus.games)
+            self.assertEqual(3, len(corpus.states), "Every turn state and frame should have a row")
+            self.assertEqual([0, 2], corpus.turn_states().tolist())
+            self.assertEqual((5, 4.0, 120.0), (corpus.states[0]["turn"], corpus.states[0]["p1_sp"], corpus.states[0]["p1_time"]))
+            frame_units = corpus.state_units(1)
+            self.assertEqual([(0, 2, 13, 3), (0, 3, 13, 0), (1, 2, 13, 3), (1, 3, 13, 0)],
+                             list(zip(frame_units["player"].tolist(), frame_units["type"].tolist(), frame_units["x"].tolist(), frame_units["y"].tolist())))
+            breach = corpus.state_events(1, "breach")
+            self.assertEqual([(0, 13, 27, 8)], list(zip(breach["player"].tolist(), breach["x"].tolist(), breach["y"].tolist(), breach["id"].tolist())))
+            self.assertEqual(1, len(corpus.state_events(1, "death")))
+            del corpus, frame_units, breach
+
+            with CorpusWriter(directory) as writer:
+                writer.add_messages(messages, "third")
+            corpus = ReplayCorpus(directory)
+            self.assertEqual(["first", "second", "third"], corpus.games, "Games should be added to an existing corpus")
+            self.assertEqual([0, 2, 3], corpus.turn_states().tolist())
+            self.assertEqual(2, corpus.states[4]["game"])
+            self.assertEqual([(1,) + unit[1:] for unit in corpus.state_units(1).tolist()],
+                             [(1,) + unit[1:] for unit in corpus.state_units(4).tolist()],
+                             "Offsets of appended states should point at their own rows")
+            self.assertEqual([4] * 4, corpus.state_units(4)["state"].tolist())
+            del corpus
+
+    @unittest.skipUnless(numpy, "Corpus queries require numpy")
+    def test_corpus_queries(self):
+        def state(turn, frame, p2_units=None, events=None):
+            empty = [[] for _ in range(8)]
+            return json.dumps({"turnInfo": [0 if frame < 0 else 1, turn, frame], "p1Units": empty, "p2Units": p2_units or empty, "events": events or {}}).encode()
+
+        billert = [[], [], [[3, 15, 75, "1"], [4, 15, 75, "2"]], [], [], [], [], [[3, 15, 0, "1"], [4, 15, 0, "2"]]]
+        half = [[], [], [[3, 15, 75, "1"], [4, 15, 75, "2"]], [], [], [], [], [[3, 15, 0, "1"]]]
+        spawns = {"spawn": [[[14, 0], 3, str(i), 1] for i in range(10, 14)]}
+        scored = {"breach": [[[27, 13], 1, 3, "10", 1]]}
+        enemy_scored = {"breach": [[[13, 27], 1, 3, "50", 2]]}
+        games = [
+            [b'{"replaySave":1}', state(0, -1), state(1, -1, half), state(1, 0, events=spawns), state(1, 5, events=scored),
+             state(2, -1, billert), state(2, 4, events=enemy_scored)],
+            [b'{"replaySave":1}', state(0, -1), state(0, 3, events=enemy_scored), state(21, -1, billert), state(21, 2, events=enemy_scored)],
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            with CorpusWriter(directory) as writer:
+                for index, messages in enumerate(games):
+                    writer.add_messages(messages, "game{}".format(index))
+            engine = CorpusQueryEngine(directory, workers=2)
+            try:
+                self.assertEqual([("game0", 2), ("game1", 0), ("game1", 21)], engine.run(BreachQuery([13, 27])))
+                self.assertEqual([("game1", 21)], engine.run(BreachQuery([13, 27], min_turn=20)))
+                layout = LayoutQuery([(2, 3, 15, True), (2, 4, 15, True)])
+                self.assertEqual([("game0", 2), ("game1", 21)], engine.run(layout), "Only fully upgraded pairs of turrets should match")
+                self.assertEqual(engine.run(layout), engine.run(layout, parallel=True), "Parallel scans should give the same turns")
+                self.assertEqual([("game0", 1)], engine.run(AttackQuery([14, 0], unit_type=3, min_lost=0.5)))
+                self.assertEqual([], engine.run(AttackQuery([14, 0], min_lost=0.8)), "3 of 4 scouts lost is not more than 80%")
+            finally:
+                engine.close()
+                del engine
+
+            # Games appended to the corpus after the indexes were built are indexed again
+            with CorpusWriter(directory) as writer:
+                writer.add_messages(games[1], "game2")
+            engine = CorpusQueryEngine(directory, workers=1)
+            try:
+                self.assertEqual([("game1", 21), ("game2", 21)], engine.run(BreachQuery([13, 27], min_turn=20)))
+            finally:
+                engine.close()
+                del engine
+
+
+class BudgetTests(unittest.TestCase):
+
+    def test_overhead_from_reported_time(self):
+        self.assertEqual(1250.0, parse_player_time(b'{"p1Stats":[30.0,25.0,5.0,1250],"p2Stats":[30.0,25.0,5.0,0]}'))
+        timer = TurnTimer(5.0, safety_margin=0.5)
+        budget = timer.start_turn(0, started=100.0)
+        self.assertEqual(4.5, budget.limit, "Only the safety margin should be reserved on the first turn")
+        timer._last_duration = 1.0
+        budget = timer.start_turn(1500)
+        self.assertAlmostEqual(4.0, budget.limit, 5, "Half a second of overhead was reported but not reserved")
+
+    def test_stages_run_by_priority(self):
+        ran = []
+        stages = PlanningStages()
+        stages.register("attack", lambda state, budget: ran.append("attack") or 1, priority=1)
+        stages.register("defense", lambda state, budget: ran.append("defense") or 2, priority=5)
+        stages.register("search", lambda state, budget: ran.append("search") or 3, priority=0, min_time=10.0)
+        results = stages.run(None, TurnBudget(1.0))
+        self.assertEqual(["defense", "attack"], ran, "Stages ran in the wrong order")
+        self.assertEqual({"defense": 2, "attack": 1}, results, "A stage that did not fit in the budget ran")
+        self.assertEqual({}, stages.run(None, TurnBudget(0.0)), "Stages ran after the budget was spent")
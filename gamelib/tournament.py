@@ -0,0 +1,301 @@
+"""
+A headless tournament runner that plays strategy files against each other without the engine.
+
+Every pair of strategies plays a number of matches, once from each side of the board. A match is
+a LocalGame: commands are validated with the GameState rules, action phases are resolved by
+ActionPhaseSimulator and resources grow as project_future_MP predicts. Both algos run in the same
+process, their messages are handled as AlgoCore.start would and their commands are captured. Matches
+are spread over a pool of worker processes:
+
+    python -m gamelib.tournament --config game.replay.gz --rounds 4 wpa.py sunny-2.py every-3.py
+
+The report has each strategy's win rate, the results of each pairing and the time strategies took per turn.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .driver import load_strategy, CommandCapture, percentile, PERCENTILES
+from .local_game import LocalGame, DEFAULT_MAX_TURNS
+from .mock_engine import load_config
+from .util import set_recorder, flush_debug
+
+EMPTY_COMMAND = "[]"
+
+_strategies = {}
+
+
+def strategy_class(path, instance=0):
+    """Imports each strategy file once per worker process. Algos of the same file that play each other
+    are given different instances of it, so they don't share the module's globals
+    """
+    key = (os.path.abspath(path), instance)
+    if key not in _strategies:
+        _strategies[key] = load_strategy(key[0])
+    return _strategies[key]
+
+
+class MatchResult:
+    """The outcome of one match.
+
+    Attributes :
+        * strategies ([string, string]): The strategy files of player 0 and player 1
+        * winner (int): The index of the winning player, None for a draw
+        * health ([float, float]): Each player's health at the end
+        * turns (int): The number of turns played
+        * turn_times ([list, list]): The seconds each player took on each turn
+        * errors ([string, string]): The error that made a player forfeit, or None
+        * seed (int): The seed of the random module at the start of the match
+
+    """
+    def __init__(self, strategies, seed):
+        self.strategies = list(strategies)
+        self.seed = seed
+        self.winner = None
+        self.health = [0.0, 0.0]
+        self.turns = 0
+        self.turn_times = [[], []]
+        self.errors = [None, None]
+
+
+def handle_message(algo, capture, message):
+    """Handles a message with an algo, with its commands going to capture. Returns the new commands
+    """
+    set_recorder(capture)
+    sent = len(capture.commands)
+    try:
+        algo._handle_message(message.encode("utf-8"))
+        flush_debug()
+    finally:
+        set_recorder(None)
+    return capture.commands[sent:]
+
+
+def play_match(strategies, config, max_turns=DEFAULT_MAX_TURNS, seed=None, frames=True, parameters=None):
+    """Plays one match between two strategy files in this process
+
+    Args:
+        strategies: The strategy files of player 0 and player 1
+        config: The game config
+        max_turns: The match is decided on health after this many turns
+        seed: Seeds the random module before the algos are created
+        frames: Whether to send the algos the action frames, which strategies that track breaches need
+        parameters: The parameter values of player 0's and player 1's algos, see parameters.py
+
+    Returns:
+        A MatchResult
+
+    """
+    result = MatchResult(strategies, seed)
+    random.seed(seed)
+    game = LocalGame(config, max_turns)
+    captures = [CommandCapture(), CommandCapture()]
+    algos = [None, None]
+    sink = open(os.devnull, "w")
+    try:
+        with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+            for player_index, path in enumerate(strategies):
+                try:
+                    mirror = player_index == 1 and os.path.abspath(path) == os.path.abspath(strategies[0])
+                    algos[player_index] = strategy_class(path, 1 if mirror else 0)()
+                    if parameters and parameters[player_index]:
+                        algos[player_index].set_parameters(parameters[player_index])
+                    handle_message(algos[player_index], captures[player_index], game.config_message())
+                except Exception as e:
+                    result.errors[player_index] = "{}: {}".format(type(e).__name__, e)
+                    game.health[player_index] = 0
+            while not game.finished():
+                for player_index, algo in enumerate(algos):
+                    started = time.perf_counter()
+                    try:
+                        commands = handle_message(algo, captures[player_index], game.turn_message(player_index))
+                    except Exception as e:
+                        result.errors[player_index] = "Turn {} {}: {}".format(game.turn_number, type(e).__name__, e)
+                        game.health[player_index] = 0
+                        break
+                    elapsed = time.perf_counter() - started
+                    result.turn_times[player_index].append(elapsed)
+                    game.times[player_index] = int(elapsed * 1000)
+                    commands = (commands + [EMPTY_COMMAND, EMPTY_COMMAND])[:2]
+                    game.submit(player_index, *commands)
+                if game.finished():
+                    break
+                game.play_action_phase()
+                if frames:
+                    for player_index, algo in enumerate(algos):
+                        try:
+                            for frame in game.action_frames(player_index):
+                                handle_message(algo, captures[player_index], frame)
+                        except Exception as e:
+                            result.errors[player_index] = "Turn {} frame {}: {}".format(game.turn_number - 1, type(e).__name__, e)
+                            game.health[player_index] = 0
+    finally:
+        sink.close()
+    result.winner = game.winner()
+    result.health = list(game.health)
+    result.turns = game.turn_number
+    return result
+
+
+def _play_match(args):
+    return play_match(*args)
+
+
+class StrategyRecord:
+    """The results of one strategy across a tournament.
+
+    Attributes :
+        * wins (int): Matches won
+        * losses (int): Matches lost
+        * draws (int): Matches drawn
+        * turn_times (list): Seconds taken on every turn of every match
+        * errors (list): Errors that made the strategy forfeit a match
+
+    """
+    def __init__(self):
+        self.wins = 0
+        self.losses = 0
+        self.draws = 0
+        self.turn_times = []
+        self.errors = []
+
+    def matches(self):
+        return self.wins + self.losses + self.draws
+
+    def win_rate(self):
+        """Returns the share of matches won, counting draws as half a win
+        """
+        return (self.wins + 0.5 * self.draws) / self.matches() if self.matches() else 0.0
+
+
+class TournamentReport:
+    """The results of a tournament.
+
+    Attributes :
+        * records (dict): A StrategyRecord for each strategy file
+        * pairings (dict): [wins, losses, draws] of each (strategy, opponent) pair
+        * matches (list): Every MatchResult
+        * total_time (float): Seconds taken by the whole tournament
+
+    """
+    def __init__(self, strategies):
+        self.records = {strategy: StrategyRecord() for strategy in strategies}
+        self.pairings = {}
+        self.matches = []
+        self.total_time = 0.0
+
+    def add(self, match):
+        """Adds the result of a match
+        """
+        self.matches.append(match)
+        for player_index, strategy in enumerate(match.strategies):
+            opponent = match.strategies[1 - player_index]
+            record = self.records[strategy]
+            pairing = self.pairings.setdefault((strategy, opponent), [0, 0, 0])
+            if match.winner is None:
+                record.draws += 1
+                pairing[2] += 1
+            elif match.winner == player_index:
+                record.wins += 1
+                pairing[0] += 1
+            else:
+                record.losses += 1
+                pairing[1] += 1
+            record.turn_times.extend(match.turn_times[player_index])
+            if match.errors[player_index]:
+                record.errors.append(match.errors[player_index])
+
+    def ranking(self):
+        """Returns the strategy files from the highest win rate to the lowest
+        """
+        return sorted(self.records, key=lambda strategy: self.records[strategy].win_rate(), reverse=True)
+
+    def summary(self):
+        """Returns the report as readable lines of text
+        """
+        lines = ["Played {} matches in {:.1f}s".format(len(self.matches), self.total_time)]
+        for strategy in self.ranking():
+            record = self.records[strategy]
+            times = record.turn_times
+            lines.append("{}: {:.1%} win rate ({}-{}-{}), turn ms {}, max {:.1f}".format(
+                strategy, record.win_rate(), record.wins, record.losses, record.draws,
+                ", ".join("p{} {:.1f}".format(q, percentile(times, q) * 1000) for q in PERCENTILES),
+                max(times, default=0) * 1000))
+            for error in record.errors[:3]:
+                lines.append("  forfeited: " + error)
+        for (strategy, opponent), (wins, losses, draws) in sorted(self.pairings.items()):
+            lines.append("  {} vs {}: {}-{}-{}".format(strategy, opponent, wins, losses, draws))
+        return lines
+
+
+class Tournament:
+    """Plays every pair of strategies against each other, from both sides of the board.
+
+    Attributes :
+        * strategies (list): The strategy files
+        * config (JSON): The game config
+        * rounds (int): The number of matches each pair plays from each side
+        * max_turns (int): Matches are decided on health after this many turns
+        * workers (int): The number of worker processes, 1 to play in this process
+        * seed (int): Match i is seeded with seed + i
+
+    """
+    def __init__(self, strategies, config, rounds=1, max_turns=DEFAULT_MAX_TURNS, workers=None, seed=0):
+        self.strategies = list(strategies)
+        self.config = config
+        self.rounds = rounds
+        self.max_turns = max_turns
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+
+    def schedule(self):
+        """Returns the (player 0, player 1) strategy pairs of every match
+        """
+        return [pair for _ in range(self.rounds) for pair in itertools.permutations(self.strategies, 2)]
+
+    def run(self):
+        """Plays the tournament
+
+        Returns:
+            A TournamentReport
+
+        """
+        report = TournamentReport(self.strategies)
+        tasks = [(pair, self.config, self.max_turns, self.seed + index) for index, pair in enumerate(self.schedule())]
+        started = time.perf_counter()
+        if self.workers <= 1:
+            for match in map(_play_match, tasks):
+                report.add(match)
+        else:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks) or 1)) as executor:
+                for match in executor.map(_play_match, tasks):
+                    report.add(match)
+        report.total_time = time.perf_counter() - started
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m gamelib.tournament", description="Play strategies against each other without the engine")
+    parser.add_argument("strategies", nargs="+", help="The strategy files, like wpa.py")
+    parser.add_argument("--config", required=True, help="A JSON config file, or a recording that starts with the config")
+    parser.add_argument("--rounds", type=int, default=1, help="Matches each pair plays from each side")
+    parser.add_argument("--turns", type=int, default=DEFAULT_MAX_TURNS, help="The number of turns of a match")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, all cores by default")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if len(args.strategies) < 2:
+        parser.error("at least two strategies are needed")
+
+    tournament = Tournament(args.strategies, load_config(args.config), args.rounds, args.turns, args.workers, args.seed)
+    for line in tournament.run().summary():
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
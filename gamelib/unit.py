@@ -62,6 +62,9 @@ class GameUnit:
 
 
     def upgrade(self):
+        """Applies the upgrade stats of this unit's type. Call mark_changed on the GameMap holding the unit afterwards,
+        so that GameState queries memoized on the map's version see the upgraded unit
+        """
         from .game_state import UNIT_TYPE_TO_INDEX
         type_config = self.config["unitInformation"][UNIT_TYPE_TO_INDEX[self.unit_type]].get("upgrade", {})
         self.speed = type_config.get("speed", self.speed)
@@ -1,41 +1,228 @@
+import io
 import sys
+import atexit
+import queue
+import threading
 
 
 BANNER_TEXT = "---------------- Starting Your Algo --------------------"
 
+STDIN_BUFFER_SIZE = 1 << 20
+DEBUG_BUFFER_LIMIT = 1 << 16
+
+
+class StdinTransport:
+    """Reads newline terminated engine messages from a binary stream.
+
+    Engine messages can be hundreds of kilobytes long during the action phase, so instead of
+    decoding stdin line by line we pull large chunks from the binary stream and split them
+    into lines ourselves. Lines are kept as bytes and are only decoded when a caller asks for text.
+
+    Attributes :
+        * stream (binary file): The stream messages are read from, usually sys.stdin.buffer
+        * buffer_size (int): The maximum number of bytes requested from the stream per read
+
+    """
+    def __init__(self, stream, buffer_size=STDIN_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._read = getattr(stream, "read1", stream.read)
+        self._lines = []
+        self._next_line = 0
+        self._partial = b""
+        self._eof = False
+
+    def read_line(self):
+        """Gets the next line from the stream, blocking until one is available
+
+        Returns:
+            The line as bytes without its trailing newline, or None once the stream is closed
+
+        """
+        while self._next_line >= len(self._lines):
+            if self._eof:
+                return None
+            self._fill()
+        line = self._lines[self._next_line]
+        self._next_line += 1
+        return line
+
+    def _fill(self):
+        """Reads one chunk from the stream and splits it into complete lines
+        """
+        chunk = self._read(self.buffer_size)
+        if not chunk:
+            self._eof = True
+            # A final message without a trailing newline is still a message
+            self._lines = [self._partial] if self._partial else []
+            self._partial = b""
+        else:
+            lines = (self._partial + chunk).split(b"\n")
+            self._partial = lines.pop()
+            self._lines = lines
+        self._next_line = 0
+
+
+class StdinReader(threading.Thread):
+    """Background thread that drains stdin into a queue as soon as messages arrive.
+
+    The queue receives raw message bytes in order, followed by None once stdin is closed.
+
+    Attributes :
+        * messages (queue.Queue): The messages read so far that have not been consumed
+        * on_message (function): Optional callback run on the reader thread for every message before it is queued
+
+    """
+    def __init__(self, on_message=None):
+        super().__init__(name="gamelib-stdin-reader", daemon=True)
+        self.messages = queue.Queue()
+        self.on_message = on_message
+
+    def run(self):
+        # Read the raw file descriptor so this daemon thread never holds the lock of sys.stdin.buffer,
+        # which would abort the interpreter if it is still blocked in a read at exit
+        transport = StdinTransport(io.FileIO(sys.stdin.fileno(), "rb", closefd=False))
+        while True:
+            try:
+                message = transport.read_line()
+            except (EOFError, ValueError, OSError):
+                message = None
+            if message is not None and self.on_message is not None:
+                try:
+                    self.on_message(message)
+                except Exception as e:
+                    debug_write("Error while watching message: {}".format(e))
+            self.messages.put(message)
+            if message is None:
+                return
+
+    def get_message(self):
+        """Gets the next message read from stdin, blocking until one is available.
+        Exits the algo once stdin is closed, the same way get_command does.
+
+        """
+        message = self.messages.get()
+        if message is None:
+            _exit_on_eof()
+        return message
+
+
+_transport = None
+_recorder = None
+_debug_buffer = []
+_debug_buffer_size = 0
+_debug_lock = threading.Lock()
+
+
+def _get_transport():
+    global _transport
+    if _transport is None or _transport.stream is not getattr(sys.stdin, "buffer", None):
+        _transport = StdinTransport(sys.stdin.buffer)
+    return _transport
+
+def _exit_on_eof():
+    # Happens if parent game process dies, so exit for cleanup,
+    # Don't change or starter-algo process won't exit even though the game has closed
+    debug_write("Got EOF, parent game process must have died, exiting for cleanup")
+    flush_debug()
+    exit()
+
+def get_command_bytes():
+    """Gets the next engine message from stdin without decoding it
+
+    """
+    if not hasattr(sys.stdin, "buffer"):
+        # Text only stdin replacement, read it the slow way
+        return get_command().encode("utf-8")
+    try:
+        ret = _get_transport().read_line()
+    except EOFError:
+        ret = None
+    if ret is None:
+        # Game parent process terminated so exit
+        _exit_on_eof()
+    return ret
 
 def get_command():
     """Gets input from stdin
 
     """
+    if hasattr(sys.stdin, "buffer"):
+        return get_command_bytes().decode("utf-8")
     try:
         ret = sys.stdin.readline()
     except EOFError:
-        # Game parent process terminated so exit
-        debug_write("Got EOF, parent game process must have died, exiting for cleanup")
-        exit()
+        ret = ""
     if ret == "":
-        # Happens if parent game process dies, so exit for cleanup, 
-        # Don't change or starter-algo process won't exit even though the game has closed
-        debug_write("Got EOF, parent game process must have died, exiting for cleanup")
-        exit()
+        _exit_on_eof()
     return ret
 
+def set_recorder(recorder):
+    """Sets the ReplayRecorder that every command sent to the engine is recorded to, or None to stop recording
+    """
+    global _recorder
+    _recorder = recorder
+
 def send_command(cmd):
     """Sends your turn to standard output.
     Should usually only be called by 'GameState.submit_turn()'
 
     """
+    if _recorder is not None:
+        _recorder.record_output(cmd.strip())
     sys.stdout.write(cmd.strip() + "\n")
     sys.stdout.flush()
 
+def send_turn(build_cmd, deploy_cmd):
+    """Sends both lines of a turn to standard output with a single write and flush.
+
+    Args:
+        build_cmd: The build phase command string
+        deploy_cmd: The deploy phase command string
+
+    """
+    if _recorder is not None:
+        _recorder.record_output(build_cmd.strip())
+        _recorder.record_output(deploy_cmd.strip())
+    sys.stdout.write(build_cmd.strip() + "\n" + deploy_cmd.strip() + "\n")
+    sys.stdout.flush()
+
 def debug_write(*msg):
     """Prints a message to the games debug output
 
+    Messages are buffered and written out once per turn by flush_debug(),
+    or sooner if the buffer grows past DEBUG_BUFFER_LIMIT characters.
+
     Args:
         msg: The message to output
 
     """
+    _buffer_debug(", ".join(map(str, msg)).strip() + "\n")
+
+def _buffer_debug(line):
+    """Queues raw text for the debug output without any formatting
+    """
+    global _debug_buffer_size
+    with _debug_lock:
+        _debug_buffer.append(line)
+        _debug_buffer_size += len(line)
+        full = _debug_buffer_size >= DEBUG_BUFFER_LIMIT
+    if full:
+        flush_debug()
+
+def flush_debug():
+    """Writes all buffered debug output to stderr
+
+    """
+    global _debug_buffer_size
+    with _debug_lock:
+        if not _debug_buffer:
+            return
+        output = "".join(_debug_buffer)
+        del _debug_buffer[:]
+        _debug_buffer_size = 0
     #Printing to STDERR is okay and printed out by the game but doesn't effect turns.
-    sys.stderr.write(", ".join(map(str, msg)).strip() + "\n")
+    sys.stderr.write(output)
     sys.stderr.flush()
+
+atexit.register(flush_debug)
@@ -0,0 +1,255 @@
+"""
+Checks ActionPhaseSimulator against action phases recorded from the engine.
+
+A recording is the sequence of messages AlgoCore.start receives: the config, then turn states
+and action frames. For every action phase the board and deploys of its first frame are simulated,
+and the breach, damage and death events of each simulated frame are compared with the recorded frame
+of the same number. Run it on replay files or files with one message per line:
+
+    python -m gamelib.validation game.replay.gz
+
+"""
+import sys
+import json
+import time
+from collections import Counter
+
+from .game_state import GameState
+from .algocore import parse_turn_type, MOBILE_UNIT_INDICES
+from .simulator import ActionPhaseSimulator, DEFAULT_MAX_FRAMES
+from .replay import read_messages
+
+COMPARED_EVENTS = ("breach", "damage", "death")
+
+
+def _event_keys(kind, entries):
+    """The parts of events that are compared, the location and owner of the unit involved
+    """
+    if kind == "death":
+        return Counter((tuple(entry[0]), entry[3]) for entry in entries if not entry[4])
+    return Counter((tuple(entry[0]), entry[4]) for entry in entries)
+
+
+class EventDiff:
+    """How the events of one kind compare across the frames of a validation.
+
+    Attributes :
+        * matched (int): Events that were both recorded and simulated
+        * missing (int): Recorded events the simulation did not produce
+        * extra (int): Simulated events that were not recorded
+
+    """
+    def __init__(self):
+        self.matched = 0
+        self.missing = 0
+        self.extra = 0
+
+    def add(self, recorded, simulated):
+        """Compares the events of one frame, as Counters of event keys
+
+        Returns:
+            True if the frame's events match
+
+        """
+        matched = sum((recorded & simulated).values())
+        self.matched += matched
+        self.missing += sum(recorded.values()) - matched
+        self.extra += sum(simulated.values()) - matched
+        return recorded == simulated
+
+    def accuracy(self):
+        """Returns the share of events that matched, 1.0 if there were none
+        """
+        total = self.matched + self.missing + self.extra
+        return self.matched / total if total else 1.0
+
+
+class ValidationReport:
+    """The divergence and speed statistics of a validation run.
+
+    Attributes :
+        * phases (int): The number of action phases simulated
+        * frames (int): The number of frames compared
+        * diverged_frames (int): Frames where any compared event differed
+        * diverged_phases (int): Action phases where any frame diverged
+        * first_divergence (list): [turn_number, frame] of the first diverging frame of each diverged phase
+        * events (dict): An EventDiff for each compared event kind
+        * breach_totals ([[int, int], [int, int]]): Recorded and simulated breach counts, by player
+        * simulated_frames (int): The number of frames the simulator ran
+        * simulation_time (float): Seconds spent simulating
+
+    """
+    def __init__(self):
+        self.phases = 0
+        self.frames = 0
+        self.diverged_frames = 0
+        self.diverged_phases = 0
+        self.first_divergence = []
+        self.events = {kind: EventDiff() for kind in COMPARED_EVENTS}
+        self.breach_totals = [[0, 0], [0, 0]]
+        self.simulated_frames = 0
+        self.simulation_time = 0.0
+
+    def frames_per_second(self):
+        """Returns the number of frames simulated per second
+        """
+        return self.simulated_frames / self.simulation_time if self.simulation_time else 0.0
+
+    def summary(self):
+        """Returns the report as readable lines of text
+        """
+        lines = [
+            "Action phases: {}, diverged: {}".format(self.phases, self.diverged_phases),
+            "Frames compared: {}, diverged: {}".format(self.frames, self.diverged_frames),
+        ]
+        for kind, diff in self.events.items():
+            lines.append("{}: {} matched, {} missing, {} extra ({:.1%} accurate)".format(
+                kind, diff.matched, diff.missing, diff.extra, diff.accuracy()))
+        lines.append("Breaches recorded: {}, simulated: {}".format(self.breach_totals[0], self.breach_totals[1]))
+        lines.append("Simulated {} frames in {:.3f}s, {:.0f} frames/s".format(
+            self.simulated_frames, self.simulation_time, self.frames_per_second()))
+        return lines
+
+
+class SimulatorValidator:
+    """Replays recorded action phases through ActionPhaseSimulator and diffs the results per frame.
+
+    Attributes :
+        * config (JSON): The game config, read from the first message that contains one
+        * report (ValidationReport): The statistics gathered so far
+        * max_frames (int): Passed on to the simulator
+
+    """
+    def __init__(self, config=None, max_frames=DEFAULT_MAX_FRAMES):
+        self.config = config
+        self.max_frames = max_frames
+        self.report = ValidationReport()
+        self._phase = []
+
+    def feed(self, message):
+        """Handles the next recorded message
+
+        Args:
+            message: A message as it was received from the engine, as a string or bytes
+
+        """
+        if isinstance(message, bytes):
+            message = message.decode("utf-8")
+        message = message.strip()
+        if not message:
+            return
+        if "replaySave" in message:
+            self.config = json.loads(message)
+            return
+        turn_type = parse_turn_type(message.encode("utf-8"))
+        if turn_type == 1:
+            self._phase.append(json.loads(message))
+        else:
+            self.finish()
+
+    def finish(self):
+        """Compares the action phase collected so far, called when a non frame message ends it
+        """
+        if self._phase and self.config is not None:
+            self._validate_phase(self._phase)
+        self._phase = []
+
+    def _deploys(self, state):
+        """Gets both players' deploys from the first frame of an action phase, in the order they spawned
+        """
+        unit_info = self.config["unitInformation"]
+        deploys = [[], []]
+        spawns = state.get("events", {}).get("spawn", [])
+        if spawns:
+            for location, type_index, _, owner in spawns:
+                if type_index in MOBILE_UNIT_INDICES:
+                    deploys[owner - 1].append((unit_info[type_index]["shorthand"], location[0], location[1]))
+            return deploys
+        for player_index, key in enumerate(("p1Units", "p2Units")):
+            for type_index in MOBILE_UNIT_INDICES:
+                for x, y, *_ in state[key][type_index]:
+                    deploys[player_index].append((unit_info[type_index]["shorthand"], x, y))
+        return deploys
+
+    def _validate_phase(self, frames):
+        report = self.report
+        start = frames[0]
+        game_state = GameState(self.config, json.dumps(start))
+        deploys, enemy_deploys = self._deploys(start)
+        if not deploys and not enemy_deploys:
+            return
+
+        started = time.perf_counter()
+        result = ActionPhaseSimulator(game_state, self.max_frames).simulate(deploys, enemy_deploys, record_events=True)
+        report.simulation_time += time.perf_counter() - started
+        report.simulated_frames += result.frames
+        report.phases += 1
+
+        recorded = {state["turnInfo"][2]: state.get("events", {}) for state in frames}
+        last_frame = max(max(recorded), result.frames)
+        first_divergence = None
+        for frame in range(1, last_frame + 1):
+            recorded_events = recorded.get(frame, {})
+            simulated_events = result.frame_events[frame - 1] if frame <= result.frames else {}
+            breaches = {}
+            matches = True
+            for kind in COMPARED_EVENTS:
+                recorded_keys = _event_keys(kind, recorded_events.get(kind, []))
+                simulated_keys = _event_keys(kind, simulated_events.get(kind, []))
+                if kind == "breach":
+                    breaches = recorded_keys
+                elif kind == "death":
+                    # The engine may also report a death for units that scored, which the simulator does not
+                    recorded_keys -= breaches
+                matches = report.events[kind].add(recorded_keys, simulated_keys) and matches
+            report.frames += 1
+            if not matches:
+                report.diverged_frames += 1
+                if first_divergence is None:
+                    first_divergence = [start["turnInfo"][1], frame]
+        if first_divergence is not None:
+            report.diverged_phases += 1
+            report.first_divergence.append(first_divergence)
+
+        for state in frames:
+            for breach in state.get("events", {}).get("breach", []):
+                report.breach_totals[0][breach[4] - 1] += 1
+        report.breach_totals[1][0] += result.survivors[0]
+        report.breach_totals[1][1] += result.survivors[1]
+
+
+def validate_messages(messages, max_frames=DEFAULT_MAX_FRAMES):
+    """Validates the simulator against a sequence of recorded engine messages
+
+    Args:
+        messages: An iterable of messages as strings or bytes, starting with the config
+        max_frames: Passed on to the simulator
+
+    Returns:
+        A ValidationReport
+
+    """
+    validator = SimulatorValidator(max_frames=max_frames)
+    for message in messages:
+        validator.feed(message)
+    validator.finish()
+    return validator.report
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Usage: python -m gamelib.validation RECORDING [RECORDING ...]")
+        return 2
+    validator = SimulatorValidator()
+    for path in argv:
+        for message in read_messages(path):
+            validator.feed(message)
+        validator.finish()
+    for line in validator.report.summary():
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
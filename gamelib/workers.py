@@ -0,0 +1,412 @@
+"""
+A pool of worker processes kept for a whole game, for evaluating candidate plans in parallel.
+
+Starting processes and pickling the config every turn costs more than most evaluations save, so the pool
+is started once, in on_game_start, and each worker keeps the config and the arena geometry. Every turn the
+board is published into shared memory as arrays of structure types, owners, health and upgrades, which the
+workers read without it being pickled. Evaluations are then fanned out and gathered before a deadline:
+
+    def on_game_start(self, config):
+        self.config = config
+        self.pool = gamelib.workers.WorkerPool(config)
+
+    def on_turn(self, turn_state):
+        game_state = gamelib.GameState(self.config, turn_state)
+        self.pool.publish(game_state)
+        paths = self.pool.map(gamelib.workers.path_to_edge, starts, timeout=0.5)
+        results = self.pool.map(gamelib.workers.simulate, attacks, timeout=budget.remaining() - 0.2)
+
+An evaluation is any function defined at the top level of a module, taking a Board and its arguments.
+Results that are not ready by the timeout are given as a default, so a slow evaluation can't make
+the algo miss the turn. With workers=0, or on a single CPU by default, evaluations run in the algo's process.
+
+The algo is not forked, since it already runs threads like the one reading stdin. Workers are started fresh
+with forkserver, or spawn where it is not available, and import the strategy file to find its evaluations,
+so the algo must be started under if __name__ == "__main__": as the starter algos are.
+
+NumPy is required for this module.
+"""
+import os
+import json
+import atexit
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import telemetry
+from .game_state import GameState
+from .simulator import ActionPhaseSimulator
+from .unit import GameUnit
+from .util import debug_write
+
+NO_STRUCTURE = -1
+# generation, turn number, then health, SP, MP and time of each player
+HEADER_FIELDS = 10
+PUBLISHING = -1.0
+
+# The _Worker of a worker process
+_worker = None
+
+
+class StaleBoardError(Exception):
+    """Raised in a worker when an evaluation's board was replaced by a newer one before it ran
+    """
+
+
+class SharedBoard:
+    """The structures and stats of a board, in shared memory.
+
+    Attributes :
+        * size (int): The size of the arena
+        * memory (SharedMemory): The shared memory block
+        * header (ndarray): (10,) The generation, the turn number, and the health, SP, MP and time of both players
+        * health (ndarray): (size, size) float64 health of the structure at every location
+        * types (ndarray): (size, size) int8 unit type index of the structure at every location, -1 if there is none
+        * owners (ndarray): (size, size) int8 player index of the structure at every location
+        * upgraded (ndarray): (size, size) bool, whether the structure at every location is upgraded
+
+    """
+    def __init__(self, size, name=None):
+        self.size = size
+        cells = size * size
+        header_bytes = HEADER_FIELDS * 8
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=header_bytes + cells * 11)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        buffer = self.memory.buf
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.float64, buffer=buffer)
+        self.health = np.ndarray((size, size), dtype=np.float64, buffer=buffer, offset=header_bytes)
+        self.types = np.ndarray((size, size), dtype=np.int8, buffer=buffer, offset=header_bytes + cells * 8)
+        self.owners = np.ndarray((size, size), dtype=np.int8, buffer=buffer, offset=header_bytes + cells * 9)
+        self.upgraded = np.ndarray((size, size), dtype=np.bool_, buffer=buffer, offset=header_bytes + cells * 10)
+        if name is None:
+            self.header[:] = 0
+            self.types[:] = NO_STRUCTURE
+
+    @property
+    def generation(self):
+        return int(self.header[0])
+
+    def write(self, game_state, generation, type_indices):
+        """Writes the structures and stats of a game state. The generation is written last, readers
+        that see it change while they read know they read a partly written board
+
+        Args:
+            game_state: The GameState to publish, structures queued with attempt_spawn included
+            generation: The number identifying this board
+            type_indices: The unit type index of every shorthand
+
+        """
+        self.header[0] = PUBLISHING
+        self.types[:] = NO_STRUCTURE
+        self.owners[:] = 0
+        self.health[:] = 0
+        self.upgraded[:] = False
+        for location in game_state.game_map:
+            for unit in game_state.game_map[location]:
+                if unit.stationary:
+                    x, y = location
+                    self.types[x, y] = type_indices[unit.unit_type]
+                    self.owners[x, y] = unit.player_index
+                    self.health[x, y] = unit.health
+                    self.upgraded[x, y] = unit.upgraded
+        self.header[1] = game_state.turn_number
+        self.header[2:6] = [game_state.my_health, game_state.get_resource(game_state.SP, 0),
+                            game_state.get_resource(game_state.MP, 0), game_state.my_time]
+        self.header[6:10] = [game_state.enemy_health, game_state.get_resource(game_state.SP, 1),
+                             game_state.get_resource(game_state.MP, 1), game_state.enemy_time]
+        self.header[0] = generation
+
+    def close(self, unlink=False):
+        # The arrays hold exports of the buffer, which must be released before it is closed
+        self.header = self.health = self.types = self.owners = self.upgraded = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+class Board:
+    """A published board, as evaluations see it in a worker.
+
+    It is shared by every evaluation of the same board in a worker, so evaluations must not change
+    game_state. Evaluations that build or deploy should change new_game_state() instead.
+
+    Attributes :
+        * generation (int): The number identifying the board, it changes on every publish
+        * game_state (GameState): The board's game state, with no units queued
+        * path_finder (FieldPathFinder): A path finder for the board, its distance fields are shared between evaluations
+        * simulator (ActionPhaseSimulator): A simulator for the board, created when it is first used
+
+    """
+    def __init__(self, generation, game_state, worker):
+        self.generation = generation
+        self.game_state = game_state
+        self._worker = worker
+        self._path_finder = None
+        self._simulator = None
+
+    @property
+    def path_finder(self):
+        if self._path_finder is None:
+            finder = self._worker.path_finder.new_board()
+            for location in self.game_state.game_map:
+                if self.game_state.contains_stationary_unit(location):
+                    finder.blocked[location[0]][location[1]] = True
+            self._path_finder = finder
+        return self._path_finder
+
+    @property
+    def simulator(self):
+        if self._simulator is None:
+            self._simulator = self._worker.new_simulator(self.game_state)
+        return self._simulator
+
+    def new_game_state(self):
+        """Creates a copy of the board's game state that can be changed
+        """
+        return self._worker.read(self.generation)
+
+
+def _empty_state(config):
+    units = [[] for _ in config["unitInformation"]]
+    return json.dumps({"turnInfo": [0, 0, 0, 0], "p1Stats": [0, 0, 0, 0], "p2Stats": [0, 0, 0, 0],
+                       "p1Units": units, "p2Units": units})
+
+
+class _Worker:
+    """What a worker keeps for the whole game: the config, the arena geometry and simulation tables
+    that are the same on every board, the shared board and the last board read from it
+    """
+    def __init__(self, config, board):
+        self.config = config
+        self.board = board
+        self.shorthands = [unit.get("shorthand") for unit in config["unitInformation"]]
+        self.empty_state = _empty_state(config)
+        self.simulator = ActionPhaseSimulator(GameState(config, self.empty_state))
+        self.path_finder = self.simulator._finder
+        self.current = None
+
+    def new_simulator(self, game_state):
+        return ActionPhaseSimulator(game_state, template=self.simulator)
+
+    def read(self, generation):
+        """Reads the shared board into a new GameState
+
+        Raises:
+            StaleBoardError: If the board is not the given generation, or was replaced while it was read
+
+        """
+        board = self.board
+        if board.generation != generation:
+            raise StaleBoardError("Board {} was replaced by {}".format(generation, board.generation))
+        config = self.config
+        game_state = GameState(config, self.empty_state)
+        header = board.header
+        game_state.turn_number = int(header[1])
+        game_state.my_health, sp, mp, game_state.my_time = map(float, header[2:6])
+        game_state.enemy_health, enemy_sp, enemy_mp, game_state.enemy_time = map(float, header[6:10])
+        game_state._player_resources = [{'SP': sp, 'MP': mp}, {'SP': enemy_sp, 'MP': enemy_mp}]
+        xs, ys = np.nonzero(board.types >= 0)
+        for x, y, type_index, owner, health, upgraded in zip(xs.tolist(), ys.tolist(), board.types[xs, ys].tolist(),
+                                                             board.owners[xs, ys].tolist(), board.health[xs, ys].tolist(),
+                                                             board.upgraded[xs, ys].tolist()):
+            unit = GameUnit(self.shorthands[type_index], config, owner, None, x, y)
+            if upgraded:
+                unit.upgrade()
+            unit.health = health
+            game_state.game_map[x, y].append(unit)
+        game_state.game_map.mark_changed()
+        if board.generation != generation:
+            raise StaleBoardError("Board {} was replaced while it was read".format(generation))
+        return game_state
+
+    def evaluate(self, generation, fn, args):
+        current = self.current
+        if current is None or current.generation != generation:
+            current = self.current = Board(generation, self.read(generation), self)
+        return fn(current, *args)
+
+
+def _init_worker(config, memory_name, size):
+    global _worker
+    _worker = _Worker(config, SharedBoard(size, memory_name))
+
+
+def _evaluate(generation, fn, args):
+    return _worker.evaluate(generation, fn, args)
+
+
+def path_to_edge(board, start_location, target_edge=None):
+    """Gets the path from a location to an edge, see GameState.find_path_to_edge
+    """
+    return board.path_finder.get_path(start_location, target_edge)
+
+
+def simulate(board, deploys, enemy_deploys=None, builds=None):
+    """Simulates an action phase on the board
+
+    Args:
+        board: The Board
+        deploys: Your deploys as (unit_type, x, y) entries
+        enemy_deploys: Your opponent's deploys as (unit_type, x, y) entries
+        builds: Structures to add first as (unit_type, x, y, player_index) entries like BatchSimulator's, to score a placement
+
+    Returns:
+        The SimulationResult
+
+    """
+    if not builds:
+        return board.simulator.simulate(deploys, enemy_deploys)
+    game_state = board.new_game_state()
+    for unit_type, x, y, player_index in builds:
+        game_state.game_map.add_unit(unit_type, [x, y], player_index)
+    return ActionPhaseSimulator(game_state).simulate(deploys, enemy_deploys)
+
+
+class WorkerPool:
+    """Worker processes that evaluate functions of the published board.
+
+    Attributes :
+        * config (JSON): The game config, given to every worker when it starts
+        * workers (int): The number of worker processes, 0 to evaluate in this process
+        * generation (int): The number of the last published board
+        * late (int): Evaluations whose results were not ready by their timeout, over the whole game
+        * stale (int): Evaluations that ran after their board was replaced, over the whole game
+
+    """
+    def __init__(self, config, workers=None):
+        """Starts the workers
+
+        Args:
+            config: The game config
+            workers: The number of worker processes. One less than the number of CPUs by default
+
+        """
+        self.config = config
+        self.workers = max(0, (os.cpu_count() or 1) - 1) if workers is None else workers
+        self.generation = 0
+        self.late = 0
+        self.stale = 0
+        self._type_indices = {unit["shorthand"]: index for index, unit in enumerate(config["unitInformation"]) if "shorthand" in unit}
+        size = GameState(config, _empty_state(config)).ARENA_SIZE
+        self._board = SharedBoard(size)
+        self._executor = None
+        self._worker = None
+        if self.workers > 0:
+            # The algo already has threads, like the one reading stdin, so its process must not be forked
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                                 initargs=(config, self._board.memory.name, size))
+            try:
+                # Start every worker now rather than on the first turn
+                for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+                    future.result()
+            except BaseException:
+                self.close()
+                raise
+        else:
+            self._worker = _Worker(config, self._board)
+        atexit.register(self.close)
+
+    def publish(self, game_state):
+        """Publishes the board of a game state for the evaluations submitted after it. Evaluations of
+        earlier boards that have not run yet are abandoned
+
+        Args:
+            game_state: The GameState, structures queued with attempt_spawn and attempt_upgrade included
+
+        Returns:
+            The board's generation
+
+        """
+        self.generation += 1
+        self._board.write(game_state, self.generation, self._type_indices)
+        return self.generation
+
+    def submit(self, fn, *args):
+        """Evaluates fn(board, *args) on the published board
+
+        Returns:
+            A Future of the result
+
+        """
+        if self.generation == 0:
+            raise RuntimeError("No board was published")
+        if self._executor is not None:
+            return self._executor.submit(_evaluate, self.generation, fn, args)
+        future = Future()
+        try:
+            future.set_result(self._worker.evaluate(self.generation, fn, args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def gather(self, futures, timeout=None, default=None):
+        """Waits for the results of evaluations
+
+        Args:
+            futures: The futures returned by submit
+            timeout: The most seconds to wait, None to wait for every result
+            default: The result of evaluations that are not ready by the timeout or whose board was replaced
+
+        Returns:
+            A list of the results, in the order of futures. Exceptions raised by evaluations are raised again
+
+        """
+        if timeout is not None:
+            timeout = max(0.0, timeout)
+        done, pending = wait(futures, timeout)
+        for future in pending:
+            future.cancel()
+        if pending:
+            self.late += len(pending)
+            debug_write("{} of {} evaluations were not ready in {:.3f}s".format(len(pending), len(futures), timeout))
+            telemetry.mark("worker_results_late", {"late": len(pending), "submitted": len(futures)})
+        results = []
+        for future in futures:
+            if future not in done:
+                results.append(default)
+                continue
+            try:
+                results.append(future.result())
+            except StaleBoardError:
+                self.stale += 1
+                results.append(default)
+        return results
+
+    def map(self, fn, *iterables, timeout=None, default=None):
+        """Evaluates fn(board, *args) for the arguments taken from iterables, like the built in map
+
+        Args:
+            fn: A function defined at the top level of a module, taking the Board first
+            iterables: The arguments of the evaluations
+            timeout: The most seconds to wait for the results, None to wait for every result
+            default: The result of evaluations that are not ready by the timeout
+
+        Returns:
+            A list of the results
+
+        """
+        return self.gather([self.submit(fn, *args) for args in zip(*iterables)], timeout, default)
+
+    def close(self):
+        """Stops the workers and frees the shared memory. Called when the algo exits if it was not called before
+        """
+        atexit.unregister(self.close)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._worker = None
+        if self._board is not None:
+            self._board.close(unlink=True)
+            self._board = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
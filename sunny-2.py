@@ -23,6 +23,13 @@ Advanced strategy tips:
 """
 
 class AlgoStrategy(gamelib.AlgoCore):
+    PARAMETERS = {
+        "attack_interval": gamelib.Parameter(3, values=[2, 3, 4]),
+        "finisher_min_mp": gamelib.Parameter(3, low=2, high=5),
+        "finisher_punch_mp": gamelib.Parameter(8, low=6, high=10),
+        "upper_survival_threshold": gamelib.Parameter(0.7, low=0.5, high=0.9),
+    }
+
     def __init__(self):
         super().__init__()
         seed = random.randrange(maxsize)
@@ -84,7 +91,7 @@ class AlgoStrategy(gamelib.AlgoCore):
         """
         #START_ATTACK = 0
         
-        if game_state.turn_number % 3 == 0 and game_state.turn_number > 6:
+        if game_state.turn_number % self.parameters["attack_interval"] == 0 and game_state.turn_number > 6:
             ATTACK_STATUS = 1
         else:
             ATTACK_STATUS = 0
@@ -105,12 +112,12 @@ class AlgoStrategy(gamelib.AlgoCore):
                 else:
                     ATTACK_STATUS = 1
         
-        if enemy_health <= 10 and int(game_state.get_resource(MP)) > 3 and int(game_state.get_resource(MP)) < 8:
+        if enemy_health <= 10 and int(game_state.get_resource(MP)) > self.parameters["finisher_min_mp"] and int(game_state.get_resource(MP)) < self.parameters["finisher_punch_mp"]:
             for i in intial_queue:
                             game_state.attempt_remove(i[0])
             for j in priority_queue:
                             game_state.attempt_remove(j[0])
-        elif enemy_health <= 10 and int(game_state.get_resource(MP)) >= 8:
+        elif enemy_health <= 10 and int(game_state.get_resource(MP)) >= self.parameters["finisher_punch_mp"]:
             if not self.detect_corner(game_state, left_array):
                 self.finishing_punch(game_state, left_support)
                 game_state.attempt_spawn(SCOUT, [14, 0], 1000)
@@ -188,6 +195,8 @@ class AlgoStrategy(gamelib.AlgoCore):
                 gamelib.debug_write("Unit Lol", unit)
                 gamelib.debug_write("Upgrade Lmao", unit.upgrade())
                 bill = unit.unit_type == 'DF' and unit.upgrade()
+                # upgrade changes the unit in place, answer memoized queries like get_attackers again
+                game_state.game_map.mark_changed()
                 if not bill:
                     return False
         return True
@@ -412,7 +421,7 @@ class AlgoStrategy(gamelib.AlgoCore):
 
     def freq(self, units_deployed, units_survived):
         global START_ATTACK
-        upper_survival_threshold = 0.7
+        upper_survival_threshold = self.parameters["upper_survival_threshold"]
         percentage_survived = units_survived/units_deployed
         if percentage_survived >= upper_survival_threshold:
             return START_ATTACK + 2
@@ -188,6 +188,8 @@ class AlgoStrategy(gamelib.AlgoCore):
                 gamelib.debug_write("Unit Lol", unit)
                 gamelib.debug_write("Upgrade Lmao", unit.upgrade())
                 bill = unit.unit_type == 'DF' and unit.upgrade()
+                # upgrade changes the unit in place, answer memoized queries like get_attackers again
+                game_state.game_map.mark_changed()
                 if not bill:
                     return False
         return True